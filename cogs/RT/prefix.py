@@ -24,17 +24,19 @@ class PrefixDB(db.DBManager):
             await cursor.execute("INSERT INTO GuildPrefix VALUES (%s, %s)", (id_, prefix,))
 
         self.bot.guild_prefixes[id_] = prefix
+        self.bot.invalidate_prefixes()
 
     @db.command()
     async def set_user(self, cursor, id_: int, prefix: str) -> None:
         "ユーザープレフィックスを設定します。"
         if id_ in self.bot.user_prefixes:
-            await cursor.execute("UPDATE GuildPrefix SET Prefix=%s WHERE GuildID=%s",
+            await cursor.execute("UPDATE UserPrefix SET Prefix=%s WHERE UserID=%s",
                                  (prefix, id_,))
         else:
-            await cursor.execute("INSERT INTO GuildPrefix VALUES (%s, %s)", (id_, prefix,))
+            await cursor.execute("INSERT INTO UserPrefix VALUES (%s, %s)", (id_, prefix,))
 
         self.bot.user_prefixes[id_] = prefix
+        self.bot.invalidate_prefixes()
 
     async def manager_load(self, cursor) -> None:
         # テーブルの準備をし、データをメモリに保存しておく。
@@ -52,6 +54,7 @@ class PrefixDB(db.DBManager):
         )
         await cursor.execute("SELECT * FROM GuildPrefix")
         self.bot.guild_prefixes = dict(await cursor.fetchall())
+        self.bot.invalidate_prefixes()
 
 
 class CustomPrefix(commands.Cog):
@@ -1,13 +1,17 @@
 # Free RT - Logger
 
+from typing import Optional
+
 from discord.ext import commands, tasks
 import discord
 
 from traceback import TracebackException
+from time import perf_counter
 
-from collections import Counter
+from aiohttp import web
 
 from util import RT
+from util.command_metrics import Bucket, CommandMetrics
 
 
 ERROR_CHANNEL = 962977145716625439
@@ -16,27 +20,45 @@ ERROR_CHANNEL = 962977145716625439
 class SystemLog(commands.Cog):
     def __init__(self, bot: RT):
         self.bot = bot
-        self.names = []
-        self.zero_parents = []
-        self.authors = []
-        self.guilds = []
+        # コマンドの実行記録です。`bot.command_metrics`からもアクセスできます。
+        self.metrics = bot.command_metrics = CommandMetrics()
+        self.logged: Optional[int] = None
         self.errors = set()
+        self.runner: Optional[web.AppRunner] = None
         self.logging_loop.start()
 
-    def cog_unload(self):
+    async def cog_load(self):
+        # auth.jsonに`metrics`がある場合はPrometheus用に実行記録を公開する。
+        if (config := self.bot.secret.get("metrics")):
+            app = web.Application()
+            app.router.add_get("/metrics", self.export_metrics)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            await web.TCPSite(
+                self.runner, str(config.get("host", "127.0.0.1")), int(config.get("port", 9108))
+            ).start()
+
+    async def cog_unload(self):
         self.logging_loop.cancel()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def export_metrics(self, _: web.Request) -> web.Response:
+        return web.Response(
+            text=self.metrics.prometheus(), content_type="text/plain", charset="utf-8"
+        )
 
-    def _make_embed(self):
+    def _make_embed(self, bucket: Bucket):
         # コマンド実行記録のembedを作成する。
         # 使用回数が最大のものを取り出す。
-        name = Counter(self.names).most_common()[0]
-        zero_parent = Counter(self.zero_parents).most_common()[0]
-        author = Counter(self.authors).most_common()[0]
-        guild = Counter(self.guilds).most_common()[0]
+        name = bucket.commands.most_common(1)[0]
+        zero_parent = bucket.parents.most_common(1)[0]
+        author = bucket.users.most_common(1)[0]
+        guild = bucket.guilds.most_common(1)[0]
 
         e = discord.Embed(
             title="Free RT command log",
-            description=f"1分間で{len(self.names)}回のコマンド実行(以下、実行最多記録)",
+            description=f"1分間で{bucket.total}回のコマンド実行(以下、実行最多記録)",
             color=self.bot.Colors.unknown
         )
         e.add_field(name="コマンド", value=f"{name[0]}：{name[1]}回")
@@ -53,23 +75,36 @@ class SystemLog(commands.Cog):
 
     @tasks.loop(seconds=60)
     async def logging_loop(self):
-        if len(self.names) != 0:
+        # 一つ前の一分間の記録をまだ送っていないなら送る。
+        if (bucket := self.metrics.completed()) is not None and bucket.slot != self.logged:
+            self.logged = bucket.slot
             await self.bot.get_channel(961870556548984862) \
-                .send(embed=self._make_embed())
-            self.names = []
-            self.zero_parents = []
-            self.authors = []
-            self.guilds = []
+                .send(embed=self._make_embed(bucket))
 
-    @commands.Cog.listener()
-    async def on_command(self, ctx):
-        self.names.append(ctx.command.name)
-        self.zero_parents.append(
-            ctx.command.name if len(ctx.command.parents) == 0 
-            else ctx.command.parents[-1].name
+    def _record(self, ctx: commands.Context, error: bool) -> None:
+        # `on_command`からの実行時間を記録する。
+        if (started := getattr(ctx, "metrics_started", None)) is None:
+            return
+        ctx.metrics_started = None
+        self.metrics.record(
+            ctx.command.qualified_name,
+            ctx.command.name if len(ctx.command.parents) == 0
+            else ctx.command.parents[-1].name,
+            ctx.author.id, getattr(ctx.guild, "id", 0),
+            perf_counter() - started, error
         )
-        self.authors.append(ctx.author.id)
-        self.guilds.append(getattr(ctx.guild, "id", 0))
+
+    @commands.Cog.listener()
+    async def on_command(self, ctx: commands.Context):
+        ctx.metrics_started = perf_counter()
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx: commands.Context):
+        self._record(ctx, False)
+
+    @commands.Cog.listener("on_command_error")
+    async def record_error(self, ctx: commands.Context, _: Exception):
+        self._record(ctx, True)
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx: commands.Context, error: Exception):
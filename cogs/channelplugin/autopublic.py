@@ -3,6 +3,8 @@
 from discord.ext import commands
 from discord import ChannelType
 
+from util import route
+
 
 CHP_HELP = {
     "ja": ("メッセージ自動公開機能。",
@@ -34,7 +36,7 @@ class AutoPublic(commands.Cog):
                 lang, *CHP_HELP[lang]
             )
 
-    @commands.Cog.listener()
+    @route(dm=False, channel=lambda self, channel: "rf>autopublic" in (getattr(channel, "topic", None) or ""))
     async def on_message(self, message):
         if not hasattr(message.channel, "topic"):
             return
@@ -3,7 +3,7 @@
 from discord.ext import commands
 import discord
 
-from util import RT
+from util import RT, route
 
 from inspect import cleandoc
 from re import findall
@@ -92,7 +92,7 @@ class ChannelPluginGeneral(commands.Cog):
                     HELPS[command_name][lang][1]
                 )
 
-    @commands.Cog.listener()
+    @route(dm=False, channel=lambda self, channel: bool(getattr(channel, "topic", None)))
     async def on_message(self, message: discord.Message):
         if isinstance(message.channel, discord.Thread):
             return
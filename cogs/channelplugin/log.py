@@ -3,6 +3,8 @@
 from discord.ext import commands
 import discord
 
+from util import route
+
 from datetime import datetime
 from functools import wraps
 
@@ -33,11 +35,11 @@ def log(mode: str = "normal", force: bool = False):
                 guild = first_arg.guild
 
             if guild:
-                channel = discord.utils.find(
-                    lambda ch: (
-                        "log-rt" in ch.name
-                        or (ch.topic and "rf>log" in ch.topic)
-                    ), guild.text_channels
+                # 名前に`log-rt`があるかトピックに`rf>log`があるチャンネルで一番上のものを使う。
+                channel = min(
+                    self.bot.topics.get(guild, "log-rt")
+                    + self.bot.topics.get(guild, "rf>log"),
+                    key=lambda ch: ch.position, default=None
                 )
 
                 if channel or force:
@@ -75,7 +77,7 @@ class Log(commands.Cog):
                 lang, *CHP_HELP[lang]
             )
 
-    @commands.Cog.listener()
+    @route(dm=False)
     @log()
     async def on_message(self, message):
         if message.content and ((ever := "@everyone" in message.content) or "@here" in message.content):
@@ -6,7 +6,8 @@ from discord.ext import commands, tasks
 from discord import app_commands
 import discord
 
-from util import RT
+from util import RT, route
+from util.matcher import MatcherCache
 
 from datetime import datetime, timedelta
 from collections import defaultdict
@@ -67,6 +68,7 @@ class DataManager:
                         )
                         if i:
                             del self.cog.cache_plus[user_id]
+                            self.cog.matchers.invalidate(user_id)
                         else:
                             del self.cog.cache[user_id]
 
@@ -143,6 +145,7 @@ class UserData:
                     )
                 self.pluses[reason] = data
                 self.cog.plus_cache[self.user.id][reason] = data
+                self.cog.matchers.invalidate(self.user.id)
 
     async def delete_plus(self, data: PlusData) -> None:
         "AFKプラスを削除します。"
@@ -150,6 +153,7 @@ class UserData:
             if d == data:
                 del self.pluses[reason]
                 del self.cog.plus_cache[self.user.id][reason]
+                self.cog.matchers.invalidate(self.user.id)
                 async with self.pool.acquire() as conn:
                     async with conn.cursor() as cursor:
                         await cursor.execute(
@@ -170,6 +174,8 @@ class AFK(commands.Cog, DataManager):
         self.bot, self.before = bot, ""
         self.cache: Dict[int, str] = {}
         self.plus_cache: Dict[int, Dict[str, PlusData]] = defaultdict(dict)
+        # ユーザー毎のAFKプラスのワードフックです。
+        self.matchers = MatcherCache()
         super(commands.Cog, self).__init__(self)
         self.ready = Event()
         self.process_afk_plus.start()
@@ -435,9 +441,9 @@ class AFK(commands.Cog, DataManager):
             )
         await ctx.reply(embed=embed)
 
-    @commands.Cog.listener()
+    @route(bots=False, dm=False, prefixed=False)
     async def on_message(self, message: discord.Message):
-        if (message.content.startswith(tuple(await self.bot.command_prefix()))
+        if (self.bot.is_command(message)
                 or not message.guild or message.author.bot):
             return
 
@@ -459,11 +465,14 @@ class AFK(commands.Cog, DataManager):
 
         # AFKプラスのワードフックがメッセージにあるならAFKを設定する。
         if message.author.id in self.plus_cache:
-            for reason, data in self.plus_cache[message.author.id].items():
-                if data.get("word", "fdjasklfdsaj;fla") in message.content:
-                    await (await self.get(message.author)).set_afk(reason)
-                    await message.add_reaction(self.CHECK_EMOJI)
-                    break
+            datas = self.plus_cache[message.author.id]
+            if (word := self.matchers.get(message.author.id, lambda: (
+                data["word"] for data in datas.values() if "word" in data
+            )).search(message.content)) is not None:
+                await (await self.get(message.author)).set_afk(next(
+                    reason for reason, data in datas.items() if data.get("word") == word
+                ))
+                await message.add_reaction(self.CHECK_EMOJI)
 
     @tasks.loop(seconds=10)
     async def process_afk_plus(self):
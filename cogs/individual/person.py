@@ -14,7 +14,7 @@ import discord
 
 from bs4 import BeautifulSoup
 
-from util import RT, Table
+from util import RT, Table, route
 from data.headers import YAHOO_SEARCH_HEADERS
 
 
@@ -453,12 +453,13 @@ class Person(commands.Cog):
         --------
         ..."""
         self.ydata[ctx.guild.id].onoff = self.ydata[ctx.guild.id].to_dict().get("onoff", False)
+        self.bot.router.invalidate(ctx.guild.id)
         await ctx.reply("Ok")
 
     def is_yt_onoff(self, guild_id: int) -> bool:
         return self.ydata[guild_id].to_dict().get("onoff", True)
 
-    @commands.Cog.listener()
+    @route(bots=False, dm=False, guild=lambda self, guild_id: self.is_yt_onoff(guild_id))
     async def on_message(self, message):
         if not message.guild or message.author.bot or not self.is_yt_onoff(message.guild.id) \
                 or message.content in ("あとは", "とは", "あとは？"):
@@ -2,14 +2,16 @@
 
 from typing import TYPE_CHECKING
 
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import app_commands
 import discord
 
 from util import RT
 
 from datetime import datetime
+from hashlib import sha1
 from asyncio import Event
+from time import time
 
 if TYPE_CHECKING:
     from aiomysql import Pool
@@ -17,6 +19,32 @@ if TYPE_CHECKING:
 TABLES = ("schedule", "schedule_test")
 
 
+def _timestamp(day: str, time_: str):
+    # 日付と時間の文字列をUNIX時間にする。形式が違う場合はNoneを返す。
+    try:
+        return datetime.strptime(day + time_, "%Y/%m/%d%H:%M").timestamp()
+    except ValueError:
+        return None
+
+
+def _keys(userid: int, title: str) -> tuple[str, str]:
+    # 予定の開始と終了のスケジューラーのキーを作る。
+    digest = sha1(title.encode()).hexdigest()
+    return f"schedule_start:{userid}:{digest}", f"schedule_end:{userid}:{digest}"
+
+
+def _jobs(userid: int, title: str, data: dict) -> list[tuple[float, str, list]]:
+    # 予定の開始時の通知と終了時の削除のスケジューラーの予約を作る。
+    start_key, end_key = _keys(userid, title)
+    jobs = []
+    if data['dmnotice'] == "on" and (start := _timestamp(data['day'], data['stime'])) \
+            and start > time():
+        jobs.append((start, start_key, [userid, title]))
+    if (end := _timestamp(data['day'], data['etime'])):
+        jobs.append((end, end_key, [userid, title]))
+    return jobs
+
+
 class DataManager:
     def __init__(self, cog: "schedule"):
         self.cog = cog
@@ -42,20 +70,28 @@ class DataManager:
                             self.cog.cache[row[0]] = dict()
                             self.cog.cache[row[0]][row[1]] = {
                                 'UserID': row[0], 'body': row[1], 'stime': row[2], 'etime': row[3], 'day': row[4], 'dmnotice': row[5]}
+        # スケジューラーを使う前に設定されたものも予約しておく。
+        if not await self.cog.bot.scheduler.migrated("schedule"):
+            await self.cog.bot.scheduler.migrate("schedule", (
+                job for userid, datas in list(self.cog.cache.items())
+                for title, data in datas.items()
+                for job in _jobs(userid, title, data)
+            ))
         self.cog.ready.set()
 
 
 class schedule(commands.Cog, DataManager): 
 
     def __init__(self, bot: RT): 
-        self.bot, self.before = bot, ""
+        self.bot = bot
         self.cache = dict()
         super(commands.Cog, self).__init__(self)
         self.ready = Event()
         self.pool: "Pool" = self.bot.mysql.pool
-        self.process_notice.start()
 
     async def cog_load(self):
+        self.bot.scheduler.register("schedule_start", self.notice)
+        self.bot.scheduler.register("schedule_end", self.end)
         await self._prepare_table()
 
     @commands.hybrid_group(
@@ -196,37 +232,30 @@ class schedule(commands.Cog, DataManager):
         else:
             await ctx.reply("Ok")
 
-    @tasks.loop(seconds=10)
-    async def process_notice(self):
+    async def _schedule(self, userid: int, title: str, data: dict) -> None:
+        # 予定の開始時の通知と終了時の削除をスケジューラーに予約する。
+        for when, key, payload in _jobs(userid, title, data):
+            await self.bot.scheduler.at(when, key, payload)
+
+    async def notice(self, payload: list):
+        # スケジューラーから呼ばれて予定の開始を通知する。
+        userid, title = payload
+        if title in self.cache.get(userid, {}) and (user := self.bot.get_user(userid)):
+            await user.send("予定のお時間です\n予定:" + title)
+
+    async def end(self, payload: list):
+        # スケジューラーから呼ばれて終わった予定を削除する。
         try:
-            await self.ready.wait()
-            now = datetime.now()
-            now = now.strftime("%Y/%m/%d%H:%M")
-
-            if self.before != now:
-                self.before = now
-
-                for user_id, datas in list(self.cache.items()):
-                    for title, data in datas.items():
-                        if data['day'] + data['stime'] == now:
-                            if (user := self.bot.get_user(user_id)):
-                                if data['dmnotice'] == "on":
-                                    await user.send("予定のお時間です\n予定:" + title)
-                            else:
-                                # もしユーザーが見つからなかったのならそのデータを削除する。
-                                await self.delete(user_id)
-                        if data['day'] + data['etime'] == now:
-                            try:
-                                await self.delete_schedule(user_id, title)
-                            except AssertionError:
-                                len('test')
-        except Exception:
-            datetime.now()
+            await self.delete_schedule(*payload)
+        except (AssertionError, KeyError):
+            ...
 
     async def delete_schedule(self, userid, data) -> None:
         for title, d in self.cache[userid].items():
             if title == data:
                 del self.cache[userid][title]
+                for key in _keys(userid, title):
+                    await self.bot.scheduler.cancel(key)
                 async with self.pool.acquire() as conn:
                     async with conn.cursor() as cursor:
                         await cursor.execute(
@@ -299,9 +328,12 @@ class schedule(commands.Cog, DataManager):
                     f"INSERT INTO {TABLES[0]} VALUES (%s, %s, %s, %s, %s, %s);",
                     (userid, title, start, end, day, notice)
                 )
+        if title:
+            await self._schedule(userid, title, self.cog.cache[userid][title])
 
     def cog_unload(self):
-        self.process_notice.cancel()
+        self.bot.scheduler.unregister("schedule_start")
+        self.bot.scheduler.unregister("schedule_end")
 
 
 async def setup(bot):
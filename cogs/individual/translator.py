@@ -7,7 +7,7 @@ from jishaku.functools import executor_function
 from asyncio import sleep
 import deep_translator
 
-from util import RT
+from util import RT, route
 
 
 CHP_HELP = {
@@ -148,7 +148,9 @@ class Translator(commands.Cog):
         except deep_translator.exceptions.LanguageNotSupportedException:
             await ctx.reply("その言語は対応していません。")
 
-    @commands.Cog.listener()
+    @route(dm=False, channel=lambda self, channel: any(
+        word in (getattr(channel, "topic", None) or "") for word in ("rf>tran", "rf>翻訳", "rf>ほんやく")
+    ))
     async def on_message(self, message: discord.Message):
         if isinstance(message.channel, discord.Thread):
             return
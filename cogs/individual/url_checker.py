@@ -6,7 +6,7 @@ from discord.ext import commands
 from discord import app_commands
 import discord
 
-from util import securl, DatabaseManager
+from util import securl, DatabaseManager, route
 
 from re import findall
 from urllib.parse import urlparse
@@ -35,6 +35,7 @@ class DataManager(DatabaseManager):
         for row in await cursor.fetchall():
             if row:
                 self.cache.append(row[0])
+        self.bot.router.invalidate()
 
     async def onoff(self, guild_id: int, cursor: "Cursor" = None) -> bool:
         "SecURLリアクションのON/OFFを行う。"
@@ -44,6 +45,7 @@ class DataManager(DatabaseManager):
                 (guild_id,)
             )
             self.cache.remove(guild_id)
+            self.bot.router.invalidate(guild_id)
             return False
         else:
             await cursor.execute(
@@ -51,6 +53,7 @@ class DataManager(DatabaseManager):
                 (guild_id,)
             )
             self.cache.append(guild_id)
+            self.bot.router.invalidate(guild_id)
             return True
 
 
@@ -188,7 +191,7 @@ class UrlChecker(commands.Cog, DataManager):
 
     EMOJI = "<:search:876360747440017439>"
 
-    @commands.Cog.listener()
+    @route(own=False, dm=False, guild=lambda self, guild_id: guild_id in self.cache)
     async def on_message(self, message: discord.Message):
         if (not message.guild or message.author.id == self.bot.user.id
                 or message.guild.id not in self.cache):
@@ -197,7 +200,7 @@ class UrlChecker(commands.Cog, DataManager):
         if (("http://" in message.content or "https://" in message.content)
             and "https://discord.com" not in message.content
             and message.channel.id not in self.channel_runnings
-                and not message.content.startswith(tuple(self.bot.command_prefix))):
+                and not self.bot.is_command(message)):
             try:
                 await message.add_reaction(self.EMOJI)
             except discord.NotFound:
@@ -9,7 +9,7 @@ from collections import defaultdict
 from re import findall
 from time import time
 
-from util import RT
+from util import RT, route
 
 
 class TokenRemover(commands.Cog):
@@ -28,7 +28,7 @@ class TokenRemover(commands.Cog):
             r"[N]([a-zA-Z0-9]{23})\.([a-zA-Z0-9]{6})\.([a-zA-Z0-9]{27})", content
         ))
 
-    @commands.Cog.listener()
+    @route(own=False, dm=False)
     async def on_message(self, message: discord.Message):
         if not message.guild or message.author.id == self.bot.user.id:
             return
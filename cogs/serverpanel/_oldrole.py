@@ -5,6 +5,8 @@ from typing import Callable, Coroutine, Optional, Dict
 from discord.ext import commands, tasks
 import discord
 
+from util import reaction_interest
+
 from emoji import EMOJI_DATA as UNICODE_EMOJI_ENGLISH
 from asyncio import create_task
 
@@ -212,6 +214,7 @@ class OldRolePanel(commands.Cog):
         )
 
     @commands.Cog.listener()
+    @reaction_interest(bot_author=True, dm=False)
     async def on_full_reaction_add(self, payload: discord.RawReactionActionEvent):
         if self.bot.is_ready() and hasattr(payload, "message"):
             if self.check(payload) and not payload.member.bot:
@@ -229,6 +232,7 @@ class OldRolePanel(commands.Cog):
                     await payload.message.remove_reaction(emoji, payload.member)
 
     @commands.Cog.listener()
+    @reaction_interest(bot_author=True, dm=False)
     async def on_full_reaction_remove(self, payload: discord.RawReactionActionEvent):
         if str(payload.emoji) != "🛠":
             await self.on_full_reaction_add(payload)
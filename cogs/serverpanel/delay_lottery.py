@@ -1,9 +1,9 @@
 # Free RT - Delay Lottery
 
-from discord.ext import commands, tasks
+from discord.ext import commands
 import discord
 
-from util import RT
+from util import RT, reaction_interest
 from util.mysql_manager import DatabaseManager
 from time import time
 
@@ -48,9 +48,7 @@ class DataManager(DatabaseManager):
         }
         if await cursor.exists(self.DB, target):
             await cursor.delete(self.DB, target)
-
-    async def delete_guild(self, cursor, guild_id: int) -> None:
-        await cursor.delete(self.DB, {"GuildID": guild_id})
+        await self.bot.scheduler.cancel(f"delay_lottery:{channel_id}:{message_id}")
 
     async def reads(self, cursor) -> dict:
         data = {}
@@ -75,7 +73,14 @@ class DelayLottery(commands.Cog, DataManager):
     async def cog_load(self):
         super(commands.Cog, self).__init__(self.bot.mysql)
         await self.init_table()
-        self.lottery_worker.start()
+        self.bot.scheduler.register("delay_lottery", self.draw)
+        # スケジューラーを使う前に作られたものも予約しておく。
+        if not await self.bot.scheduler.migrated("delay_lottery"):
+            await self.bot.scheduler.migrate("delay_lottery", (
+                (date, f"delay_lottery:{channel_id}:{message_id}", [guild_id, channel_id, message_id])
+                for guild_id, rows in (await self.reads()).items()
+                for date, channel_id, message_id in rows
+            ))
 
     @commands.command(
         aliases=["dl", "期限抽選"], extras={
@@ -158,9 +163,13 @@ class DelayLottery(commands.Cog, DataManager):
         )
         try:
             await self.write(
-                mes.guild.id, int(time() + 60 * minutes),
+                mes.guild.id, (date := int(time() + 60 * minutes)),
                 mes.channel.id, mes.id
             )
+            await self.bot.scheduler.at(
+                date, f"delay_lottery:{mes.channel.id}:{mes.id}",
+                [mes.guild.id, mes.channel.id, mes.id]
+            )
         except OverflowError:
             await ctx.reply(
                 {"ja": "数が大きすぎてオーバーフローしました。",
@@ -171,33 +180,25 @@ class DelayLottery(commands.Cog, DataManager):
             for emoji in self.EMOJIS.values():
                 await mes.add_reaction(emoji)
 
-    @tasks.loop(seconds=31)
-    async def lottery_worker(self):
-        now = time()
-        for guild_id, rows in (await self.reads()).items():
-            guild = self.bot.get_guild(guild_id)
-            if guild:
-                for row in rows:
-                    if row[0] < now:
-                        if (channel := guild.get_channel(row[1])):
-                            try:
-                                message = await channel.fetch_message(row[2])
-                            except discord.NotFound:
-                                continue
-                            if message.reactions:
-                                members = (await message.reactions[0].users().flatten())[1:]
-                                await self.bot.cogs["ServerTool"].lottery(
-                                    await self.bot.get_context(message),
-                                    (length if (c := int(message.content)) > (length := len(members)) else c),
-                                    target=members
-                                )
-                    else:
-                        continue
-                    await self.delete(guild_id, row[1], row[2])
-            else:
-                await self.delete_guild(guild_id)
+    async def draw(self, payload: list[int]):
+        # スケジューラーから呼ばれて抽選を行う。
+        guild_id, channel_id, message_id = payload
+        if (guild := self.bot.get_guild(guild_id)) and (channel := guild.get_channel(channel_id)):
+            try:
+                message = await channel.fetch_message(message_id)
+            except discord.NotFound:
+                message = None
+            if message is not None and message.reactions:
+                members = (await message.reactions[0].users().flatten())[1:]
+                await self.bot.cogs["ServerTool"].lottery(
+                    await self.bot.get_context(message),
+                    (length if (c := int(message.content)) > (length := len(members)) else c),
+                    target=members
+                )
+        await self.delete(guild_id, channel_id, message_id)
 
     @commands.Cog.listener()
+    @reaction_interest(emojis=(EMOJIS["error"],), bot_author=True)
     async def on_full_reaction_add(self, payload):
         if (not hasattr(payload, "message") or not payload.message.guild
                 or not payload.message.author.bot):
@@ -214,7 +215,7 @@ class DelayLottery(commands.Cog, DataManager):
             )
 
     def cog_unload(self):
-        self.lottery_worker.cancel()
+        self.bot.scheduler.unregister("delay_lottery")
 
 
 async def setup(bot):
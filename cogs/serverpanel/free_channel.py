@@ -5,7 +5,7 @@ from typing import Literal
 from discord.ext import commands
 import discord
 
-from util import RT
+from util import RT, route
 
 from asyncio import sleep
 
@@ -239,7 +239,7 @@ but this ID does not need to be included in the channel name when removing it.""
              "en": "..."}
         )
 
-    @commands.Cog.listener()
+    @route(dm=False, channel=lambda self, channel: "RTフリーチャンネル" in (getattr(channel, "topic", None) or ""))
     async def on_message(self, message):
         if (not message.guild or not hasattr(message.channel, "topic")
                 or not message.content or not message.channel.topic):
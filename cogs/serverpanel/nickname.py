@@ -3,6 +3,8 @@
 from discord.ext import commands
 import discord
 
+from util import reaction_interest
+
 from emoji import EMOJI_DATA as UNICODE_EMOJI_ENGLISH
 from typing import Dict
 
@@ -121,6 +123,7 @@ class NicknamePanel(commands.Cog):
         for emoji in emojis:
             await message.add_reaction(emoji)
 
+    @reaction_interest(bot_author=True, dm=False)
     async def on_full_reaction_add_remove(
         self, payload: discord.RawReactionActionEvent,
     ):
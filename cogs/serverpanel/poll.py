@@ -1,20 +1,65 @@
 # Free RT - Poll (Vote)
 
-from typing import Callable, Tuple, List, Dict
+from typing import Callable, Optional, Tuple, List, Dict
 
-from asyncio import create_task
+from asyncio import Task, create_task, shield
+from collections import OrderedDict
 
 from discord.ext import commands, tasks
 import discord
 
+from aiomysql import Pool, Cursor
 from emoji import EMOJI_DATA as UNICODE_EMOJI_ENGLISH
+from ujson import loads, dumps
 
-from util import RT
+from util import RT, DatabaseManager, route, reaction_interest
+
+
+Ledger = Dict[int, set]
+
+
+class DataManager(DatabaseManager):
+    def __init__(self, pool: Pool):
+        self.pool = pool
+        self.pool._loop.create_task(self._prepare_table())
+
+    async def _prepare_table(self, cursor: Cursor = None):
+        await cursor.execute(
+            """CREATE TABLE IF NOT EXISTS PollLedger (
+                MessageID BIGINT PRIMARY KEY NOT NULL, Votes JSON
+            );"""
+        )
+
+    async def save_ledger(self, message_id: int, ledger: Ledger, cursor: Cursor = None) -> None:
+        "投票の記録を`{絵文字: [ユーザーID, ...]}`の形で保存します。"
+        votes: Dict[str, list] = {}
+        for user_id, emojis in ledger.items():
+            for emoji in emojis:
+                votes.setdefault(emoji, []).append(user_id)
+        await cursor.execute(
+            """INSERT INTO PollLedger VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE Votes = VALUES(Votes);""",
+            (message_id, dumps(votes))
+        )
+
+    async def load_ledger(self, message_id: int, cursor: Cursor = None) -> Dict[str, list]:
+        "保存されている投票の記録を読み込みます。"
+        await cursor.execute(
+            "SELECT Votes FROM PollLedger WHERE MessageID = %s;", (message_id,)
+        )
+        return loads(row[0]) if (row := await cursor.fetchone()) else {}
+
+    async def delete_ledger(self, message_id: int, cursor: Cursor = None) -> None:
+        "投票の記録を削除します。"
+        await cursor.execute(
+            "DELETE FROM PollLedger WHERE MessageID = %s;", (message_id,)
+        )
 
 
 class CloseButton(discord.ui.View):
     def __init__(self, *args, **kwargs):
         self._color = kwargs.pop("color", 0)
+        self._cog = kwargs.pop("cog")
         kwargs["timeout"] = None
         super().__init__(*args, **kwargs)
 
@@ -44,22 +89,32 @@ class CloseButton(discord.ui.View):
                 content=interaction.message.embeds[0].title,
                 view=None, embed=embed
             )
+            await self._cog.forget(interaction.message.id)
         else:
             await interaction.response.send_message(
                 "投票をした人でないと締め切ることはできません。", ephemeral=True
             )
 
 
-class Poll(commands.Cog):
+class Poll(commands.Cog, DataManager):
+
+    MAX_LEDGERS = 500
+    "投票の記録を何個までメモリに置いておくかです。"
+
     def __init__(self, bot: RT):
         self.bot, self.rt = bot, bot.data
         self.emojis = [chr(0x1f1e6 + i) for i in range(26)]
         self.queue: Dict[str, discord.RawReactionActionEvent] = {}
-        self.view = CloseButton(color=self.bot.Colors.normal)
+        # 投票パネルのメッセージID毎の、ユーザーIDと投票した絵文字です。
+        self.ledgers: OrderedDict[int, Ledger] = OrderedDict()
+        self.dirty: set = set()
+        self._loading: Dict[int, Task] = {}
+        super(commands.Cog, self).__init__(self.bot.mysql.pool)
+        self.view = CloseButton(color=self.bot.Colors.normal, cog=self)
         self.bot.add_view(self.view)
         self.panel_updater.start()
 
-    @commands.Cog.listener()
+    @route()
     async def on_message(self, message):
         if message.content.startswith("投票rt "):
             message.content = message.content.replace("投票rt", "rf!poll")
@@ -202,6 +257,70 @@ class Poll(commands.Cog):
                 and any(str(payload.emoji) == str(reaction.emoji)
                         for reaction in payload.message.reactions))
 
+    def _matches(self, message: discord.Message, votes: Dict[str, set]) -> bool:
+        # 保存されていた投票の記録がメッセージのリアクションの数と合っているか確認する。
+        return {
+            str(reaction.emoji): reaction.count - reaction.me
+            for reaction in message.reactions if reaction.count - reaction.me
+        } == {emoji: len(user_ids) for emoji, user_ids in votes.items() if user_ids}
+
+    async def _load(
+        self, message: discord.Message,
+        payload: Optional[discord.RawReactionActionEvent] = None
+    ) -> Ledger:
+        # 投票の記録を読み込む。保存されていたものが古い場合はリアクションから作り直す。
+        ledger: Ledger = {}
+        votes = {emoji: set(user_ids) for emoji, user_ids in (await self.load_ledger(message.id)).items()}
+        if payload is not None:
+            # メッセージのリアクションには読み込むきっかけになったリアクションが既に反映されているので、保存されていたものにも反映させる。
+            if payload.event_type == "REACTION_ADD":
+                votes.setdefault(str(payload.emoji), set()).add(payload.user_id)
+            elif str(payload.emoji) in votes:
+                votes[str(payload.emoji)].discard(payload.user_id)
+        if self._matches(message, votes):
+            for emoji, user_ids in votes.items():
+                for user_id in user_ids:
+                    ledger.setdefault(user_id, set()).add(emoji)
+        else:
+            for reaction in message.reactions:
+                async for user in reaction.users():
+                    if user.id != self.bot.user.id:
+                        ledger.setdefault(user.id, set()).add(str(reaction.emoji))
+            self.dirty.add(message.id)
+        self.ledgers[message.id] = ledger
+        # 古いものから保存済みのものをメモリから消す。
+        for message_id in list(self.ledgers):
+            if len(self.ledgers) <= self.MAX_LEDGERS:
+                break
+            if message_id not in self.dirty and message_id != message.id:
+                del self.ledgers[message_id]
+        return ledger
+
+    async def get_ledger(
+        self, message: discord.Message,
+        payload: Optional[discord.RawReactionActionEvent] = None
+    ) -> Ledger:
+        """投票の記録を取得します。メモリにない場合は読み込みます。
+        リアクションのイベントで読み込む場合は、そのイベントを`payload`に渡してください。"""
+        if message.id in self.ledgers:
+            self.ledgers.move_to_end(message.id)
+            return self.ledgers[message.id]
+        # 同じパネルへのリアクションが同時に来た場合は一度だけ読み込む。
+        if message.id not in self._loading:
+            self._loading[message.id] = create_task(
+                self._load(message, payload), name=f"[Poll] Load: {message.id}"
+            )
+            self._loading[message.id].add_done_callback(
+                lambda _: self._loading.pop(message.id, None)
+            )
+        return await shield(self._loading[message.id])
+
+    async def forget(self, message_id: int) -> None:
+        "投票の記録を削除します。"
+        self.ledgers.pop(message_id, None)
+        self.dirty.discard(message_id)
+        await self.delete_ledger(message_id)
+
     def graph(self, p: dict, size: int = 28) -> str:
         "グラフを作るための関数です。"
         r, t = '[', len(p)
@@ -225,7 +344,11 @@ class Poll(commands.Cog):
     async def update_panel(self, payload: discord.RawReactionActionEvent):
         # RTの投票パネルをアップデートする。
         embed = payload.message.embeds[0]
-        emojis = {str(reaction.emoji): reaction.count - 1
+        counts: Dict[str, int] = {}
+        for votes in self.ledgers.get(payload.message_id, {}).values():
+            for emoji in votes:
+                counts[emoji] = counts.get(emoji, 0) + 1
+        emojis = {str(reaction.emoji): counts.get(str(reaction.emoji), 0)
                   for reaction in payload.message.reactions}
         # 最大桁数を数える。
         before = 1
@@ -235,28 +358,29 @@ class Poll(commands.Cog):
         # Embedを編集する。
 
         def _get_emoji(emoji):
-            return str({str(reaction.emoji): reaction.count - 1
-                        for reaction in payload.message.reactions}
-                       [emoji]).zfill(before)
+            return str(emojis.get(emoji, 0)).zfill(before)
         description, _ = self.make_description(
             embed.description, _get_emoji
         )
         if description != embed.description:
             # もしカウントが変わっているならメッセージを編集する。
             embed.description = description
-            wb = discord.utils.get(
-                await payload.message.channel.webhooks(), name="RT-Tool"
-            )
+            # 送信したウェブフックはキャッシュされているものを使う。
+            wb = await self.bot.webhooks.find(
+                payload.message.channel, payload.message.webhook_id
+            ) if payload.message.webhook_id else None
             if wb:
                 try:
                     await wb.edit_message(
                         payload.message_id, embed=embed,
                         content="".join(
                             (payload.message.content[:payload.message.content.find("\n")],
-                             "\n📊 ", self.graph(emojis), "")))
+                             "\n📊 ", self.graph(dict(emojis)), "")))
                 except ValueError:
                     pass
-        del description, emojis
+                except discord.NotFound:
+                    self.bot.webhooks.invalidate(payload.channel_id)
+        del description
 
     def cog_unload(self):
         self.panel_updater.cancel()
@@ -268,31 +392,50 @@ class Poll(commands.Cog):
         for cmid in list(self.queue.keys()):
             create_task(self.update_panel(self.queue[cmid]))
             del self.queue[cmid]
+        # 変更された投票の記録を保存する。
+        for message_id in list(self.dirty):
+            self.dirty.discard(message_id)
+            if message_id in self.ledgers:
+                try:
+                    await self.save_ledger(message_id, self.ledgers[message_id])
+                except Exception as e:
+                    self.dirty.add(message_id)
+                    self.bot.print("[Poll]", "Failed to save ledger:", e)
 
     @commands.Cog.listener()
+    @reaction_interest(bot_author=True, dm=False)
     async def on_full_reaction_add(self, payload: discord.RawReactionActionEvent):
-        if self.bot.is_ready() and hasattr(payload, "message"):
+        if self.bot.is_ready() and hasattr(payload, "message") \
+                and payload.message.content.startswith("RT投票パネル") \
+                and payload.user_id != self.bot.user.id:
+            # 投票の記録を更新する。
+            ledger, emoji = await self.get_ledger(payload.message, payload), str(payload.emoji)
+            votes = ledger.setdefault(payload.user_id, set())
+            if payload.event_type == "REACTION_ADD":
+                # もし一人一票までなら投票できるかチェックをする。
+                if "一" in payload.message.content and votes - {emoji} \
+                        and payload.member and not payload.member.bot:
+                    await payload.message.remove_reaction(payload.emoji, payload.member)
+                    return
+                votes.add(emoji)
+            else:
+                votes.discard(emoji)
+                if not votes:
+                    del ledger[payload.user_id]
+            self.dirty.add(payload.message_id)
             if self.check_panel(payload):
-                cmid = f"{payload.channel_id}.{payload.message_id}"
-                if payload.event_type == "REACTION_ADD":
-                    # もし一人一票までなら投票できるかチェックをする。
-                    if "一" in payload.message.content:
-                        users = len(
-                            [reaction for reaction in payload.message.reactions
-                             if any(user.id == payload.member.id
-                                    for user in await reaction.users().flatten())]
-                        )
-                        if users > 1:
-                            await payload.message.remove_reaction(
-                                payload.emoji, payload.member
-                            )
-                            return
-                self.queue[cmid] = payload
+                self.queue[f"{payload.channel_id}.{payload.message_id}"] = payload
 
     @commands.Cog.listener()
+    @reaction_interest(bot_author=True, dm=False)
     async def on_full_reaction_remove(self, payload: discord.RawReactionActionEvent):
         await self.on_full_reaction_add(payload)
 
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.message_id in self.ledgers:
+            await self.forget(payload.message_id)
+
 
 async def setup(bot):
     await bot.add_cog(Poll(bot))
@@ -3,6 +3,8 @@
 from discord.ext import commands, tasks
 import discord
 
+from util import reaction_interest
+
 from asyncio import create_task
 from time import time
 
@@ -159,6 +161,7 @@ class Recruitment(commands.Cog):
             del self.queue[key]
 
     @commands.Cog.listener()
+    @reaction_interest(emojis=(EMOJI,), bot_author=True)
     async def on_full_reaction_add(self, payload):
         if (hasattr(payload, "message") and "RT募集パネル" in payload.message.content
                 and payload.message.author.bot and payload.message.guild
@@ -170,6 +173,7 @@ class Recruitment(commands.Cog):
             self.queue[f"{payload.channel_id}.{payload.message_id}"] = payload
 
     @commands.Cog.listener()
+    @reaction_interest(emojis=(EMOJI,), bot_author=True)
     async def on_full_reaction_remove(self, payload):
         await self.on_full_reaction_add(payload)
 
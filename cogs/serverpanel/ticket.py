@@ -10,7 +10,7 @@ import discord
 from ujson import loads, dumps
 
 from util import RolesConverter
-from util import componesy
+from util import componesy, reaction_interest
 
 if TYPE_CHECKING:
     from aiomysql import Pool
@@ -346,10 +346,12 @@ class Ticket(commands.Cog, DataManager):
                     await channel.send(first)
 
     @commands.Cog.listener()
+    @reaction_interest(emojis=("🎫",), bot_author=True)
     async def on_full_reaction_add(self, payload):
         await self.on_ticket(payload)
 
     @commands.Cog.listener()
+    @reaction_interest(emojis=("🎫",), bot_author=True)
     async def on_full_reaction_remove(self, payload):
         await self.on_ticket(payload)
 
@@ -5,9 +5,14 @@ from typing import Callable, Coroutine, Literal, Union, Any, Dict, Tuple, List
 from discord.ext import commands
 import discord
 
-from util import RT
+from asyncio import sleep
 
-from .modutils import process_check_message, trial_new_member, trial_invite
+from util import RT, route
+
+from .modutils import (
+    process_check_message, trial_new_member, trial_invite, trial_raid,
+    RaidWindow, SCORERS
+)
 from .data_manager import GuildData, DataManager
 from .cache import Cache
 
@@ -27,13 +32,45 @@ class AutoMod(commands.Cog, DataManager):
         "warn": 0xDDBB04,
         "error": 0xF288AA
     }
+    # スパム判定でメッセージの似ている度の計算に使うものです。
+    # `minhash`は`difflib`の値に合わせてあるので、怪しさの基準はどちらでも同じです。
+    scorer = SCORERS["minhash"]
 
     def __init__(self, bot: RT):
         self.bot = bot
         self.caches: Dict[int, Tuple[GuildData, Dict[int, Cache]]] = {}
         self.enabled: List[int] = []
+        # レイド検知用のサーバー毎の最近のメッセージの記録と、処罰待ちのメンバーです。
+        self.raid_windows: Dict[int, RaidWindow] = {}
+        self.raid_queue: Dict[int, set] = {}
         super(commands.Cog, self).__init__(self)
 
+    # レイド検知で何秒以内の投稿を見るかと、サーバー毎に覚えておくメッセージの数の上限です。
+    RAID_SECONDS = 10.0
+    RAID_MAXLEN = 500
+    # レイドを検知してから処罰するまで待つ秒数です。この間に検知したメンバーはまとめて処罰されます。
+    RAID_GRACE = 1.0
+
+    def get_raid_window(self, guild_id: int) -> RaidWindow:
+        "レイド検知用のサーバーのメッセージの記録を取得します。"
+        if guild_id not in self.raid_windows:
+            self.raid_windows[guild_id] = RaidWindow(self.RAID_SECONDS, self.RAID_MAXLEN)
+        return self.raid_windows[guild_id]
+
+    def punish_raid(self, guild: discord.Guild, member_ids: set) -> None:
+        "レイドをしたメンバーを処罰待ちに追加します。処罰はサーバー毎にまとめて行われます。"
+        if guild.id in self.raid_queue:
+            self.raid_queue[guild.id].update(member_ids)
+        else:
+            self.raid_queue[guild.id] = set(member_ids)
+            self.bot.loop.create_task(
+                self._punish_raid(guild), name=f"[AutoMod] Punish raid: {guild.id}"
+            )
+
+    async def _punish_raid(self, guild):
+        await sleep(self.RAID_GRACE)
+        await trial_raid(self, guild, self.raid_queue.pop(guild.id))
+
     def cog_unload(self):
         self.close()
 
@@ -607,11 +644,49 @@ class AutoMod(commands.Cog, DataManager):
         assert count in (True, False) or 0 <= count <= 4000, "その数で設定することはできません。"
         await self.setting(self.toggle, ctx, "emoji", count, OK)
 
+    @automod.command(aliases=["r", "レイド"])
+    async def raid(self, ctx: commands.Context, count: Union[bool, int]):
+        """!lang ja
+        --------
+        レイド検知機能です。  
+        この機能を有効にすると、十秒以内に指定した人数以上の人が同じ内容のメッセージを送信した場合、その人達をまとめてタイムアウトします。
+
+        Parameters
+        ----------
+        count : offまたは人数
+            何人が同じ内容を送信したらタイムアウトするかです。  
+            `off`にした場合はこの機能を無効にします。
+
+        Aliases
+        -------
+        r, レイド
+
+        !lang en
+        --------
+        This is a raid detection feature.  
+        When this is enabled, if the specified number of people send the same message within ten seconds, they will all be timed out.
+
+        Parameters
+        ----------
+        count : off or number
+            How many people need to send the same content to be timed out.  
+            If set to `off`, this feature will be disabled.
+
+        Aliases
+        -------
+        r"""
+        if count is True:
+            # `toggle`は`True`を1にしてしまうので、onの場合はデフォルトの人数にする。
+            count = self.DEFAULTS["raid"]
+        assert count is False or (isinstance(count, int) and 2 <= count <= 100), \
+            "その数で設定することはできません。"
+        await self.setting(self.toggle, ctx, "raid", count, OK)
+
     async def prepare_cache(self, guild: discord.Guild, member: discord.Member):
         await self.prepare_cache_guild(guild)
         await self.prepare_cache_member(member)
 
-    @commands.Cog.listener()
+    @route(bots=False, dm=False, guild=lambda self, guild_id: guild_id in self.enabled)
     async def on_message(self, message: discord.Message):
         if (message.guild and not message.author.bot
                 and message.guild.id in self.enabled):
@@ -0,0 +1,99 @@
+# Free RT AutoMod - Benchmark
+
+"""AutoModのスパム判定で使うメッセージの似ている度の計算方法の速さを比べるためのものです。
+`python -m cogs.serversafety.automod.benchmark`で実行すると、
+レイドを真似たメッセージを流した場合の一秒あたりに処理できるメッセージの数と、`difflib`との値のズレを表示します。"""
+
+from __future__ import annotations
+
+from random import Random
+from time import perf_counter
+
+from .modutils import SCORERS, Scorer
+
+
+HIRAGANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+WORDS = (
+    "今日", "明日", "天気", "ゲーム", "参加", "募集", "よろしく", "お願いします", "サーバー", "無料",
+    "Nitro", "配布", "こちら", "クリック", "今すぐ", "限定", "イベント", "楽しい", "です", "ます"
+)
+
+
+def _sentence(random: Random, length: int) -> str:
+    # 単語とひらがなを適当に繋げた文章を作る。
+    return "".join(
+        random.choice(WORDS) if random.random() < 0.5 else random.choice(HIRAGANA)
+        for _ in range(length)
+    )
+
+
+def _mutate(random: Random, text: str, rate: float) -> str:
+    # 文字を消したり置き換えたり足したりする。
+    result = []
+    for char in text:
+        if (value := random.random()) < rate / 3:
+            continue
+        result.append(random.choice(HIRAGANA) if value < rate * 2 / 3 else char)
+        if rate * 2 / 3 <= value < rate:
+            result.append(random.choice(HIRAGANA))
+    return "".join(result)
+
+
+def raid_corpus(count: int = 5000, seed: int = 0) -> list[tuple[str, str]]:
+    """レイドを真似た(前のメッセージ, 次のメッセージ)の組を作ります。
+    テンプレートに少し手を加えたスパム、同じ文字の連投、普通の会話が混ざっています。"""
+    random, pairs = Random(seed), []
+    templates = [
+        _sentence(random, random.randint(5, 40)) + " https://discord.gg/" + "".join(
+            random.choice("abcdefghijk") for _ in range(8)
+        ) for _ in range(20)
+    ]
+    for _ in range(count):
+        if (value := random.random()) < 0.5:
+            template = random.choice(templates)
+            pairs.append((
+                f"<@{random.randint(10 ** 17, 10 ** 18)}> " + _mutate(random, template, 0.05),
+                f"<@{random.randint(10 ** 17, 10 ** 18)}> " + _mutate(random, template, random.random() * 0.5)
+            ))
+        elif value < 0.65:
+            char = random.choice(HIRAGANA + "wｗ草!")
+            pairs.append((char * random.randint(1, 300), _mutate(random, char * random.randint(1, 300), 0.05)))
+        else:
+            before = _sentence(random, random.randint(1, 30))
+            pairs.append((
+                before, _mutate(random, before, random.random())
+                if random.random() < 0.3 else _sentence(random, random.randint(1, 30))
+            ))
+    return pairs
+
+
+def measure(scorer: Scorer, pairs: list[tuple[str, str]]) -> float:
+    """一秒あたりに処理できるメッセージの数を測ります。
+    `Cache`と同じように前のメッセージの`fingerprint`は作り直さずに使い回します。"""
+    fingerprints = [scorer.fingerprint(before) for before, _ in pairs]
+    started = perf_counter()
+    for before, (_, after) in zip(fingerprints, pairs):
+        scorer.compare(before, scorer.fingerprint(after))
+    return len(pairs) / (perf_counter() - started)
+
+
+def deviation(scorer: Scorer, pairs: list[tuple[str, str]]) -> float:
+    "`difflib`で計算した似ている度とのズレの平均を計算します。"
+    return sum(
+        abs(scorer.compare(scorer.fingerprint(before), scorer.fingerprint(after))
+            - SCORERS["difflib"].compare(before, after))
+        for before, after in pairs
+    ) / len(pairs)
+
+
+def main(count: int = 5000) -> None:
+    pairs = raid_corpus(count)
+    for name, scorer in SCORERS.items():
+        print(
+            f"{name}: {measure(scorer, pairs):.0f} messages/s,",
+            f"deviation from difflib: {deviation(scorer, pairs):.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
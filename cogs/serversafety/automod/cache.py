@@ -37,7 +37,9 @@ class Cache:
         self.last_update = time()
         # 以下以降スパムチェックに使うキャッシュの部分です。
         self.before: Optional[discord.Message] = None
-        self.before_content: Optional[discord.Message] = None
+        # メッセージの内容を`AutoMod.scorer`で比較用に変換したものです。
+        self.before_fingerprints: list[Any] = []
+        self.fingerprints: list[Any] = []
         self.before_join: Optional[float] = None
         self.suspicious = 0
 
@@ -54,7 +56,9 @@ class Cache:
         "キャッシュをアップデートします。"
         self.update_timeout()
         before = self.before
-        self.before_content = join(self.before or message)
+        fingerprints = [self.cog.scorer.fingerprint(content) for content in join(message)]
+        self.before_fingerprints = self.fingerprints or fingerprints
+        self.fingerprints = fingerprints
         self.before = message
         return before
 
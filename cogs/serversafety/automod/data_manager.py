@@ -30,6 +30,7 @@ class GuildData(TypedDict, total=False):
     bolt: float
     invite_deleter: NewType("invite_deleter", List[str])
     emoji: int
+    raid: int
 
 
 class HashableGuild(dict):
@@ -64,7 +65,7 @@ class DataManager(DatabaseManager):
 
     TABLES = ("AutoModData",)
     DEFAULTS = {
-        "ban": 5, "mute": 3, "bolt": 60, "emoji": 15
+        "ban": 5, "mute": 3, "bolt": 60, "emoji": 15, "raid": 5
     }
     WARN_RESET_TIMEOUT = 86400
 
@@ -83,6 +84,7 @@ class DataManager(DatabaseManager):
         for row in await cursor.fetchall():
             if row:
                 self.cog.enabled.append(row[0])
+        self.cog.bot.router.invalidate()
 
     @tasks.loop(seconds=10)
     # @tasks.loop(seconds=30)
@@ -108,6 +110,13 @@ class DataManager(DatabaseManager):
                     # もしサーバーのキャッシュが空になったらそれもいらないので消す。
                     del self.cog.caches[guild_id]
 
+        for guild_id in list(self.cog.raid_windows.keys()):
+            # レイド検知用の記録で放置されているものは消す。
+            window = self.cog.raid_windows[guild_id]
+            window._expire(now)
+            if not window:
+                del self.cog.raid_windows[guild_id]
+
         self.cog.bot.loop.create_task(self._reset_warn(now))
 
     def close(self):
@@ -145,6 +154,7 @@ class DataManager(DatabaseManager):
                 f"DELETE FROM {self.TABLES[0]} WHERE GuildID = %s;", (guild_id,)
             )
             self.cog.enabled.remove(guild_id)
+            self.cog.bot.router.invalidate(guild_id)
             return False
         else:
             await cursor.execute(
@@ -153,6 +163,7 @@ class DataManager(DatabaseManager):
                 )
             )
             self.cog.enabled.append(guild_id)
+            self.cog.bot.router.invalidate(guild_id)
             return True
 
     def if_str_loads(self, data: Union[str, dict]) -> dict:
@@ -2,10 +2,13 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Union, Any
+from typing import TYPE_CHECKING, Optional, Union, Any
 
 from datetime import timedelta
-from re import findall
+from re import findall, compile as re_compile
+from collections import deque
+from heapq import nsmallest
+from bisect import bisect_right
 from time import time
 
 import discord
@@ -16,6 +19,7 @@ from emoji import emoji_list as emoji_lis
 if TYPE_CHECKING:
     from .data_manager import GuildData
     from .cache import Cache
+    from .__init__ import AutoMod
 
 
 def similar(before: str, after: str) -> float:
@@ -23,6 +27,78 @@ def similar(before: str, after: str) -> float:
     return SequenceMatcher(None, before, after).ratio() * 100
 
 
+class Scorer:
+    """文章の似ている度を0から100で計算するためのクラスです。
+    `fingerprint`で作ったものを`compare`で比べます。継承して別の方法を実装することができます。"""
+
+    def fingerprint(self, text: str) -> Any:
+        "比較に使うデータを作ります。"
+        return text
+
+    def compare(self, before: Any, after: Any) -> float:
+        "`fingerprint`で作ったデータ同士の似ている度を計算します。"
+        raise NotImplementedError()
+
+
+class DifflibScorer(Scorer):
+    "`difflib.SequenceMatcher`を使う昔からの方法です。文字数の二乗の時間がかかります。"
+
+    def compare(self, before: str, after: str) -> float:
+        return similar(before, after)
+
+
+class MinHashScorer(Scorer):
+    """文字列を`shingle`文字ずつに区切ったもののハッシュの小さい方から`k`個(bottom-kのMinHash)で比較します。
+    文字数に比例する時間で作ることができ、比較は`k`に比例する時間で行えます。
+    同じ文字の連投を見分けられるように、区切ったものは何回目に出てきたかも含めてハッシュにします。
+
+    MinHashで推定できるJaccard係数は`difflib`の似ている度より小さく出るので、
+    `CALIBRATION`で`difflib`の値に合わせてから返します。これでスパム判定の基準はそのまま使えます。
+    `CALIBRATION`は`benchmark.raid_corpus`で作ったものから、Jaccard係数毎の`difflib`の値の中央値を取って作りました。"""
+
+    CALIBRATION = (
+        (0.0, 0.0), (0.05, 0.17), (0.15, 0.5), (0.25, 0.65), (0.35, 0.72),
+        (0.5, 0.79), (0.65, 0.84), (0.85, 0.9), (1.0, 1.0)
+    )
+    "(Jaccard係数, `difflib`の似ている度)の表です。間の値は線形補間します。"
+
+    def __init__(self, shingle: int = 2, k: int = 64):
+        self.shingle, self.k = shingle, k
+        self._xs = [x for x, _ in self.CALIBRATION]
+
+    def fingerprint(self, text: str) -> frozenset[int]:
+        if not text:
+            return frozenset()
+        counts, hashes = {}, set()
+        for i in range(max(len(text) - self.shingle + 1, 1)):
+            shingle = text[i:i + self.shingle]
+            counts[shingle] = counts.get(shingle, -1) + 1
+            hashes.add(hash((shingle, counts[shingle])))
+        return frozenset(nsmallest(self.k, hashes))
+
+    def calibrate(self, jaccard: float) -> float:
+        "Jaccard係数を`difflib`の似ている度に合わせた0から100の値にします。"
+        if (index := bisect_right(self._xs, jaccard)) >= len(self.CALIBRATION):
+            return self.CALIBRATION[-1][1] * 100
+        (x1, y1), (x2, y2) = self.CALIBRATION[index - 1], self.CALIBRATION[index]
+        return (y1 + (y2 - y1) * (jaccard - x1) / (x2 - x1)) * 100
+
+    def compare(self, before: frozenset[int], after: frozenset[int]) -> float:
+        if not before and not after:
+            # 両方とも空の場合は同じものとする。
+            return 100.0
+        union = nsmallest(self.k, before | after)
+        return self.calibrate(
+            sum(1 for value in union if value in before and value in after) / len(union)
+        )
+
+
+SCORERS: dict[str, Scorer] = {
+    "difflib": DifflibScorer(),
+    "minhash": MinHashScorer()
+}
+
+
 def join(message: discord.Message) -> list[str]:
     "渡されたメッセージにある文字列を全て合体させます。"
     contents = [message.content or ""]
@@ -36,10 +112,71 @@ def join(message: discord.Message) -> list[str]:
     return contents
 
 
+class RaidWindow:
+    """サーバーの最近のメッセージを記録して、複数人が同じ内容を投稿しているのを検知するためのクラスです。
+    `seconds`秒より古いものか、`maxlen`個を超えた古いものから忘れます。
+    一つのメッセージあたりの処理は(均して)定数時間です。"""
+
+    def __init__(self, seconds: float = 10.0, maxlen: int = 500):
+        self.seconds, self.maxlen = seconds, maxlen
+        self.entries: deque[tuple[float, int, int]] = deque()
+        # 内容のハッシュ毎の投稿したメンバーとその回数です。
+        self.counts: dict[int, dict[int, int]] = {}
+        # 既に検知済みとして返したメンバーです。
+        self.flagged: dict[int, set[int]] = {}
+
+    def _expire(self, now: float) -> None:
+        # 古いものを消す。
+        while self.entries and (
+            len(self.entries) > self.maxlen
+            or now - self.entries[0][0] > self.seconds
+        ):
+            _, fingerprint, member_id = self.entries.popleft()
+            members = self.counts[fingerprint]
+            members[member_id] -= 1
+            if not members[member_id]:
+                del members[member_id]
+                if not members:
+                    del self.counts[fingerprint]
+                    self.flagged.pop(fingerprint, None)
+
+    def add(
+        self, member_id: int, fingerprint: int, threshold: int,
+        now: Optional[float] = None
+    ) -> set[int]:
+        """メッセージを記録します。
+        同じ内容を`threshold`人以上が投稿していた場合は、まだ返していないそのメンバーを返します。"""
+        now = now or time()
+        self.entries.append((now, fingerprint, member_id))
+        members = self.counts.setdefault(fingerprint, {})
+        members[member_id] = members.get(member_id, 0) + 1
+        self._expire(now)
+        if fingerprint in self.counts and len(members) >= threshold:
+            flagged = self.flagged.setdefault(fingerprint, set())
+            new = members.keys() - flagged
+            flagged.update(new)
+            return new
+        return set()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+RAID_MIN_LENGTH = 10
+
+
+def raid_fingerprint(text: str) -> Optional[int]:
+    "レイド検知に使うメッセージの内容のハッシュを作ります。短すぎる場合は`None`を返します。"
+    text = " ".join(text.lower().split())
+    return hash(text) if len(text) >= RAID_MIN_LENGTH else None
+
+
+CUSTOM_EMOJI = re_compile(r"<a?:\w+:\d+>")
+
+
 def emoji_count(text: str) -> int:
     "渡された文字列にある絵文字の数を数えます。"
-    return len(findall("<a?:.+:\\d+>", text)) \
-        + len([char for char in text if emoji_lis(char)])
+    return len(CUSTOM_EMOJI.findall(text)) + len(emoji_lis(text))
 
 
 async def log(
@@ -47,16 +184,46 @@ async def log(
     reason: str, subject: str, error: bool = False
 ) -> discord.Message:
     "ログを流します。"
-    for channel in cache.guild.text_channels:
-        if channel.topic and "rt>automod" in channel.topic:
-            return await channel.send(
-                f"<t:{int(time())}>", embed=discord.Embed(
-                    title="AutoMod",
-                    description=f"{cache.member.mention}を{reason}のため{subject}しました。" + 
-                                (f"\nですが権限がないので{subject}することができませんでした。" if error else ""),
-                    color=cache.cog.COLORS["error" if error else "warn"]
-                )
+    if (channel := cache.cog.bot.topics.first(cache.guild, "rt>automod")):
+        return await channel.send(
+            f"<t:{int(time())}>", embed=discord.Embed(
+                title="AutoMod",
+                description=f"{cache.member.mention}を{reason}のため{subject}しました。" + 
+                            (f"\nですが権限がないので{subject}することができませんでした。" if error else ""),
+                color=cache.cog.COLORS["error" if error else "warn"]
             )
+        )
+
+
+async def trial_raid(cog: "AutoMod", guild: discord.Guild, member_ids: set[int]) -> None:
+    "レイドをしたメンバー達をまとめてタイムアウトします。"
+    members = [
+        member for member_id in member_ids
+        if (member := guild.get_member(member_id)) is not None
+        and not member.guild_permissions.administrator
+    ]
+    if not members:
+        return
+    cog.print("[punishment.raid]", guild.id, len(members))
+    failed = 0
+    for member in members:
+        try:
+            await member.edit(timeout=timedelta(days=1), reason="[AutoMod] レイドのため")
+        except discord.Forbidden:
+            failed += 1
+        except discord.HTTPException as e:
+            failed += 1
+            cog.print("[punishment.raid]", "Failed:", member.id, e)
+    if (channel := cog.bot.topics.first(guild, "rt>automod")):
+        return await channel.send(
+            f"<t:{int(time())}>", embed=discord.Embed(
+                title="AutoMod",
+                description=f"{len(members)}人({', '.join(member.mention for member in members)})を"
+                            "レイドのためタイムアウトしました。"
+                            + (f"\nですが{failed}人は権限がないのでタイムアウトできませんでした。" if failed else ""),
+                color=cog.COLORS["error" if failed else "warn"]
+            )
+        )
 
 
 def get(cache: "Cache", data: "GuildData", key: str) -> Any:
@@ -108,12 +275,18 @@ def process_check_message(
         # スパム判定をする。
         # 以前送られたメッセージと似ているかをチェックし似ている度を怪しさにカウントします。
         self.suspicious += sum(
-            similar(*contents) for contents in zip(
-                self.before_content, join(message)
+            self.cog.scorer.compare(*fingerprints) for fingerprints in zip(
+                self.before_fingerprints, self.fingerprints
             )
         )
     if self.process_suspicious():
         self.cog.bot.loop.create_task(trial_message(self, data, message))
+    # 複数人による同じ内容の投稿(レイド)をチェックします。
+    if "raid" in data and (fingerprint := raid_fingerprint(message.content)) is not None:
+        if (members := self.cog.get_raid_window(message.guild.id).add(
+            message.author.id, fingerprint, data["raid"]
+        )):
+            self.cog.punish_raid(message.guild, members)
     # 絵文字カウントをチェックします。
     if get(self, data, "emoji") <= emoji_count(message.content):
         self.suspicious += 50
@@ -15,7 +15,7 @@ from aiomysql import Pool, Cursor
 from ujson import loads, dumps
 
 from util import DatabaseManager
-from util import RT
+from util import RT, route, reaction_interest
 
 from .automod.modutils import emoji_count
 
@@ -294,7 +294,7 @@ class Blocker(commands.Cog, DataManager):
             ):
                 yield mode
 
-    @commands.Cog.listener()
+    @route(dm=False)
     async def on_message(self, message: discord.Message):
         if (message.guild and isinstance(message.author, discord.Member)
                 and message.guild.id in self.cache):
@@ -317,6 +317,7 @@ class Blocker(commands.Cog, DataManager):
                     break
 
     @commands.Cog.listener()
+    @reaction_interest(guild=lambda self, guild_id: guild_id in self.cache)
     async def on_full_reaction_add(self, payload: discord.RawReactionActionEvent):
         if payload.guild_id is not None and payload.guild_id in self.cache:
             for mode in self.is_should_check(payload.member):
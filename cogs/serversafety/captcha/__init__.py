@@ -11,7 +11,7 @@ from time import time
 from discord.ext import commands, tasks
 import discord
 
-from util import RT, Table
+from util import RT, Table, route
 
 from .image import ImageCaptcha, QueueData as ImageQueue
 from .web import WebCaptcha
@@ -458,7 +458,7 @@ class Captcha(commands.Cog, DataManager):
             # もしCpatchaクラスにon_member_joinがあるならQueueDataに値を設定できるようにそれを呼び出す。
             await self.dispatch(self.get_captcha(row[0]), "on_member_join", member)
 
-    @commands.Cog.listener()
+    @route(dm=False)
     async def on_message(self, message: discord.Message):
         # 合言葉認証に必要なのでon_messageを呼び出しておく。
         if (message.guild and message.author
@@ -224,7 +224,7 @@ class GlobalBan(commands.Cog, DataManager):
         await self.add_user(user_id, reason)
 
         for guild in self.bot.guilds:
-            if not self.get_onoff(guild.id):
+            if not await self.get_onoff(guild.id):
                 # オフに設定してるサーバーは無視する。
                 continue
             for member in guild.members:
@@ -247,16 +247,20 @@ class GlobalBan(commands.Cog, DataManager):
         await self.remove_user(user_id)
 
         for guild in self.bot.guilds:
-            for member in guild.members:
-                if member.id == user_id:
-                    try:
-                        await member.unban()
-                        if (channel := self.get_channel(guild)):
-                            await channel.send(
-                                f"{member.name}のBANを解除しました。"
-                            )
-                    except Exception as e:
-                        print("Error on ungban :", e)
+            # キャッシュされているBANのリストにいないサーバーは飛ばす。
+            # キャッシュがないサーバーはBANのリストを取得せずに解除を試み、BANされていなかった場合は無視する。
+            if guild.id in self.bot.bans.bans and user_id not in self.bot.bans.bans[guild.id]:
+                continue
+            try:
+                await guild.unban(discord.Object(user_id))
+                if (channel := self.get_channel(guild)):
+                    await channel.send(
+                        f"{getattr(self.bot.get_user(user_id), 'name', user_id)}のBANを解除しました。"
+                    )
+            except discord.NotFound:
+                continue
+            except Exception as e:
+                print("Error on ungban :", e)
 
         await ctx.reply("削除しました。")
 
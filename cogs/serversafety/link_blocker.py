@@ -6,7 +6,7 @@ from discord.ext import commands
 from discord import app_commands
 import discord
 
-from util import RT
+from util import RT, route
 
 if TYPE_CHECKING:
     from aiomysql import Pool, Cursor
@@ -128,6 +128,7 @@ class LinkBlocker(commands.Cog, DataManager):
                 self.guilds.append(ctx.guild.id)
             else:
                 self.guilds.remove(ctx.guild.id)
+            self.bot.router.invalidate(ctx.guild.id)
             await ctx.reply(
                 f"リンクブロックを{'有効' if onoff else '無効'}にしました。"
             )
@@ -251,7 +252,7 @@ class LinkBlocker(commands.Cog, DataManager):
 
     SCHEMES = ("https://", "http://")
 
-    @commands.Cog.listener()
+    @route(dm=False, guild=lambda self, guild_id: guild_id in self.guilds)
     async def on_message(self, message: discord.Message):
         if (message.guild and message.guild.id in self.guilds
                 and any(scheme in message.content for scheme in self.SCHEMES)
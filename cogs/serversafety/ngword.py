@@ -6,7 +6,8 @@ from discord.ext import commands
 from discord import app_commands
 import discord
 
-from util import RT, Table
+from util import RT, Table, route
+from util.matcher import MatcherCache
 
 from ..channelplugin.log import log
 
@@ -18,7 +19,9 @@ class NGWords(Table):
 
 class DataManager:
     def __init__(self, bot: RT):
+        self.bot = bot
         self.data = NGWords(bot)
+        self.matchers = MatcherCache()
 
     def get(self, guild_id: int) -> list[str]:
         "NGワードのリストを取得します。"
@@ -35,12 +38,16 @@ class DataManager:
         assert word not in self.data[guild_id].words, "既に追加されています。"
         assert len(self.data[guild_id].words) < 50, "追加しすぎです。"
         self.data[guild_id].words.append(word)
+        self.matchers.invalidate(guild_id)
+        self.bot.router.invalidate(guild_id)
 
     def remove(self, guild_id: int, word: str) -> None:
         "NGワードを削除します。"
         self._prepare(guild_id)
         assert word in self.data[guild_id].words, "そのNGワードはありません。"
         self.data[guild_id].words.remove(word)
+        self.matchers.invalidate(guild_id)
+        self.bot.router.invalidate(guild_id)
 
 
 class NgWord(commands.Cog, DataManager):
@@ -167,7 +174,7 @@ class NgWord(commands.Cog, DataManager):
             self.remove(ctx.guild.id, word)
         await ctx.reply("Ok")
 
-    @commands.Cog.listener()
+    @route(own=False, dm=False, guild=lambda self, guild_id: bool(self.get(guild_id)))
     @log(force=True)
     async def on_message(self, message: discord.Message):
         # 関係ないメッセージは無視する。
@@ -175,22 +182,22 @@ class NgWord(commands.Cog, DataManager):
                 or isinstance(message.author, discord.User)):
             return
 
-        if not message.author.guild_permissions.administrator:
-            for word in self.get(message.guild.id):
-                if word in message.content:
-                    await message.delete()
-                    embed = discord.Embed(
-                        title={"ja": "NGワードを削除しました。",
-                               "en": "Removed the NG Word."},
-                        color=self.bot.colors["unknown"]
-                    )
-                    embed.add_field(
-                        name="Author",
-                        value=f"{message.author.mention} ({message.author.id})",
-                        inline=False
-                    )
-                    embed.add_field(name="Content", value=message.content)
-                    return embed
+        if not message.author.guild_permissions.administrator and self.matchers.get(
+            message.guild.id, lambda: self.get(message.guild.id)
+        ).search(message.content) is not None:
+            await message.delete()
+            embed = discord.Embed(
+                title={"ja": "NGワードを削除しました。",
+                       "en": "Removed the NG Word."},
+                color=self.bot.colors["unknown"]
+            )
+            embed.add_field(
+                name="Author",
+                value=f"{message.author.mention} ({message.author.id})",
+                inline=False
+            )
+            embed.add_field(name="Content", value=message.content)
+            return embed
 
 
 async def setup(bot):
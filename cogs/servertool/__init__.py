@@ -13,6 +13,7 @@ from discord import app_commands
 import discord
 
 from util.page import EmbedPage
+from util import reaction_interest
 from data import PERMISSION_TEXTS
 
 
@@ -556,6 +557,7 @@ class ServerTool(commands.Cog):
     }
 
     @commands.Cog.listener()
+    @reaction_interest(emojis=(*EMOJIS["star"], EMOJIS["trash"]), dm=False)
     async def on_full_reaction_add(self, payload):
         if (not payload.guild_id or not payload.member or payload.member.bot
             or not hasattr(payload, "message")
@@ -575,14 +577,9 @@ class ServerTool(commands.Cog):
                         else:
                             count += 1
             else:
-                if (channel := discord.utils.find(
-                    lambda ch: ch.topic and "rt>star" in ch.topic,
-                    payload.message.guild.text_channels
-                )):
-                    cache = channel.topic[channel.topic.find("rt>star") + 7:]
+                if (channel := self.bot.topics.first(payload.message.guild, "rt>star")):
                     try:
-                        require = int(cache 
-                                      if (index := cache.find("\n")) == -1 else cache[:index])
+                        require = int(self.bot.topics.argument(channel, "rt>star"))
                     except ValueError:
                         require = 1
                     if count < require:
@@ -2,11 +2,12 @@
 
 from typing import Any, Literal
 
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import app_commands
 import discord
 
 from util.mysql_manager import DatabaseManager
+from util import route
 
 from asyncio import sleep
 from ujson import loads
@@ -114,7 +115,23 @@ class Bump(commands.Cog, DataManager):
             self.bot.mysql
         )
         await self.init_table()
-        self.notification.start()
+        self.bot.scheduler.register("bump", self.notification)
+        # スケジューラーを使う前に設定された通知も予約しておく。
+        if await self.bot.scheduler.migrated("bump"):
+            return
+        jobs = []
+        for key in self.IDS:
+            mode = self.IDS[key]["mode"]
+            for row in await self.get_all(mode):
+                try:
+                    data = loads(row[-1])
+                except Exception as e:
+                    if self.bot.test:
+                        print("Error on bump:", e)
+                else:
+                    if data.get("notification"):
+                        jobs.append((data["notification"], f"bump:{row[0]}:{mode}", [row[0], mode]))
+        await self.bot.scheduler.migrate("bump", jobs)
 
     async def write(
         self, mode: Literal["bump", "up"], guild_id: int,
@@ -222,7 +239,7 @@ class Bump(commands.Cog, DataManager):
         return embed
 
     def cog_unload(self):
-        self.notification.cancel()
+        self.bot.scheduler.unregister("bump")
 
     async def get_all(self, mode: str) -> tuple:
         return await self.execute(
@@ -232,47 +249,34 @@ class Bump(commands.Cog, DataManager):
 
     REPLIES = {"bump": "/bump", "up": "/dissoku up", "raise": "rf!raise"}
 
-    @tasks.loop(seconds=10)
-    async def notification(self):
-        now = time()
-        for key in self.IDS:
-            mode = self.IDS[key]["mode"]
-            for row in await self.get_all(mode):
-                row = list(row)
-                try:
-                    row[-1] = loads(row[-1])
-                except Exception as e:
-                    if self.bot.test:
-                        print("Error on bump:", e)
-                else:
-                    if "notification" in row[-1]:
-                        if (row[-1]["notification"] <= now
-                                and row[-1]["notification"] != 0):
-                            # もし通知時刻になっているなら通知をする。
-                            channel = self.bot.get_channel(
-                                int(row[-1]["channel"])
-                            )
-                            if channel:
-                                role = channel.guild.get_role(row[-1].get("role", 0))
-                                kwargs = {}
-                                if role:
-                                    kwargs["content"] = role.mention
-                                kwargs["embed"] = discord.Embed(
-                                    title=f"Time to {mode}!",
-                                    description=f"{mode}の時間です。\n"
-                                                f"`{self.REPLIES[mode]}`"
-                                                "でこのサーバーの表示順位を上げよう！",
-                                    color=self.bot.colors["normal"]
-                                )
-                                try:
-                                    await channel.send(**kwargs)
-                                except Exception as e:
-                                    if self.bot.test:
-                                        print("Error on bump2:", e)
-
-                                # 通知時刻をまた通知しないようにゼロにする。
-                                row[-1]["notification"] = 0
-                                await self.save(channel.guild.id, mode, row[-1])
+    async def notification(self, payload: list):
+        # スケジューラーから通知時刻に呼ばれて通知をする。
+        guild_id, mode = payload
+        row = await self.load(guild_id, mode)
+        if not row[-1].get("notification"):
+            return
+        channel = self.bot.get_channel(int(row[-1]["channel"]))
+        if channel:
+            role = channel.guild.get_role(row[-1].get("role", 0))
+            kwargs = {}
+            if role:
+                kwargs["content"] = role.mention
+            kwargs["embed"] = discord.Embed(
+                title=f"Time to {mode}!",
+                description=f"{mode}の時間です。\n"
+                            f"`{self.REPLIES[mode]}`"
+                            "でこのサーバーの表示順位を上げよう！",
+                color=self.bot.colors["normal"]
+            )
+            try:
+                await channel.send(**kwargs)
+            except Exception as e:
+                if self.bot.test:
+                    print("Error on bump2:", e)
+
+        # 通知時刻をまた通知しないようにゼロにする。
+        row[-1]["notification"] = 0
+        await self.save(guild_id, mode, row[-1])
 
     async def delay_on_message(self, seconds: int, message: discord.Message) -> None:
         # 遅れて再取得してもう一回on_messageを実行する。
@@ -284,7 +288,7 @@ class Bump(commands.Cog, DataManager):
         else:
             await self.on_message(message, True)
 
-    @commands.Cog.listener()
+    @route(dm=False)
     async def on_message(self, message: discord.Message, retry: bool = False):
         if not self.bot.is_ready():
             return
@@ -313,6 +317,10 @@ class Bump(commands.Cog, DataManager):
                 new["notification"] = time() + data["time"]
                 new["channel"] = message.channel.id
                 await self.save(message.guild.id, data["mode"], new)
+                await self.bot.scheduler.at(
+                    new["notification"], f"bump:{message.guild.id}:{data['mode']}",
+                    [message.guild.id, data["mode"]]
+                )
 
                 # 通知の設定をしたとメッセージを送る。
                 try:
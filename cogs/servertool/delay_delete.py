@@ -1,10 +1,10 @@
 # Free RT - Delay Delete Message
 
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import app_commands
 import discord
 
-from util import RT
+from util import RT, route
 from util.mysql_manager import DatabaseManager
 from time import time
 
@@ -40,9 +40,14 @@ class DataManager(DatabaseManager):
         if len(rows := await self._gets(cursor, channel_id)) >= self._maxsize:
             delete_target["MessageID"] = rows[-1][1]
             await cursor.delete(self.DB, delete_target)
+            await self.bot.scheduler.cancel(f"delay_delete:{channel_id}:{rows[-1][1]}")
         delete_target["MessageID"] = message_id
         delete_target["DeleteTime"] = int(time() + delay)
         await cursor.insert_data(self.DB, delete_target)
+        await self.bot.scheduler.at(
+            delete_target["DeleteTime"], f"delay_delete:{channel_id}:{message_id}",
+            [channel_id, message_id]
+        )
 
     async def reads(self, cursor) -> list:
         return [row async for row in cursor.get_datas(self.DB, {})
@@ -61,7 +66,13 @@ class DelayDelete(commands.Cog, DataManager):
     async def cog_load(self):
         super(commands.Cog, self).__init__(self.bot.mysql)
         await self.init_table()
-        self.delete_loop.start()
+        self.bot.scheduler.register("delay_delete", self.delete_message)
+        # スケジューラーを使う前に登録されたものも予約しておく。
+        if not await self.bot.scheduler.migrated("delay_delete"):
+            await self.bot.scheduler.migrate("delay_delete", (
+                (delete_time, f"delay_delete:{channel_id}:{message_id}", [channel_id, message_id])
+                for channel_id, message_id, delete_time in await self.reads()
+            ))
 
     @commands.hybrid_command(
         aliases=["dd", "遅延削除"], extras={
@@ -136,7 +147,10 @@ class DelayDelete(commands.Cog, DataManager):
         await self.write(ctx.channel.id, new.id, 60 * minutes)
         await ctx.message.delete()
 
-    @commands.Cog.listener()
+    @route(
+        bots=False, dm=False,
+        channel=lambda self, channel: "rf>delaydelete" in (getattr(channel, "topic", None) or "")
+    )
     async def on_message(self, message: discord.Message):
         if (not message.guild or message.author.bot
                 or isinstance(message.channel, discord.Thread)
@@ -156,22 +170,18 @@ class DelayDelete(commands.Cog, DataManager):
                     )
 
     def cog_unload(self):
-        self.delete_loop.cancel()
-
-    @tasks.loop(seconds=30)
-    async def delete_loop(self):
-        now = time()
-        for row in await self.reads():
-            if row[-1] <= now:
-                channel = self.bot.get_channel(row[0])
-                if channel:
-                    try:
-                        message = await channel.fetch_message(row[1])
-                        await message.delete()
-                    except Exception as e:
-                        if self.bot.test:
-                            print("Error on Delay Delete:", e)
-                await self.delete(row[0], row[1])
+        self.bot.scheduler.unregister("delay_delete")
+
+    async def delete_message(self, payload: list[int]):
+        # スケジューラーから呼ばれて遅延削除を行う。
+        channel_id, message_id = payload
+        if channel := self.bot.get_channel(channel_id):
+            try:
+                await channel.get_partial_message(message_id).delete()
+            except (discord.NotFound, discord.Forbidden) as e:
+                if self.bot.test:
+                    print("Error on Delay Delete:", e)
+        await self.delete(channel_id, message_id)
 
 
 async def setup(bot):
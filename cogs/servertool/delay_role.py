@@ -4,9 +4,11 @@ from __future__ import annotations
 
 from typing import Optional
 
+from asyncio import Event, Task, TimeoutError, wait_for
+from heapq import heappush, heappop
 from time import time
 
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import app_commands
 import discord
 
@@ -56,7 +58,7 @@ class DataManager(DatabaseManager):
                 (guild_id, role_id, delay, delay)
             )
 
-    async def delete(self, guild_id: int, cursor: Cursor = None) -> None:
+    async def delete_all(self, guild_id: int, cursor: Cursor = None) -> None:
         "指定されたサーバーのDelayRoleの設定を全て削除します。"
         await cursor.execute(
             "DELETE FROM DelayRole WHERE GuildID = %s;", (guild_id,)
@@ -80,7 +82,18 @@ class DelayRole(commands.Cog, DataManager):
         self.bot = bot
         self.recently: Cacher[int, list[int]] = self.bot.cachers.acquire(60.0, list)
         super(commands.Cog, self).__init__(self.bot.mysql.pool)
-        self.check_queue_deadline.start()
+        # サーバー毎のロールIDと遅延時間です。
+        self.settings: dict[int, dict[int, int]] = {}
+        # ロールを付与する時刻順のヒープです。(付与する時刻, サーバーID, メンバーID, ロールID)
+        self.heap: list[tuple[float, int, int, int]] = []
+        # サーバー毎のロールの付与待ちのメンバーと付与するロールです。
+        self.queues: dict[int, dict[int, set[int]]] = {}
+        self.workers: dict[int, Task] = {}
+        self._wakeup = Event()
+        self._runner: Optional[Task] = None
+
+    async def cog_load(self):
+        self._runner = self.bot.loop.create_task(self._run(), name="[DelayRole] Runner")
 
     @commands.hybrid_group(
         aliases=("delayRole", "dr", "遅延ロール", "ちろ"), extras={
@@ -99,9 +112,8 @@ class DelayRole(commands.Cog, DataManager):
         --------
         この機能は関係ない人にもロールが付与されることがあります。
         (この関係ない人は、既に遅延時間を超えていない人は含まれません)
-        「メンバー入室時に、そのメンバーをロール付与の対象としてセーブデータに書き込み、しばらくした後に、そのセーブデータに書き込まれているメンバーにロールを付与する。」
-        というような仕組みではなく「定期的に、メンバー全員をチェックする。チェック内容は、現在の時間とメンバーの入室時間の差が、遅延時間より多いかどうかです。もし多い場合は、そのメンバーにロールを付与する。」という仕組みとなっています。
-        セーブデータが肥大化するのを避けるための解決方法です。
+        メンバー入室時にロールを付与する時刻を予約する他に、設定をした時とRTの起動時にメンバー全員をチェックして、\
+        入室してから遅延時間が経過していてロールを持っていないメンバーにロールを付与するためです。
         ご了承ください。
 
         Aliases
@@ -119,13 +131,8 @@ class DelayRole(commands.Cog, DataManager):
         --------
         This feature may also grant roles to unrelated people.
         (These unrelated people do not include those who have not already exceeded the delay time.)
-        "When a member enters a server, the member is written into the saved data as a role grantee, \
-        and a short time later, the role is granted to the member whose saved data is being written \
-        into the saved data."
-        Instead of such a mechanism, "Periodically, all members are checked. The check is whether the \
-        difference between the current time and the member's entry time is more than the delay time. 
-        If it is more, the member is given a role." This is how the system works.
-        This is a solution to avoid save data bloat.
+        Besides scheduling the grant when a member joins, all members are checked when the setting is made \
+        and when RT starts, and members who joined more than the delay time ago and do not have the role are given it.
         Please understand this.
 
         Aliases
@@ -174,7 +181,6 @@ class DelayRole(commands.Cog, DataManager):
         delay : int
             何秒遅延するかです。
             もし日付等で指定したい場合は`rf!calc 式`で計算ができるのでそれを使ったりして秒数に計算してください。
-            三十五秒以下にすると大幅に付与が遅れます。
         role : ロールの名前かメンションまたはID
             付与するロールです。
 
@@ -196,7 +202,6 @@ class DelayRole(commands.Cog, DataManager):
             The number of seconds to delay.
             If you want to specify a date, you can use `rf!calc expression` \
             to calculate the number of seconds.
-            If it is less than 35 seconds, the grant is significantly delayed.
         role : role name, mentions or ID
             The role to be granted.
 
@@ -209,6 +214,8 @@ class DelayRole(commands.Cog, DataManager):
         s"""
         await ctx.typing()
         await self.write(ctx.guild.id, role.id, delay)
+        self.settings.setdefault(ctx.guild.id, {})[role.id] = delay
+        self._reconcile(ctx.guild, role.id, delay)
         await ctx.reply("Ok")
 
     @delayrole.command(aliases=("del", "d", "削除"))
@@ -242,38 +249,117 @@ class DelayRole(commands.Cog, DataManager):
         del, d"""
         await ctx.typing()
         await self.write(ctx.guild.id, role.id, None)
+        self.settings.get(ctx.guild.id, {}).pop(role.id, None)
         await ctx.reply("Ok")
 
-    @tasks.loop(seconds=30)
-    async def check_queue_deadline(self):
-        # キューの処理を行います。
-        now, guild = time(), None
-        async with self.pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                for guild_id, role_id, delay in await self.reads(cursor):
-                    if guild is None:
-                        guild = self.bot.get_guild(guild_id)
-                    # もしサーバーが見つからないのなら設定を削除する。
-                    if guild is None:
-                        await self.delete(guild_id, cursor)
-                        continue
-                    # もしロールが見つからないのなら設定を削除する。
-                    if (role := guild.get_role(role_id)) is None:
-                        await self.write(guild_id, role_id, None, cursor)
-
-                    # ロール付与対象を探しロールを付与する。
-                    for member in guild.members:
-                        if not member.bot and member.get_role(role_id) is None \
-                                and now - member.joined_at.timestamp() > delay:
-                            # もしメンバーが参加後しばらく経過していてロール付与対象の場合はロールを付与する。
-                            try: 
-                                await member.add_roles(role)
-                            except Exception:
-                                ...
-                    guild = None
+    def _push(self, guild_id: int, member_id: int, role_id: int, due: float, now: float) -> None:
+        # ロールを付与する時刻を過ぎていればキューに、そうでなければヒープに入れる。
+        if due <= now:
+            self._enqueue(guild_id, member_id, role_id)
+        else:
+            heappush(self.heap, (due, guild_id, member_id, role_id))
+            if self.heap[0][0] == due:
+                self._wakeup.set()
+
+    def _reconcile(self, guild: discord.Guild, role_id: int, delay: int) -> None:
+        # まだロールを持っていないメンバーを全員探して、ロールを付与する時刻を予約する。
+        now = time()
+        for member in guild.members:
+            if not member.bot and member.joined_at is not None and member.get_role(role_id) is None:
+                self._push(guild.id, member.id, role_id, member.joined_at.timestamp() + delay, now)
+
+    async def _check(self, guild_id: int, role_id: int) -> Optional[discord.Guild]:
+        # サーバーとロールがあるか確認して、ないなら設定を削除する。
+        if (guild := self.bot.get_guild(guild_id)) is None:
+            self.settings.pop(guild_id, None)
+            await self.delete_all(guild_id)
+        elif guild.get_role(role_id) is None:
+            self.settings.get(guild_id, {}).pop(role_id, None)
+            await self.write(guild_id, role_id, None)
+        else:
+            return guild
+
+    def _due(self, guild_id: int, member_id: int, role_id: int, now: float) -> None:
+        # 付与する時刻になったものを確認してキューに入れる。
+        if (delay := self.settings.get(guild_id, {}).get(role_id)) is None \
+                or (guild := self.bot.get_guild(guild_id)) is None \
+                or (member := guild.get_member(member_id)) is None \
+                or member.joined_at is None or member.get_role(role_id) is not None:
+            return
+        # 遅延時間が変更されている場合があるので付与する時刻を計算し直す。
+        self._push(guild_id, member_id, role_id, member.joined_at.timestamp() + delay, now)
+
+    def _enqueue(self, guild_id: int, member_id: int, role_id: int) -> None:
+        # ロールの付与をキューに入れる。
+        self.queues.setdefault(guild_id, {}).setdefault(member_id, set()).add(role_id)
+        if guild_id not in self.workers:
+            self.workers[guild_id] = self.bot.loop.create_task(
+                self._work(guild_id), name=f"[DelayRole] Worker: {guild_id}"
+            )
+
+    async def _work(self, guild_id: int) -> None:
+        # キューにあるロールの付与をサーバー毎に一つずつ行う。
+        # ロールの付与のレート制限はサーバー毎なので、レート制限で待たされても他のサーバーの付与は遅れない。
+        queue = self.queues[guild_id]
+        try:
+            while queue:
+                member_id = next(iter(queue))
+                role_ids = queue.pop(member_id)
+                if (guild := self.bot.get_guild(guild_id)) is None:
+                    break
+                if (member := guild.get_member(member_id)) is None:
+                    continue
+                roles = [
+                    role for role_id in role_ids
+                    if (role := guild.get_role(role_id)) is not None
+                    and member.get_role(role_id) is None
+                ]
+                if roles:
+                    try:
+                        await member.add_roles(*roles)
+                    except discord.HTTPException:
+                        ...
+        finally:
+            del self.queues[guild_id], self.workers[guild_id]
+
+    async def _run(self) -> None:
+        # 起動時に一度だけメンバー全員を確認して、その後は付与する時刻になるまで待つ。
+        await self.bot.wait_until_ready()
+        for guild_id, role_id, delay in await self.reads():
+            self.settings.setdefault(guild_id, {})[role_id] = delay
+        for guild_id, roles in list(self.settings.items()):
+            for role_id, delay in list(roles.items()):
+                if (guild := await self._check(guild_id, role_id)) is not None:
+                    self._reconcile(guild, role_id, delay)
+        while True:
+            now = time()
+            while self.heap and self.heap[0][0] <= now:
+                _, guild_id, member_id, role_id = heappop(self.heap)
+                self._due(guild_id, member_id, role_id, now)
+            self._wakeup.clear()
+            try:
+                await wait_for(
+                    self._wakeup.wait(), self.heap[0][0] - now if self.heap else None
+                )
+            except TimeoutError:
+                ...
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if not member.bot and member.joined_at is not None \
+                and (roles := self.settings.get(member.guild.id)):
+            now = time()
+            for role_id, delay in roles.items():
+                self._push(
+                    member.guild.id, member.id, role_id,
+                    member.joined_at.timestamp() + delay, now
+                )
 
     def cog_unload(self):
-        self.check_queue_deadline.cancel()
+        if self._runner is not None:
+            self._runner.cancel()
+        for worker in list(self.workers.values()):
+            worker.cancel()
 
 
 async def setup(bot):
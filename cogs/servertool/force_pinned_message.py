@@ -9,7 +9,7 @@ from discord.ext import commands, tasks
 from discord import app_commands
 import discord
 
-from util import RT
+from util import RT, route
 from util.mysql_manager import DatabaseManager as OldDatabaseManager
 from util import DatabaseManager, markdowns
 
@@ -269,7 +269,7 @@ class ForcePinnedMessage(commands.Cog, DataManager):
         else:
             await ctx.reply("インターバルは五秒から三時間までしか設定できません。")
 
-    @commands.Cog.listener()
+    @route(dm=False)
     async def on_message(self, message: discord.Message):
         if not message.guild or "- RT" in message.author.name or not self.bot.is_ready():
             return
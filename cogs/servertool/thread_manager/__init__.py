@@ -5,6 +5,8 @@ from typing import TYPE_CHECKING
 from discord.ext import commands
 import discord
 
+from util import route
+
 from asyncio import sleep
 
 from .constants import MAX_CHANNELS, HELP
@@ -401,7 +403,7 @@ class ThreadManager(commands.Cog, DataManager):
                 lang, *HELP[lang]
             )
 
-    @commands.Cog.listener()
+    @route(own=False, channel=lambda self, channel: "rt>thread" in (getattr(channel, "topic", None) or ""))
     async def on_message(self, message: discord.Message):
         if (hasattr(message.channel, "topic") and message.channel.topic
                 and "rt>thread" in message.channel.topic
@@ -6,7 +6,7 @@ from discord.ext import commands
 from discord import app_commands
 import discord
 
-from util import RT
+from util import RT, route
 from util.mysql_manager import DatabaseManager
 
 from re import findall
@@ -134,7 +134,7 @@ class Expander(commands.Cog, DataManager):
             await self.set_ignore(ctx.channel.id, onoff)
         await ctx.reply("Ok")
 
-    @commands.Cog.listener()
+    @route(bots=False, dm=False)
     async def on_message(self, message: discord.Message):
         if not message.guild or message.author.bot:
             return
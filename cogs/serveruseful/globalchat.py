@@ -12,8 +12,10 @@ from discord.ext import commands
 from discord import app_commands
 import discord
 
+from asyncio import Semaphore, gather
 from collections import defaultdict
 from util.mysql_manager import DatabaseManager
+from util import route
 from functools import wraps
 from time import time
 
@@ -35,44 +37,28 @@ class DataManager(DatabaseManager):
         )
 
     async def load_globalchat_name(self, cursor, channel_id: int) -> list:
-        target = {"ChannelID": channel_id}
-        if await cursor.exists("globalChat", target):
-            return await cursor.get_data("globalChat", target)
-        else:
-            return ()
+        return await cursor.get_data("globalChat", {"ChannelID": channel_id}) or ()
+
+    async def load_all_globalchat(self, cursor) -> list:
+        return [data async for data in cursor.get_datas("globalChat", {}) if data]
 
     async def load_globalchat_channels(self, cursor, name: str) -> list:
-        target = {"Name": name}
-        if await cursor.exists("globalChat", target):
-            return [
-                data
-                async for data in cursor.get_datas(
-                    "globalChat", target
-                )
-            ]
-        else:
-            return []
+        return [
+            data async for data in cursor.get_datas("globalChat", {"Name": name}) if data
+        ]
 
     async def make_globalchat(self, cursor, name: str, channel_id: int, extras: dict) -> None:
         target = {"Name": name, "ChannelID": channel_id, "Extras": extras}
-        if await cursor.exists("globalChat", {"Name": name}):
+        if not await cursor.insert_unique("globalChat", target, {"Name": name}):
             raise ValueError("既に追加されています。")
-        else:
-            await cursor.insert_data("globalChat", target)
 
     async def connect_globalchat(self, cursor, name: str, channel_id: int, extras: dict) -> None:
         target = {"Name": name, "ChannelID": channel_id}
-        if await cursor.exists("globalChat", target):
+        if not await cursor.insert_unique("globalChat", {**target, "Extras": extras}, target):
             raise ValueError("既に接続しています。")
-        else:
-            target["Extras"] = extras
-            await cursor.insert_data("globalChat", target)
 
     async def disconnect_globalchat(self, cursor, name: str, channel_id: int) -> None:
-        target = {"Name": name, "ChannelID": channel_id}
-        if await cursor.exists("globalChat", target):
-            await cursor.delete("globalChat", target)
-        else:
+        if not await cursor.delete("globalChat", {"Name": name, "ChannelID": channel_id}):
             raise ValueError(
                 "そのグローバルチャットは存在していないまたはチャンネルは接続していません。"
             )
@@ -84,7 +70,7 @@ class DataManager(DatabaseManager):
         target = {"Name": name}
         change = {"Extras": extras}
         if await cursor.exists("globalChat", target):
-            await cursor.update("globalChat", change, target)
+            await cursor.update_data("globalChat", change, target)
         else:
             raise ValueError("グローバルチャットが存在しません。")
 
@@ -108,7 +94,7 @@ def require_guild(coro):
 def require_globalchat(coro):
     @wraps(coro)
     async def new_coro(self, ctx, *args, **kwargs):
-        if (row := await self.load_globalchat_name(ctx.channel.id)):
+        if (row := self.get_route(ctx.channel.id)):
             ctx.row = row
             return await coro(self, ctx, *args, **kwargs)
         else:
@@ -123,16 +109,39 @@ class GlobalChat(commands.Cog, DataManager):
     def __init__(self, bot: "Backend"):
         self.bot = bot
         self.blocking = {}
-        self.ban_cache = defaultdict(list)
         self.ygc = ygclib.YGC(bot)
         self.share = 707158257818664991
         self.badword = ["discord.gg", "discord.com/invite", "discordapp.net/invite"]
+        # チャンネルIDからグローバルチャットの行と、名前からその全チャンネルの行を引くための索引です。
+        self.routes: dict[int, list] = {}
+        self.rooms: defaultdict[str, list[list]] = defaultdict(list)
+        self.send_limit = Semaphore(self.SEND_CONCURRENCY)
+
+    SEND_CONCURRENCY = 8
 
     async def cog_load(self):
         super(commands.Cog, self).__init__(
             self.bot.mysql
         )
         await self.init_table()
+        await self.reload_routes()
+
+    async def reload_routes(self) -> None:
+        "グローバルチャットの接続情報をデータベースから読み込み直します。"
+        routes, rooms = {}, defaultdict(list)
+        for row in await self.load_all_globalchat():
+            routes[row[1]] = row
+            rooms[row[0]].append(row)
+        self.routes, self.rooms = routes, rooms
+        # 送信時にBANのリストを取得しなくて済むように先に取得しておく。
+        for channel_id in routes:
+            if (channel := self.bot.get_channel(channel_id)) \
+                    and channel.guild.id not in self.bot.bans.bans:
+                self.bot.bans.prefetch(channel.guild)
+
+    def get_route(self, channel_id: int) -> Optional[list]:
+        "チャンネルが接続しているグローバルチャットの行を取得します。"
+        return self.routes.get(channel_id)
 
     @commands.hybrid_group(
         aliases=["gc", "ぐろちゃ", "ぐろーばるちゃっと"],
@@ -177,6 +186,7 @@ class GlobalChat(commands.Cog, DataManager):
             await self.make_globalchat(
                 name, ctx.channel.id, {"author": ctx.author.id}
             )
+            await self.reload_routes()
         except ValueError:
             await ctx.reply(
                 {"ja": "そのグローバルチャットは既に存在します。",
@@ -207,6 +217,7 @@ class GlobalChat(commands.Cog, DataManager):
         ..."""
         if ctx.row[-1]["author"] == ctx.author.id:
             await self.delete_globalchat(ctx.row[0])
+            await self.reload_routes()
             await ctx.channel.edit(topic=None)
             await ctx.reply({"ja": "削除しました。", "en": "Success!"})
         else:
@@ -248,7 +259,7 @@ class GlobalChat(commands.Cog, DataManager):
             if ctx.channel.topic and "RT-GlobalChat" in ctx.channel.topic:
                 await ctx.reply("既に接続しています。")
             else:
-                rows = await self.load_globalchat_channels(name)
+                rows = self.rooms.get(name) or await self.load_globalchat_channels(name)
                 extras = rows[0][-1]
                 try:
                     await ctx.channel.edit(topic="RT-GlobalChat")
@@ -256,6 +267,7 @@ class GlobalChat(commands.Cog, DataManager):
                     await ctx.reply("権限がないのでチャンネルの編集に失敗しました。")
                 else:
                     await self.connect_globalchat(name, ctx.channel.id, extras)
+                    await self.reload_routes()
                     await ctx.reply("Ok")
                     # 入室メッセージを送信する。
                     message = ctx.message
@@ -285,8 +297,9 @@ class GlobalChat(commands.Cog, DataManager):
         Aliases
         -------
         dis, leave, bye"""
-        if (row := await self.load_globalchat_name(ctx.channel.id)):
+        if (row := self.get_route(ctx.channel.id)):
             await self.disconnect_globalchat(row[0], ctx.channel.id)
+            await self.reload_routes()
             await ctx.channel.edit(topic=None)
             await ctx.reply(
                 {"ja": "グローバルチャットから切断しました。",
@@ -307,7 +320,7 @@ class GlobalChat(commands.Cog, DataManager):
 
     async def send(self, message: discord.Message, row: list) -> None:
         # グローバルチャットにメッセージを送る。
-        rows = await self.load_globalchat_channels(row[0])
+        rows = self.rooms.get(row[0], ())
 
         # もし返信先があるメッセージなら返信先のEmbedを作っておく。
         if message.author.id in (888057396310716496,):
@@ -343,38 +356,46 @@ class GlobalChat(commands.Cog, DataManager):
                     .set_footer(text="添付されたスタンプ")
                 )
 
+        # 添付ファイルは一度だけダウンロードして全てのチャンネルで使い回す。
+        try:
+            attachments = await gather(*(
+                self._read_attachment(attachment) for attachment in message.attachments
+            ))
+        except Exception as e:
+            print("Error on global chat :", e)
+            attachments = []
+
         # 送る。
-        for _, channel_id, _ in rows:
-            if message.channel.id == channel_id:
-                continue
-            else:
-                channel = self.bot.get_channel(channel_id)
-                if channel:
-                    try:
-                        if channel.guild.id not in self.ban_cache:
-                            async for entry in channel.guild.bans():
-                                self.ban_cache[channel.guild.id].append(
-                                    entry.user.id
-                                )
-                    except Exception as e:
-                        print("Error on global chat :", e)
-                    if all(
-                        user_id != message.author.id
-                        for user_id in self.ban_cache[channel.guild.id]
-                    ):
-                        try:
-                            await channel.webhook_send(
-                                username=f"{message.author.name} {message.author.id} (mID:{message.id})",
-                                avatar_url=getattr(message.author.display_avatar, "url", ""),
-                                content=message.clean_content, embeds=embeds, files=[
-                                    await attachment.to_file()
-                                    for attachment in message.attachments
-                                ]
-                            )
-                        except Exception as e:
-                            print("Error on global chat :", e)
+        await gather(*(
+            self._send_channel(channel, message, embeds, attachments)
+            for _, channel_id, _ in rows
+            if message.channel.id != channel_id
+            and (channel := self.bot.get_channel(channel_id))
+        ))
+
+    async def _read_attachment(self, attachment):
+        # 添付ファイルを読み込む。
+        return attachment.filename, await attachment.read(), attachment.is_spoiler()
+
+    async def _send_channel(self, channel, message, embeds, attachments):
+        # 一つのチャンネルにメッセージを送る。同時に送る数は`SEND_CONCURRENCY`までにする。
+        if not await self.bot.bans.is_banned(channel.guild, message.author.id):
+            async with self.send_limit:
+                try:
+                    await channel.webhook_send(
+                        username=f"{message.author.name} {message.author.id} (mID:{message.id})",
+                        avatar_url=getattr(message.author.display_avatar, "url", ""),
+                        content=message.clean_content, embeds=embeds, files=[
+                            discord.File(io.BytesIO(data), filename, spoiler=spoiler)
+                            for filename, data, spoiler in attachments
+                        ]
+                    )
+                except Exception as e:
+                    print("Error on global chat :", e)
 
-    @commands.Cog.listener()
+    @route(dm=False, channel=lambda self, channel: channel.id == self.share or (
+        not isinstance(channel, discord.Thread) and "RT-GlobalChat" in (channel.topic or "")
+    ))
     async def on_message(self, message: discord.Message):
         if (not message.guild or isinstance(message.channel, discord.Thread)
                 or (not message.channel.topic and not message.channel.id == self.share) or (message.author.bot and not message.channel.id == self.share)
@@ -382,7 +403,7 @@ class GlobalChat(commands.Cog, DataManager):
             return
         if any(bad_word in message.content for bad_word in self.badword):
             return await message.add_reaction("❎")
-        row = await self.load_globalchat_name(message.channel.id)
+        row = self.get_route(message.channel.id)
         mc = ""
         if row or message.channel.id == self.share:
             if message.channel.id == self.share:
@@ -415,8 +436,7 @@ class GlobalChat(commands.Cog, DataManager):
             if message.channel.id == self.share and message.author.id != self.bot.user.id:
                 data = ujson.loads(message.content)
                 if "type" in data and data["type"] == "delete":
-                    rows = await self.load_globalchat_channels("main")
-                    for _, channel_id, _ in rows:
+                    for _, channel_id, _ in self.rooms.get("main", ()):
                         channel = self.bot.get_channel(channel_id)
                         if channel:
                             try:
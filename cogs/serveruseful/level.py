@@ -5,13 +5,18 @@ from __future__ import annotations
 from typing import NewType, TypedDict, Literal, Optional
 
 from dataclasses import dataclass
+from asyncio import Event
+from time import time
 
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 import discord
 
+from sortedcontainers import SortedList
+from aiomysql import Cursor
+
 from util.page import EmbedPage
-from util import RT, Table
+from util import RT, Table, DatabaseManager, Cacher, route
 
 
 Exp, Level = NewType("Exp", int), NewType("Level", int)
@@ -35,6 +40,7 @@ class LocalLevel(Table):
     __allocation__ = "GuildID"
     onoff: bool
     nof: bool
+    # 旧形式のメンバーのレベルのデータです。起動時に`LocalLevelStore`に移行されます。
     data: dict[int, LevelData]
     reward: dict[str, Reward]
 
@@ -51,6 +57,238 @@ class Data:
     g: GlobalLevel
 
 
+MemberKey = tuple[int, int]
+
+
+class Leaderboard:
+    """レベルのランキングを保持するためのクラスです。
+    更新・順位の取得・ページの取得はどれも全体を走査せずに行えます。
+    `limit`を指定した場合は上位の`limit`人だけを保持します。"""
+
+    def __init__(
+        self, rows: Optional[list[tuple[int, LevelData]]] = None,
+        limit: Optional[int] = None
+    ):
+        self.entries: dict[int, tuple[int, int, int]] = {}
+        # 上位から順に並ぶように符号を反転させたものを入れる。
+        self.ranking = SortedList()
+        for user_id, now in rows or ():
+            self.entries[user_id] = self._entry(user_id, now)
+        self.ranking.update(self.entries.values())
+        self.limit = limit
+        # 全員を保持していない場合の一番下の順位のものです。これより下の人はランキングにいません。
+        self.cutoff = self.ranking[-1] \
+            if limit is not None and len(self.ranking) >= limit else None
+
+    def _entry(self, user_id, now):
+        return (-now["level"], -now["exp"], user_id)
+
+    def update(self, user_id: int, now: LevelData) -> None:
+        "ユーザーのレベルを更新します。"
+        if (old := self.entries.pop(user_id, None)) is not None:
+            self.ranking.remove(old)
+        entry = self._entry(user_id, now)
+        if self.cutoff is not None and entry > self.cutoff:
+            # ランキングにいない順位の場合は保持しない。
+            return
+        self.entries[user_id] = entry
+        self.ranking.add(entry)
+        if self.limit is not None and len(self.ranking) > self.limit:
+            del self.entries[self.ranking.pop()[2]]
+            self.cutoff = self.ranking[-1]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        "ユーザーの順位を取得します。ランキングにいない場合は`None`を返します。"
+        if (entry := self.entries.get(user_id)) is None:
+            return None
+        return self.ranking.index(entry) + 1
+
+    def page(self, page: int, size: int = 10) -> list[tuple[int, LevelData]]:
+        "ランキングの指定されたページ(0から始まる)を取得します。"
+        return [
+            (user_id, LevelData(exp=-exp, level=-level))
+            for level, exp, user_id in self.ranking[page * size:(page + 1) * size]
+        ]
+
+    def __len__(self) -> int:
+        return len(self.ranking)
+
+
+class LocalLevelStore(DatabaseManager):
+    """サーバー毎のメンバーのレベルを一人一行で保存するためのクラスです。
+    経験値の変更はメモリ上に溜められ、定期的にまとめて書き込まれます。
+    テーブルの作成と旧形式のデータの移行が終わるまでは読み込みと書き込みを待ちます。"""
+
+    TABLE = "LocalLevelMembers"
+    FLUSH_SIZE = 1000
+    FLUSH_CHUNK = 500
+
+    def __init__(self, cog: Level):
+        self.cog, self.pool = cog, cog.bot.mysql.pool
+        self.cache = cog.bot.cachers.acquire(600.0)
+        # 書き込まれていない変更です。キャッシュの期限が切れても消えないように値も一緒に持っておく。
+        self.dirty: dict[MemberKey, LevelData] = {}
+        # 書き込み中の変更です。
+        self._writing: dict[MemberKey, LevelData] = {}
+        self._flushing = False
+        self._idle = Event()
+        self._idle.set()
+        # テーブルの作成と移行が終わったかどうかです。
+        self.ready = Event()
+        self._flush.start()
+
+    async def prepare(self) -> None:
+        "テーブルを準備して、旧形式のデータがあれば移行します。"
+        await self.cog.data.l.locked.wait()
+        await self._prepare_table()
+        self.ready.set()
+
+    async def _prepare_table(self, cursor: Cursor = None):
+        await cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                GuildID BIGINT NOT NULL, UserID BIGINT NOT NULL,
+                Exp BIGINT NOT NULL DEFAULT 0, Level INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (GuildID, UserID),
+                INDEX Ranking (GuildID, Level, Exp)
+            );"""
+        )
+        for guild_id, row in list(self.cog.data.l.to_dict().items()):
+            if row.get("data"):
+                await self._migrate(cursor, guild_id, row["data"])
+                del self.cog.data.l[guild_id].data
+
+    async def _migrate(self, cursor, guild_id, data):
+        # 一つのサーバーの旧形式のデータを移行する。既に移行済みのものは上書きしない。
+        self.cog.bot.print("[Level]", "[migrate]", guild_id, f"{len(data)} members")
+        rows = [
+            (guild_id, int(user_id), now["exp"], now["level"])
+            for user_id, now in data.items()
+        ]
+        for i in range(0, len(rows), self.FLUSH_CHUNK):
+            chunk = rows[i:i + self.FLUSH_CHUNK]
+            await cursor.execute(
+                f"INSERT IGNORE INTO {self.TABLE} VALUES "
+                f"{', '.join(('(%s, %s, %s, %s)',) * len(chunk))};",
+                [value for row in chunk for value in row]
+            )
+
+    async def get(self, guild_id: int, user_id: int) -> LevelData:
+        "メンバーのレベルを取得します。"
+        if (now := self._unwritten((guild_id, user_id))) is not None:
+            return now.copy()
+        if (guild_id, user_id) in self.cache:
+            return self.cache[(guild_id, user_id)].copy()
+        # 移行前のデータを読んでしまわないように移行が終わるのを待つ。
+        await self.ready.wait()
+        return await self._get(guild_id, user_id)
+
+    async def _get(self, guild_id: int, user_id: int, cursor: Cursor = None) -> LevelData:
+        if (now := self._unwritten((guild_id, user_id))) is not None:
+            return now.copy()
+        if (guild_id, user_id) in self.cache:
+            return self.cache[(guild_id, user_id)].copy()
+        await cursor.execute(
+            f"SELECT Exp, Level FROM {self.TABLE} WHERE GuildID = %s AND UserID = %s;",
+            (guild_id, user_id)
+        )
+        row = await cursor.fetchone()
+        now = LevelData(exp=row[0], level=row[1]) if row else FIRST_LEVEL.copy()
+        self.cache[(guild_id, user_id)] = now
+        return now.copy()
+
+    def _unwritten(self, key: MemberKey) -> Optional[LevelData]:
+        # まだ書き込まれていない変更を取得する。
+        return self.dirty.get(key) or self._writing.get(key)
+
+    def set(self, guild_id: int, user_id: int, now: LevelData) -> None:
+        "メンバーのレベルを設定します。データベースへの書き込みは後でまとめて行われます。"
+        self.cache[(guild_id, user_id)] = now
+        self.dirty[(guild_id, user_id)] = now
+        if len(self.dirty) >= self.FLUSH_SIZE and not self._flushing:
+            self.cog.bot.loop.create_task(self.flush())
+
+    async def _flushed(self, guild_id: int) -> None:
+        # 書き込み中のものが終わるのを待ってから、サーバーの溜まっている変更を書き込む。
+        await self.ready.wait()
+        await self._idle.wait()
+        if any(key[0] == guild_id for key in self.dirty):
+            await self.flush()
+            await self._idle.wait()
+
+    async def get_top(self, guild_id: int, limit: int) -> list[tuple[int, LevelData]]:
+        "サーバーのレベルの上位のメンバーを取得します。"
+        await self._flushed(guild_id)
+        return await self._get_top(guild_id, limit)
+
+    async def _get_top(
+        self, guild_id: int, limit: int, cursor: Cursor = None
+    ) -> list[tuple[int, LevelData]]:
+        await cursor.execute(
+            f"""SELECT UserID, Exp, Level FROM {self.TABLE} WHERE GuildID = %s
+                ORDER BY Level DESC, Exp DESC LIMIT %s;""",
+            (guild_id, limit)
+        )
+        return [
+            (row[0], LevelData(exp=row[1], level=row[2]))
+            for row in await cursor.fetchall()
+        ]
+
+    async def get_rank(self, guild_id: int, now: LevelData) -> int:
+        "サーバーでのレベルの順位を取得します。"
+        await self._flushed(guild_id)
+        return await self._get_rank(guild_id, now)
+
+    async def _get_rank(self, guild_id: int, now: LevelData, cursor: Cursor = None) -> int:
+        await cursor.execute(
+            f"""SELECT COUNT(*) FROM {self.TABLE} WHERE GuildID = %s
+                AND (Level > %s OR (Level = %s AND Exp > %s));""",
+            (guild_id, now["level"], now["level"], now["exp"])
+        )
+        return (await cursor.fetchone())[0] + 1
+
+    async def flush(self, cursor: Cursor = None) -> None:
+        "溜まっている変更をまとめて書き込みます。"
+        if self._flushing or not self.dirty or not self.ready.is_set():
+            return
+        self._flushing = True
+        self._idle.clear()
+        dirty, self.dirty = self.dirty, {}
+        self._writing = dirty
+        rows = [(*key, now["exp"], now["level"]) for key, now in dirty.items()]
+        try:
+            for i in range(0, len(rows), self.FLUSH_CHUNK):
+                chunk = rows[i:i + self.FLUSH_CHUNK]
+                await cursor.execute(
+                    f"""INSERT INTO {self.TABLE} VALUES
+                        {', '.join(('(%s, %s, %s, %s)',) * len(chunk))}
+                        ON DUPLICATE KEY UPDATE
+                            Exp = VALUES(Exp), Level = VALUES(Level);""",
+                    [value for row in chunk for value in row]
+                )
+        except Exception:
+            # 次回書き込めるように戻しておく。書き込み中に更に変更されたものはそちらを優先する。
+            for key, now in dirty.items():
+                self.dirty.setdefault(key, now)
+            raise
+        finally:
+            self._writing = {}
+            self._flushing = False
+            self._idle.set()
+
+    @tasks.loop(seconds=10)
+    async def _flush(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            # 失敗しても変更は残っているので、次の書き込みでもう一度試す。
+            self.cog.bot.print("[Level]", "[flush.error]", f"{len(self.dirty)} members:", e)
+
+    def close(self) -> None:
+        "コグのアンロード時に呼び出されるべき関数です。"
+        self._flush.cancel()
+        self.cog.bot.loop.create_task(self.flush())
+
+
 cooldown = commands.cooldown(1, 5, commands.BucketType.guild)
 
 
@@ -58,9 +296,16 @@ class Level(commands.Cog):
     def __init__(self, bot: RT):
         self.bot = bot
         self.data = Data(LocalLevel(bot), GlobalLevel(bot))
+        self.store = LocalLevelStore(self)
+        # ランキングは最初に必要になった時に作られます。
+        self.boards: Cacher[int, Leaderboard] = self.bot.cachers.acquire(3600.0)
+        self.global_board: Optional[Leaderboard] = None
 
     async def cog_load(self):
-        self.bot.prefixes = tuple(await self.bot.command_prefix())
+        self.bot.loop.create_task(self.store.prepare())
+
+    async def cog_unload(self):
+        self.store.close()
 
     def get_now(self, data: LevelData) -> str:
         return f"Level:`{data['level']}`, Exp:`{data['exp']}`"
@@ -105,8 +350,7 @@ class Level(commands.Cog):
                     name={"ja": f"{ctx.guild.name}でのレベル",
                           "en": f"{ctx.guild.name} Level"},
                     value=self.get_now(
-                        self.data.l[ctx.guild.id].get('data', {})
-                        .get(str(ctx.author.id), FIRST_LEVEL)
+                        await self.store.get(ctx.guild.id, ctx.author.id)
                     )
                 ).add_field(
                     name={"ja": "グローバルでのレベル", "en": "Global Level"},
@@ -124,19 +368,43 @@ class Level(commands.Cog):
         3: "<:No3:795849531840397323>"
     }
 
+    RANKING_PAGES = 10
+
     def make_ranking_embed(
-        self, rank: int, fields: list[tuple[str, str]]
+        self, page: int, fields: list[tuple[str, str]], rank: Optional[int]
     ) -> discord.Embed:
         "ランキング用の埋め込みを作ります。"
         embed = discord.Embed(
             title="ランキング ",
-            description=f"{rank/10}ページ目",
+            description=f"{page}ページ目",
             color=self.bot.Colors.normal
         )
         for name, value in fields:
             embed.add_field(name=name, value=value)
+        embed.set_footer(text=f"あなたの順位：{'？' if rank is None else rank}位")
         return embed
 
+    async def get_board(self, mode: UserMode, guild_id: int) -> Leaderboard:
+        "ランキングを取得します。まだ作られていない場合は作ります。"
+        if mode == "global":
+            if self.global_board is None:
+                await self.data.g.locked.wait()
+                self.global_board = Leaderboard([
+                    (user_id, row["level"])
+                    for user_id, row in list(self.data.g.to_dict().items())
+                    if "level" in row
+                ])
+            return self.global_board
+        if guild_id in self.boards:
+            # 使われている間は消さないようにする。
+            self.boards.get_raw(guild_id).deadline = time() + self.boards.lifetime
+        else:
+            limit = self.RANKING_PAGES * 10
+            self.boards[guild_id] = Leaderboard(
+                await self.store.get_top(guild_id, limit), limit
+            )
+        return self.boards[guild_id]
+
     @level.command(
         aliases=["rank", "r", "ランキング", "ランク"],
         description="レベルのランキングを表示します。"
@@ -170,33 +438,25 @@ class Level(commands.Cog):
         Aliases
         -------
         rank, r"""
-        if (mode == "server" and (
-            data := self.data.l[ctx.guild.id].get("data")
-        ) is not None) or (data := {
-            key: value.get("level", dict(level=0, exp=0))
-            for key, value in self.data.g.to_dict().items()
-        }):
-            fields, embeds = [], []
-            for rank, (user_id, data) in enumerate(
-                reversed(sorted(data.items(), key=lambda x: x[1]["level"])), 1
-            ):
-                fields.append(
+        if board := await self.get_board(mode, ctx.guild.id):
+            embeds, my_rank = [], board.rank(ctx.author.id)
+            if my_rank is None and mode == "server":
+                # ランキングにいない場合はデータベースで数える。
+                my_rank = await self.store.get_rank(
+                    ctx.guild.id, await self.store.get(ctx.guild.id, ctx.author.id)
+                )
+            for page in range(self.RANKING_PAGES):
+                if not (rows := board.page(page)):
+                    break
+                embeds.append(self.make_ranking_embed(page + 1, [
                     (
                         f"{self.EMOJIS.get(rank, f'{rank}位')}",
                         "{}：`{}`".format(
                             getattr(self.bot.get_user(int(user_id)), 'name', '？？？'),
                             data['level']
                         )
-                    )
-                )
-                if rank % 10 == 0:
-                    embeds.append(self.make_ranking_embed(rank, fields))
-                    fields = []
-                    if mode == "global":
-                        # グローバルの場合はメモリが大きくなるので終了する。
-                        break
-            if fields:
-                embeds.append(self.make_ranking_embed(rank, fields))
+                    ) for rank, (user_id, data) in enumerate(rows, page * 10 + 1)
+                ], my_rank))
             if len(embeds) == 1:
                 await ctx.reply(embed=embeds[0])
             else:
@@ -448,28 +708,28 @@ class Level(commands.Cog):
                             "remove", message, data["replace_role_id"]
                         )
 
-    @commands.Cog.listener()
+    @route(bots=False, dm=False, prefixed=False)
     async def on_message(self, message: discord.Message):
         if (message.author.bot or not message.guild
-                or message.content.startswith(self.bot.prefixes)):
+                or self.bot.is_command(message)):
             return
 
-        if self.data.l[message.guild.id].get("data", True):
-            if "data" not in self.data.l[message.guild.id]:
-                self.data.l[message.guild.id].data = {}
+        if self.data.l[message.guild.id].get("onoff", True):
             if self.process_level(
-                now := self.data.l[message.guild.id].data.get(
-                    str(message.author.id), FIRST_LEVEL
-                ).copy()
+                now := await self.store.get(message.guild.id, message.author.id)
             ):
                 await self.on_level(message, now["level"], "l")
-            self.data.l[message.guild.id].data[str(message.author.id)] = now
+            self.store.set(message.guild.id, message.author.id, now)
+            if message.guild.id in self.boards:
+                self.boards[message.guild.id].update(message.author.id, now)
 
         if self.process_level(
             now := self.data.g[message.author.id].get("level", FIRST_LEVEL).copy()
         ):
             await self.on_level(message, now["level"], "g")
         self.data.g[message.author.id].level = now
+        if self.global_board is not None:
+            self.global_board.update(message.author.id, now)
 
 
 del cooldown
@@ -8,7 +8,8 @@ import discord
 
 from aiomysql import Pool, Cursor
 
-from util import DatabaseManager
+from util import DatabaseManager, route
+from util.matcher import MatcherCache
 
 
 class DataManager(DatabaseManager):
@@ -79,6 +80,7 @@ class OriginalCommand(commands.Cog, DataManager):
     def __init__(self, bot):
         self.bot = bot
         self.data = {}
+        self.matchers = MatcherCache()
 
     async def cog_load(self):
         super(commands.Cog, self).__init__(self.bot.mysql.pool)
@@ -87,6 +89,8 @@ class OriginalCommand(commands.Cog, DataManager):
 
     async def update_cache(self):
         self.data = {}
+        self.matchers.invalidate()
+        self.bot.router.invalidate()
         for row in await self.read_all():
             if row:
                 if row[0] not in self.data:
@@ -248,23 +252,21 @@ class OriginalCommand(commands.Cog, DataManager):
             await self.update_cache()
             await ctx.reply("Ok")
 
-    @commands.Cog.listener()
+    @route(own=False, dm=False, prefixed=False, guild=lambda self, guild_id: guild_id in self.data)
     async def on_message(self, message: discord.Message):
         if not message.guild:
             return
 
         if ((data := self.data.get(message.guild.id))
                 and message.author.id != self.bot.user.id
-                and not message.content.startswith(
-                    tuple(self.bot.command_prefix))):
-            count = 0
-            for command in data:
-                if ((data[command]["reply"] and command in message.content)
-                        or command == message.content):
-                    await message.reply(data[command]["content"])
-                    count += 1
-                    if count == 3:
-                        break
+                and not self.bot.is_command(message)):
+            # メッセージに含まれているコマンドを一度に探して、部分一致か完全一致のものに返信する。
+            for command in [
+                command for command in self.matchers.get(message.guild.id, lambda: data)
+                .find(message.content)
+                if data[command]["reply"] or command == message.content
+            ][:3]:
+                await message.reply(data[command]["content"])
 
 
 async def setup(bot):
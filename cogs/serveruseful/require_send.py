@@ -6,6 +6,8 @@ from discord.ext import commands, tasks
 from discord import app_commands
 import discord
 
+from util import route
+
 from asyncio import Event
 from time import time
 
@@ -53,6 +55,7 @@ class DataManager:
                 if row[0] not in self.cache:
                     self.cache[row[0]] = []
                 self.cache[row[0]].append(row[1])
+        self.bot.router.invalidate()
 
     async def write(self, guild_id: int, channel_id: int, timeout: int) -> None:
         "送信必須チャンネルを追加します。"
@@ -411,7 +414,7 @@ class RequireSend(commands.Cog, DataManager):
                     async with conn.cursor() as cursor:
                         await self.add_queue(cursor, member.guild.id, 0, member.id)
 
-    @commands.Cog.listener()
+    @route(dm=False, channel=lambda self, channel: channel.id in self.cache.get(channel.guild.id, ()))
     async def on_message(self, message: discord.Message):
         if message.guild and message.channel.id in self.cache.get(message.guild.id, ()):
             await self.process_check(message)
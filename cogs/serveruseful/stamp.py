@@ -8,6 +8,8 @@ import discord
 
 from util.mysql_manager import DatabaseManager
 from util.page import EmbedPage
+from util.matcher import MatcherCache
+from util import route
 
 
 class DataManager(DatabaseManager):
@@ -25,30 +27,14 @@ class DataManager(DatabaseManager):
         )
 
     async def write(self, cursor, guild_id: int, name: str, url: str) -> None:
-        target = {"GuildID": guild_id, "Name": name}
-        change = {"Url": url}
-        if await cursor.exists(self.DB, target):
-            await cursor.update_data(self.DB, change, target)
-        else:
-            target.update(change)
-            await cursor.insert_data(self.DB, target)
+        await cursor.upsert_data(self.DB, {"Url": url}, {"GuildID": guild_id, "Name": name})
 
     async def delete(self, cursor, guild_id: int, name: str) -> None:
-        target = {"GuildID": guild_id, "Name": name}
-        if await cursor.exists(self.DB, target):
-            await cursor.delete(self.DB, target)
-        else:
+        if not await cursor.delete(self.DB, {"GuildID": guild_id, "Name": name}):
             raise KeyError("そのスタンプが見つかりませんでした。")
 
     async def read(self, cursor, guild_id: int) -> Optional[tuple]:
-        target = {"GuildID": guild_id}
-        if await cursor.exists(self.DB, target):
-            return [
-                row
-                async for row in cursor.get_datas(
-                    self.DB, target
-                )
-            ]
+        return [row async for row in cursor.get_datas(self.DB, {"GuildID": guild_id}) if row]
 
     async def reads(self, cursor) -> list:
         return [row async for row in cursor.get_datas(self.DB, {})]
@@ -58,6 +44,7 @@ class Stamp(commands.Cog, DataManager):
     def __init__(self, bot):
         self.bot = bot
         self.cache = {}
+        self.matchers = MatcherCache()
 
     async def cog_load(self):
         super(commands.Cog, self).__init__(
@@ -67,6 +54,8 @@ class Stamp(commands.Cog, DataManager):
         await self.update_cache()
 
     async def update_cache(self, guild_id: Optional[int] = None) -> None:
+        self.matchers.invalidate(guild_id)
+        self.bot.router.invalidate(guild_id)
         for row in (
             await self.read(guild_id)
             if guild_id
@@ -219,6 +208,8 @@ class Stamp(commands.Cog, DataManager):
         if name in self.cache.get(ctx.guild.id, {}):
             await self.delete(ctx.guild.id, name)
             del self.cache[ctx.guild.id][name]
+            self.matchers.invalidate(ctx.guild.id)
+            self.bot.router.invalidate(ctx.guild.id)
             await ctx.reply("Ok")
         else:
             await ctx.reply(
@@ -226,17 +217,17 @@ class Stamp(commands.Cog, DataManager):
                  "en": "The stamp has not registered yet."}
             )
 
-    @commands.Cog.listener()
+    @route(
+        bots=False, dm=False, prefixed=False,
+        guild=lambda self, guild_id: bool(self.cache.get(guild_id))
+    )
     async def on_message(self, message: discord.Message):
         if (message.guild and not message.author.bot
                 and (data := self.cache.get(message.guild.id))
-                and not message.content.startswith(
-                    tuple(self.bot.command_prefix)
-                )):
-            for name in data:
-                if name in message.content:
-                    await message.channel.send(data[name])
-                    break
+                and not self.bot.is_command(message)):
+            if (name := self.matchers.get(message.guild.id, lambda: data)
+                    .search(message.content)) is not None:
+                await message.channel.send(data[name])
 
 
 async def setup(bot):
@@ -42,7 +42,7 @@ class StrToCommand:
         repeate = ["(曲|音楽)を(繰り返して|ループして)"]
         slowmode = ["(低速を|ていそくを)(.+)秒(にして|に設定して|にセットして)"]
         tenki = ["(今日の|明日の)(.+)(の天気は|の天気|の天気を教えて)"]
-        prf = self.bot.command_prefix[0]
+        prf = self.bot.get_prefixes()[0]
         rem = await self.regmatch(tex, afk)  # afk check
         if rem:
             cmd = re.sub("afk(の|を)", "", tex)
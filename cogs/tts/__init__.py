@@ -5,6 +5,7 @@ from __future__ import annotations
 from typing import TypedDict, TypeVar, Literal, Union, Optional, Any
 
 from functools import wraps
+from asyncio import Semaphore
 from os import listdir
 
 from discord.ext import commands, tasks
@@ -14,12 +15,13 @@ import discord
 from aiofiles.os import remove
 
 from util.slash import UnionContext
-from util import RT, Table
+from util import RT, Table, route
 from util import TimeoutView
 
 from .agents import AGENTS
-from .voice import OUTPUT_DIRECTORY
+from .voice import OUTPUT_DIRECTORY, CACHE_DIRECTORY
 from .manager import Manager
+from .cache import SynthesisCache
 
 
 class RoutineData(TypedDict):
@@ -29,6 +31,7 @@ class RoutineData(TypedDict):
 
 class TTSUserData(Table):
     __allocation__ = "UserID"
+    __lazy__ = True
     routines: list[RoutineData]
     voice: str
 
@@ -71,6 +74,7 @@ class SelectAgentView(TimeoutView):
         ]
     )
     async def agent_select(self, select: discord.ui.Select, interaction: discord.Interaction):
+        await self.cog.user.load(interaction.user.id)
         self.cog.user[interaction.user.id].voice = select.values[0]
         await interaction.response.send_message({"ja": "設定しました。", "en": "Ok"})
 
@@ -78,22 +82,28 @@ class SelectAgentView(TimeoutView):
 class TTSCog(commands.Cog, name="TTS"):
 
     RTCHAN = False
+    CACHE_BUDGET = 256 * 1024 * 1024
+    "音声合成のキャッシュに使うディスクの容量の上限です。"
+    SYNTHE_CONCURRENCY = 4
+    "全てのサーバーで同時に実行する音声合成の数の上限です。"
 
     def __init__(self, bot: RT):
         self.bot = bot
 
         self.user = TTSUserData(self.bot)
         self.guild = TTSGuildData(self.bot)
+        self.cache = SynthesisCache(CACHE_DIRECTORY, self.CACHE_BUDGET)
+        self.synthe_semaphore = Semaphore(self.SYNTHE_CONCURRENCY)
         self.auto_leave.start()
 
         self.RTCHAN = self.bot.user.id == 888635684552863774
-        global OPENJTALK
-        if self.RTCHAN:
-            # もしりつたんの場合はOpenJTalkの場所を直接指定する。
-            OPENJTALK = "/home/tasuren/opt/bin/open_jtalk"
 
         self.now: dict[int, Manager] = {}
 
+    async def cog_before_invoke(self, ctx: UnionContext):
+        # ユーザーデータは遅延読み込みなので使う前に読み込んでおく。
+        await self.user.load(ctx.author.id)
+
     @commands.hybrid_group(aliases=("読み上げ",), extras={
         "headding": {"ja": "読み上げ", "en": "TTS"}, "parent": "Entertainment"
     })
@@ -148,6 +158,7 @@ class TTSCog(commands.Cog, name="TTS"):
             await ctx.author.voice.channel.connect()
             self.now[ctx.guild.id] = Manager(self, ctx.guild)
             self.now[ctx.guild.id].add_channel(ctx.channel.id)
+            self.bot.router.invalidate(ctx.guild.id)
             await ctx.reply({"ja": "接続しました。", "en": "Connected!"})
 
     @tts.command(aliases=("l", "さようなら"))
@@ -479,11 +490,11 @@ class TTSCog(commands.Cog, name="TTS"):
         else:
             await ctx.reply({"ja": "見つかりませんでした。", "en": "Not found"})
 
-    @commands.Cog.listener()
+    @route(dm=False, prefixed=False, guild=lambda self, guild_id: guild_id in self.now)
     async def on_message(self, message: discord.Message):
         if message.guild and message.content and message.guild.id in self.now \
                 and self.now[message.guild.id].check_channel(message.channel.id) \
-                and not message.content.startswith(tuple(self.bot.command_prefix)):
+                and not self.bot.is_command(message):
             await self.now[message.guild.id].add(message)
 
     @commands.Cog.listener()
@@ -504,7 +515,12 @@ class TTSCog(commands.Cog, name="TTS"):
     def clean(self, manager: Manager, reason: Optional[Any] = None) -> None:
         "渡されたManagerの後始末をします。"
         self.bot.loop.create_task(manager.disconnect(reason)) \
-            .add_done_callback(lambda _: self.now.pop(manager.guild.id))
+            .add_done_callback(lambda _: self._remove_manager(manager.guild.id))
+
+    def _remove_manager(self, guild_id: int) -> None:
+        # 後始末が終わったManagerを消す。
+        self.now.pop(guild_id)
+        self.bot.router.invalidate(guild_id)
 
     async def cog_unload(self):
         self.auto_leave.cancel()
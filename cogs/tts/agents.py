@@ -6,8 +6,11 @@ from typing import Literal, Union, Optional
 from enum import Enum
 
 from subprocess import Popen, TimeoutExpired, PIPE
-from asyncio import get_running_loop
+from asyncio import Task, TimerHandle, get_running_loop, gather
+from threading import Lock
 from os.path import exists
+from io import BytesIO
+import wave
 
 from re import sub, findall
 
@@ -15,25 +18,29 @@ import discord
 
 from jishaku.functools import executor_function
 
-from pyopenjtalk import g2p
+from pyopenjtalk import g2p, extract_fullcontext, HTSEngine
 from gtts import gTTS
+import numpy as np
 
 from aiofiles import open as aioopen
 from aiohttp import ClientSession
 from bs4 import BeautifulSoup
-from ujson import load, dumps
-
-
-ENG2KANA_DATA_PATH = "cogs/tts/data/eng2kana.json"
-"英語からカタカナに変換されている辞書があるJSONファイルです。"
+from ujson import load, loads, dumps
+
+
+ENG2KANA_DATA_PATH = "cogs/tts/data/eng2kana.jsonl"
+"""英語からカタカナに変換した結果を追記していくファイルです。
+一行毎に`["英単語", "カタカナ"]`のJSONが書かれています。カタカナが`null`のものは変換できなかった英単語です。"""
+ENG2KANA_LEGACY_DATA_PATH = "cogs/tts/data/eng2kana.json"
+"以前使っていた英語からカタカナに変換されている辞書があるJSONファイルです。あれば起動時に読み込みます。"
+ENG2KANA_URL = "https://www.sljfaq.org/cgi/e2k_ja.cgi"
+"英語をカタカナに変換するのに使うウェブサイトのURLです。テストの際はローカルのサーバーに変えることができます。"
+ENG2KANA_FLUSH_DELAY = 5.0
+"新しい英単語を変換してから何秒待ってまとめてファイルに追記するかです。"
 AQUESTALK_DIRECTORY = "cogs/tts/lib/AquesTalk"
 "AquesTalkのプログラムが入っているフォルダです。"
 ALLOWED_CHARACTERS_CSV = "cogs/tts/data/allowed_characters.csv"
 "AquesTalkで読み上げ可能な文字が入っているcsvファイルです。"
-OPENJTALK = "open_jtalk"
-"なんのコマンドでOpenJTalkを実行するかです。"
-OPENJTALK_DICTIONARY = "cogs/tts/lib/OpenJTalk/dic"
-"OpenJTalkで使う辞書がある場所です。"
 OPENJTALK_VOICE_DIRECTORY = "cogs/tts/lib/OpenJTalk"
 "OpenJTalkで使う音声のデータがあるディレクトリです。"
 AGENTS_JSON = "cogs/tts/data/avaliable_voices.json"
@@ -55,21 +62,45 @@ with open(ALLOWED_CHARACTERS_CSV, "r", encoding="utf8") as f:
     "AquesTalkで使える文字のタプル"
 Source = Union[discord.FFmpegOpusAudio, discord.FFmpegPCMAudio]
 
-# 英語とカタカナの辞書を読み込んでおく。
-eng2kanaData: dict[str, str] = {}
-if exists(ENG2KANA_DATA_PATH):
-    with open(ENG2KANA_DATA_PATH, "r") as f:
+# 英語とカタカナの辞書を読み込んでおく。値が`None`のものは変換できなかった英単語です。
+eng2kanaData: dict[str, Optional[str]] = {}
+if exists(ENG2KANA_LEGACY_DATA_PATH):
+    with open(ENG2KANA_LEGACY_DATA_PATH, "r") as f:
         eng2kanaData.update(load(f))
-else:
-    # 存在しないなら空のものを作っておく。
-    with open(ENG2KANA_DATA_PATH, "w") as f:
-        f.write(r"{}")
+if exists(ENG2KANA_DATA_PATH):
+    with open(ENG2KANA_DATA_PATH, "r", encoding="utf8") as f:
+        for line in f:
+            try:
+                word, kana = loads(line)
+            except ValueError:
+                # 書き込み途中で終了した場合などの壊れた行は無視する。
+                continue
+            eng2kanaData[word] = kana
+_eng2kana_pending: list[tuple[str, Optional[str]]] = []
+_eng2kana_flush: Optional[TimerHandle] = None
+_eng2kana_lookups: dict[str, Task] = {}
 
 
 async def _dumps_eng2kana_data():
-    # eng2kanaのデータを保存します。
-    async with aioopen(ENG2KANA_DATA_PATH, "w") as f:
-        await f.write(dumps(eng2kanaData, indent=2, ensure_ascii=False))
+    # 新しく変換した英単語をまとめてファイルに追記します。
+    global _eng2kana_flush
+    _eng2kana_flush = None
+    if _eng2kana_pending:
+        lines = "".join(f"{dumps(item, ensure_ascii=False)}\n" for item in _eng2kana_pending)
+        _eng2kana_pending.clear()
+        async with aioopen(ENG2KANA_DATA_PATH, "a", encoding="utf8") as f:
+            await f.write(lines)
+
+
+def _schedule_dumps_eng2kana_data():
+    # 追記を少し遅らせて、その間に変換したものをまとめて書き込むようにします。
+    global _eng2kana_flush
+    if _eng2kana_flush is None:
+        _eng2kana_flush = loop.call_later(
+            ENG2KANA_FLUSH_DELAY, lambda: loop.create_task(
+                _dumps_eng2kana_data(), name="TTS: Sync eng2kana data"
+            )
+        )
 
 
 HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:47.0) Gecko/20100101 Firefox/47.0'}
@@ -77,43 +108,75 @@ HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:47.0) Gecko
 session, loop = None, None
 
 
-async def eng2kana(text: str) -> str:
-    "渡された文字列にある英語をかなにします。"
+def setup_eng2kana(
+    url: Optional[str] = None, new_session: Optional[ClientSession] = None,
+    data_path: Optional[str] = None
+) -> None:
+    """英語をカタカナに変換するのに使うウェブサイトのURLとセッション、変換結果を追記するファイルを変えます。
+    テストでローカルのサーバーを使う際に使います。指定しなかったものはそのままです。"""
+    global ENG2KANA_URL, ENG2KANA_DATA_PATH, session, loop
+    if url is not None:
+        ENG2KANA_URL = url
+    if new_session is not None:
+        session, loop = new_session, None
+    if data_path is not None:
+        ENG2KANA_DATA_PATH = data_path
+
+
+async def _lookup_eng2kana(word: str) -> Optional[str]:
+    # 英単語の読み方をウェブサイトから取得します。
+    async with session.get(ENG2KANA_URL, params={"word": word}, headers=HEADERS) as r:
+        tag = BeautifulSoup(await r.text(), "lxml").find(class_="katakana-string")
+    kana = tag.string.replace("\n", "") if tag is not None and tag.string else None
+    eng2kanaData[word] = kana
+    _eng2kana_pending.append((word, kana))
+    _schedule_dumps_eng2kana_data()
+    return kana
+
+
+async def lookup_eng2kana(word: str) -> Optional[str]:
+    """英単語の読み方を取得します。変換できない英単語の場合は`None`を返します。
+    同じ英単語の取得が同時に要求された場合は一度だけ取得します。"""
     global session, loop
+    if loop is None:
+        loop = get_running_loop()
     if session is None:
-        session = ClientSession(
-            loop=(loop := get_running_loop()), raise_for_status=True
+        session = ClientSession(raise_for_status=True)
+    if word in eng2kanaData:
+        return eng2kanaData[word]
+    if word not in _eng2kana_lookups:
+        _eng2kana_lookups[word] = loop.create_task(
+            _lookup_eng2kana(word), name=f"TTS: Lookup eng2kana: {word}"
         )
+        _eng2kana_lookups[word].add_done_callback(lambda _: _eng2kana_lookups.pop(word, None))
+    return await _eng2kana_lookups[word]
 
-    text = text.replace("\n", "、").lower()
 
-    # 英単語をカタカナにする。
-    words = findall("[a-zA-Z]+", text)
-    for word in words:
-        # 既にある英語辞書から英単語を検索する。
-        result = eng2kanaData.get(word)
+async def eng2kana(text: str) -> str:
+    "渡された文字列にある英語をかなにします。"
+    text = text.replace("\n", "、").lower()
 
-        if result is None:
-            # もしまだない英単語の場合は読み方の取得を行う。
-            async with session.get(
-                f"https://www.sljfaq.org/cgi/e2k_ja.cgi?word={word.replace(' ', '+')}", headers=HEADERS
-            ) as r:
-                eng2kanaData[word] = BeautifulSoup(await r.text(), "lxml") \
-                    .find(class_='katakana-string').string.replace('\n', '')
-            result = eng2kanaData[word]
+    # 英単語をカタカナにする。まだない英単語の読み方はまとめて同時に取得する。
+    words = list(dict.fromkeys(findall("[a-zA-Z]+", text)))
+    for word, result in zip(words, await gather(
+        *map(lookup_eng2kana, words), return_exceptions=True
+    )):
+        # 取得に失敗したものや変換できないものはそのままにする。
+        if isinstance(result, str):
+            text = text.replace(word, result)
 
-            # 同期しておく。
-            loop.create_task(_dumps_eng2kana_data(), name="TTS: Sync eng2kana data")
+    return text
 
-        text = text.replace(word, result)
 
-    return text
+# pyopenjtalkの`g2p`と`extract_fullcontext`は一つのOpenJTalkのインスタンスを共有しているので、同時に使わないようにする。
+_frontend_lock = Lock()
 
 
 @executor_function
 def aiog2p(*args, **kwargs):
     "`run_in_executor_function`を使って非同期に実行できるようにした`pyopenjtalk.g2p`です。"
-    return g2p(*args, **kwargs)
+    with _frontend_lock:
+        return g2p(*args, **kwargs)
 
 
 NO_JOINED_TWICE_CHARS = (
@@ -161,11 +224,25 @@ class Agent:
         self.type, self.name, self.agent, self.details = type_, name, agent, details
         self.emoji = emoji
 
-    async def synthe(self, text: str, path: str) -> Optional[Source]:
-        "音声合成を行います。"
+    async def write(self, text: str, path: str) -> Union[bytes, bool]:
+        """音声合成を行います。
+        プロセス内で音声合成ができるものはPCMを返し、それ以外のものは渡されたパスに音声ファイルを書き込んで`True`を返します。
+        読み上げるものがなかった場合は何もせずに`False`を返します。"""
         text = await adjust_text(text)
         if text:
-            return await globals()[self.type.name](text, path, self.agent)
+            return await globals()[self.type.name](text, path, self.agent) or True
+        return False
+
+    def prepare(self, data: Union[str, bytes]) -> Source:
+        "`write`で作った音声ファイルのパスかPCMからSourceを作ります。"
+        if isinstance(data, bytes):
+            return discord.PCMAudio(BytesIO(data))
+        return prepare_source(data, VOLUMES.get(self.type, DEFAULT_VOLUME))
+
+    async def synthe(self, text: str, path: str) -> Optional[Source]:
+        "音声合成を行います。"
+        if data := await self.write(text, path):
+            return self.prepare(path if data is True else data)
 
     @property
     def code(self) -> str:
@@ -191,20 +268,27 @@ class SyntheError(Exception):
 
 
 @executor_function
-def _synthe(log_name: str, commands: str, text: str):
-    # 音声合成のコマンドを実行します。
-    proc = Popen(commands, stdin=PIPE, stdout=PIPE, stderr=PIPE, shell=True)
+def _synthe(log_name: str, commands: list[str], text: str) -> bytes:
+    # 音声合成のコマンドを実行して、その標準出力を返します。
+    proc = Popen(commands, stdin=PIPE, stdout=PIPE, stderr=PIPE)
     try:
-        _, stderr_ = proc.communicate(bytes(text, encoding="utf-8"), 5)
+        stdout_, stderr_ = proc.communicate(bytes(text, encoding="utf-8"), 5)
     except TimeoutExpired:
         proc.kill()
         raise SyntheError(f"{log_name}: 音声合成に失敗しました。ERR:TimeoutExpired")
     else:
         if stderr_:
             raise SyntheError(f"{log_name}: 音声合成に失敗しました。ERR:{stderr_}")
+        return stdout_
 
 
-def prepare_source(path: str, volume: float = 5.5) -> Source:
+DEFAULT_VOLUME = 5.5
+"音声合成で作った音声の音量です。"
+VOLUMES = {VoiceTypes.aquestalk: 2.2}
+"音声合成に使うもの毎の音量です。ここにないものは`DEFAULT_VOLUME`になります。"
+
+
+def prepare_source(path: str, volume: float = DEFAULT_VOLUME) -> Source:
     "Sourceを作ります。"
     return discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(
         path, options=f'-filter:a "volume={volume}"'
@@ -213,6 +297,34 @@ def prepare_source(path: str, volume: float = 5.5) -> Source:
     )
 
 
+SAMPLING_RATE = 48000
+"Discordで再生するPCMのサンプリング周波数です。"
+
+
+def to_pcm(samples: np.ndarray, rate: int, volume: float = DEFAULT_VOLUME) -> bytes:
+    """モノラルの音声の波形をDiscordでそのまま再生できる48kHzで16bitのステレオのPCMにします。
+    FFmpegを使わずに再生するためのものです。"""
+    if rate != SAMPLING_RATE:
+        samples = np.interp(
+            np.arange(0, len(samples), rate / SAMPLING_RATE),
+            np.arange(len(samples)), samples
+        )
+    samples = np.clip(samples * volume, -32768, 32767).astype("<i2")
+    pcm = np.repeat(samples, 2).tobytes()
+    # 最後のフレームが途中で終わっていると再生されないので無音で埋める。
+    return pcm + b"\0" * (-len(pcm) % discord.opus.Encoder.FRAME_SIZE)
+
+
+def wav_to_pcm(data: bytes, volume: float = DEFAULT_VOLUME) -> bytes:
+    "WAVのデータを`to_pcm`でPCMにします。"
+    with wave.open(BytesIO(data)) as f:
+        channels, rate = f.getnchannels(), f.getframerate()
+        samples = np.frombuffer(f.readframes(f.getnframes()), "<i2").astype(np.float64)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return to_pcm(samples, rate, volume)
+
+
 #   AquesTalk
 AQUESTALK_REPLACE_CHARACTERS = {
     "ぁ": "あ", "ぃ": "い", "ぅ": "う", "ぇ": "え", "ぉ": "お",
@@ -221,7 +333,7 @@ AQUESTALK_REPLACE_CHARACTERS = {
 "AquesTalkで読めない文字の置き換えに使う辞書"
 
 
-async def aquestalk(text: str, path: str, agent: Union[Literal["f1", "f2"], str]) -> Source:
+async def aquestalk(text: str, path: str, agent: Union[Literal["f1", "f2"], str]) -> bytes:
     "AquesTalkで音声合成をします。"
     # AquesTalk用に文字列を調整する。
     for char in AQUESTALK_REPLACE_CHARACTERS:
@@ -237,24 +349,43 @@ async def aquestalk(text: str, path: str, agent: Union[Literal["f1", "f2"], str]
             first = False
         new_text += char
 
-    # 音声合成をする。
-    await _synthe(
-        f"AquesTalk[{agent}]", f"./{f'{AQUESTALK_DIRECTORY}/{agent}'} 130 > {path}", text
-    )
-
-    return prepare_source(path, 2.2)
+    # 音声合成をする。WAVは標準出力から受け取るのでファイルは作らない。
+    return wav_to_pcm(await _synthe(
+        f"AquesTalk[{agent}]", [f"./{AQUESTALK_DIRECTORY}/{agent}", "130"], text
+    ), VOLUMES[VoiceTypes.aquestalk])
 
 
 #   OpenJTalk
-async def openjtalk(text: str, path: str, agent: str) -> Source:
-    "OpenJTalkで音声合成を行います。"
-    await _synthe(
-        f"OpenJTalk[{agent}]",
-        f"""{OPENJTALK} -x {OPENJTALK_DICTIONARY}
-            -m {f'{OPENJTALK_VOICE_DIRECTORY}/{agent}.htsvoice'} -r 1.0 -ow {path}""".replace("\n", ""),
-        text
-    )
-    return prepare_source(path)
+_engines: dict[str, tuple[HTSEngine, Lock]] = {}
+_engines_lock = Lock()
+
+
+def _get_engine(agent: str) -> tuple[HTSEngine, Lock]:
+    # 声毎のHTSEngineを取得する。HTSEngineは同時に使えないのでロックも一緒に作っておく。
+    with _engines_lock:
+        if agent not in _engines:
+            _engines[agent] = (
+                HTSEngine(f"{OPENJTALK_VOICE_DIRECTORY}/{agent}.htsvoice".encode()), Lock()
+            )
+        return _engines[agent]
+
+
+@executor_function
+def _openjtalk(text: str, agent: str) -> bytes:
+    engine, lock = _get_engine(agent)
+    with _frontend_lock:
+        labels = extract_fullcontext(text)
+    with lock:
+        samples = engine.synthesize(labels)
+        rate = engine.get_sampling_frequency()
+    if not len(samples):
+        raise SyntheError(f"OpenJTalk[{agent}]: 音声合成に失敗しました。")
+    return to_pcm(samples, rate)
+
+
+async def openjtalk(text: str, path: str, agent: str) -> bytes:
+    "pyopenjtalkを使ってプロセス内でOpenJTalkの音声合成を行い、PCMを返します。"
+    return await _openjtalk(text, agent)
 
 
 #   gTTS
@@ -263,7 +394,6 @@ def _gtts(text: str, path: str, agent: str):
     gTTS(text, lang=agent).save(path)
 
 
-async def gtts(text: str, path: str, agent: str) -> Source:
+async def gtts(text: str, path: str, agent: str) -> None:
     "gTTSを使用して音声合成をします。"
     await _gtts(text, path, agent)
-    return prepare_source(path)
@@ -0,0 +1,214 @@
+# Free RT TTS - Cache
+
+from __future__ import annotations
+
+from typing import Callable, Awaitable, Optional, Union
+
+from asyncio import Task, create_task, shield
+from collections import OrderedDict
+from dataclasses import dataclass
+from hashlib import sha1
+from os import listdir, makedirs, remove, stat
+from os.path import exists
+
+from aiofiles import open as aioopen
+
+
+@dataclass
+class CacheEntry:
+    """キャッシュされている音声です。`path`はディスクにあるファイルで、`data`はメモリ上にあるPCMです。
+    PCMはファイルにも保存されるので、両方ある場合もあります。"""
+
+    key: str
+    path: Optional[str]
+    size: int
+    refs: int = 0
+    data: Optional[bytes] = None
+
+
+class SynthesisCache:
+    """音声合成の結果を(Agentコード, 文字列)をキーとして保存しておくためのクラスです。
+    音声ファイルはディスクに、プロセス内で音声合成したPCMはメモリとディスクの両方に保存します。
+    どれがあるかはメモリ上でLRUの順番で管理し、それぞれの合計のサイズが上限を超えたら古いものから消します。
+    メモリから消したPCMはディスクに残り、次に使われた時に読み込まれます。
+    再生中のものは`acquire`から`release`までの間は消されません。
+    起動時にディレクトリにあるファイルを読み込むので、再起動してもキャッシュは残ります。
+
+    Parameters
+    ----------
+    directory : str
+        キャッシュを保存するディレクトリです。
+    budget : int, default 256MB
+        ファイルのキャッシュの合計のサイズの上限です。
+    memory_budget : int, default 64MB
+        メモリにあるPCMのキャッシュの合計のサイズの上限です。"""
+
+    def __init__(
+        self, directory: str, budget: int = 256 * 1024 * 1024,
+        memory_budget: int = 64 * 1024 * 1024
+    ):
+        self.directory, self.budget, self.memory_budget = directory, budget, memory_budget
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.size = self.memory = 0
+        self.hits = self.misses = self.evictions = 0
+        self._pending: dict[str, Task] = {}
+        makedirs(directory, exist_ok=True)
+        # 前回のキャッシュを古い順に読み込む。
+        files = []
+        for file_name in listdir(directory):
+            if file_name.endswith((".wav", ".pcm")):
+                path = f"{directory}/{file_name}"
+                files.append((stat(path).st_mtime, file_name[:-4], path))
+        for _, key, path in sorted(files):
+            self._add(CacheEntry(key, path, stat(path).st_size))
+        self._evict()
+
+    @staticmethod
+    def make_key(code: str, text: str) -> str:
+        "Agentコードと文字列からキーを作ります。"
+        return sha1(f"{code}\0{text}".encode()).hexdigest()
+
+    def _add(self, entry: CacheEntry) -> None:
+        self.entries[entry.key] = entry
+        if entry.path is not None:
+            self.size += entry.size
+        if entry.data is not None:
+            self.memory += entry.size
+
+    def _evict(self) -> None:
+        # 使われていないものを古い順に上限に収まるまで消す。PCMはメモリから消してもディスクには残す。
+        for entry in list(self.entries.values()):
+            over_disk, over_memory = self.size > self.budget, self.memory > self.memory_budget
+            if not over_disk and not over_memory:
+                break
+            if entry.refs:
+                continue
+            if over_memory and entry.data is not None:
+                entry.data = None
+                self.memory -= entry.size
+            if over_disk and entry.path is not None:
+                self.size -= entry.size
+                try:
+                    remove(entry.path)
+                except OSError:
+                    ...
+                entry.path = None
+            if entry.path is None and entry.data is None:
+                del self.entries[entry.key]
+                self.evictions += 1
+
+    async def _save(self, key: str, data: bytes) -> Optional[str]:
+        # PCMを再起動後も使えるようにファイルに保存する。
+        path = f"{self.directory}/{key}.pcm"
+        try:
+            async with aioopen(path, "wb") as f:
+                await f.write(data)
+        except OSError:
+            if exists(path):
+                remove(path)
+            return None
+        return path
+
+    async def _load(self, entry: CacheEntry) -> None:
+        # ファイルにあるPCMをメモリに読み込む。
+        async with aioopen(entry.path, "rb") as f:
+            data = await f.read()
+        if entry.data is None:
+            entry.data = data
+            self.memory += entry.size
+
+    async def _synthe(
+        self, key: str, synthe: Callable[[str], Awaitable[Union[bytes, bool]]]
+    ) -> Optional[CacheEntry]:
+        # 音声合成をしてキャッシュに追加する。
+        path = f"{self.directory}/{key}.wav"
+        try:
+            if not (data := await synthe(path)):
+                return None
+        except BaseException:
+            if exists(path):
+                remove(path)
+            raise
+        if isinstance(data, bytes):
+            entry = CacheEntry(key, await self._save(key, data), len(data), data=data)
+        elif exists(path):
+            entry = CacheEntry(key, path, stat(path).st_size)
+        else:
+            return None
+        self._add(entry)
+        return entry
+
+    async def acquire(
+        self, code: str, text: str, synthe: Callable[[str], Awaitable[Union[bytes, bool]]]
+    ) -> Optional[CacheEntry]:
+        """キャッシュから音声ファイルを取得します。ない場合は音声合成をします。
+        使い終わったら`release`を呼んでください。
+
+        Parameters
+        ----------
+        code : str
+            Agentコードです。
+        text : str
+            読み上げる文字列です。
+        synthe : Callable[[str], Awaitable[Union[bytes, bool]]]
+            キャッシュにない場合に音声合成をするコルーチン関数です。
+            渡されたパスに音声ファイルを書き込んで`True`を返すか、PCMを返してください。
+            読み上げるものがなかった場合は`False`を返してください。
+
+        Returns
+        -------
+        Optional[CacheEntry]
+            読み上げるものがなかった場合は`None`になります。"""
+        key = self.make_key(code, text)
+        if (entry := self.entries.get(key)) is not None and entry.data is None \
+                and entry.path is not None and entry.path.endswith(".pcm"):
+            # 読み込み中に消されないようにしておく。
+            entry.refs += 1
+            try:
+                await self._load(entry)
+            except OSError:
+                # 読み込めない場合はキャッシュから消して音声合成をし直す。
+                if self.entries.get(key) is entry and entry.path is not None:
+                    del self.entries[key]
+                    self.size -= entry.size
+                entry.refs -= 1
+                entry = None
+            else:
+                entry.refs -= 1
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+            # 同じものが同時に要求された場合は一度だけ音声合成をする。
+            if key not in self._pending:
+                self._pending[key] = create_task(
+                    self._synthe(key, synthe), name=f"[SynthesisCache] Synthe: {key}"
+                )
+                self._pending[key].add_done_callback(lambda _: self._pending.pop(key, None))
+            # 待っているものがキャンセルされても音声合成は止めない。
+            if (entry := await shield(self._pending[key])) is None:
+                return None
+        entry.refs += 1
+        self._evict()
+        return entry
+
+    def release(self, entry: CacheEntry) -> None:
+        "`acquire`で取得したものを使い終わったことを伝えます。"
+        entry.refs -= 1
+        if not entry.refs:
+            self._evict()
+
+    @property
+    def hit_rate(self) -> float:
+        "キャッシュのヒット率です。"
+        return self.hits / total if (total := self.hits + self.misses) else 0.0
+
+    def metrics(self) -> dict[str, float]:
+        "キャッシュの状態を返します。"
+        return {
+            "entries": len(self.entries), "size": self.size, "budget": self.budget,
+            "memory": self.memory, "memory_budget": self.memory_budget,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "hit_rate": self.hit_rate
+        }
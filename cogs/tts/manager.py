@@ -36,7 +36,11 @@ class ExtendedVoice(Voice):
 
 
 class Manager:
-    "読み上げを管理するためのクラスです。"
+    """読み上げを管理するためのクラスです。
+    メッセージは届いた順にキューに入れられ、キューの先頭から`PREFETCH`個までは再生を待たずに音声合成をしておきます。"""
+
+    PREFETCH = 3
+    "再生中のものを含めて、キューの先頭から何個まで先に音声合成をしておくかです。"
 
     def __init__(self, cog: TTSCog, guild: discord.Guild):
         self.cog, self.guild = cog, guild
@@ -44,6 +48,7 @@ class Manager:
         self.queues: list[Voice] = []
         self.channels: list[int] = []
         self._closing = False
+        self._playing = False
 
     def add_channel(self, channel_id: int) -> None:
         "読み上げチャンネルを追加します。"
@@ -78,22 +83,35 @@ class Manager:
             ...
 
     async def add(self, message: discord.Message):
-        "渡されたメッセージを読み上げキューに追加します。"
-        queue = ExtendedVoice(self, message)
+        "渡されたメッセージを読み上げキューに追加します。音声合成は順番が近くなったら行われます。"
+        self.queues.append(ExtendedVoice(self, message))
+        self._prefetch()
+
+    def _prefetch(self) -> None:
+        # キューの先頭からPREFETCH個までの音声合成を開始する。
+        for voice in self.queues[:self.PREFETCH]:
+            if voice.task is None:
+                voice.task = self.cog.bot.loop.create_task(
+                    self._synthe(voice), name=f"{self}: Voice synthesis"
+                )
+
+    async def _synthe(self, voice: Voice) -> None:
+        # 音声合成をして、それがキューの先頭なら再生する。
         try:
-            await queue.synthe()
+            await voice.synthe()
         except Exception as e:
             if self.cog.bot.test:
-                await try_add_reaction(message, EMOJI_ERROR)
+                self.cog.bot.loop.create_task(
+                    try_add_reaction(voice.message, EMOJI_ERROR),
+                    name=f"{self}: Try add error reaction"
+                )
             self.print("Failed to do voice synthesis:", f"{e.__class__.__name__} - {e}")
-        else:
-            self.queues.append(queue)
-            try:
-                self.queues[1]
-            except IndexError:
-                self.play()
-
-    async def _after(self, e: Optional[Exception]):
+        voice.ready = True
+        if self.queues and self.queues[0] is voice:
+            self.play()
+
+    def _after(self, e: Optional[Exception]):
+        self._playing = False
         if self.queues:
             if e:
                 self.print("Failed to play voice:", f"{e.__class__.__name__} - {e}")
@@ -102,27 +120,31 @@ class Manager:
                     name=f"{self}: Try add error reaction"
                 )
 
-            await self.queues[0].close()
-            del self.queues[0]
+            self.clean(self.queues.pop(0))
             self.play()
 
     def play(self):
-        if self.queues:
-            self.print("Play voice:", self.queues[0])
-            if self.queues[0].source is None:
-                # 普通ないがもしsourceが用意されていないのなら再生をしない。
-                self.cog.bot.loop.create_task(
-                    self._after(None), name=f"{self}: After playing voice"
-                )
-            elif self.vc.is_connected():
-                self.vc.play(
-                    self.queues[0].source, after=lambda e: self.cog.bot.loop.create_task(
-                        self._after(e), name=f"{self}: After playing voice"
-                    )
-                )
+        """キューの先頭の音声を再生します。
+        まだ音声合成が終わっていない場合は、終わった時に再生されます。"""
+        while self.queues and not self._playing:
+            voice = self.queues[0]
+            if not voice.ready:
+                break
+            if voice.source is None:
+                # 音声合成に失敗したか読み上げるものがなかった場合は飛ばす。
+                self.clean(self.queues.pop(0))
+                continue
+            if not self.vc.is_connected():
+                break
+            self.print("Play voice:", voice)
+            self._playing = True
+            self.vc.play(
+                voice.source, after=lambda e: self.cog.bot.loop.call_soon_threadsafe(self._after, e)
+            )
+        self._prefetch()
 
     def clean(self, voice: Voice) -> Task:
-        "渡されたVoiceのお片付けをします。第二引数にもし数字を渡した場合はキューを消した後にplayを実行します。"
+        "渡されたVoiceのお片付けをします。音声合成中の場合は中止します。"
         return self.cog.bot.loop.create_task(
             voice.close(), name=f"{self}: Remove voice cache file"
         )
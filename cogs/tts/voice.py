@@ -2,29 +2,39 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Optional, Union
 
-import discord
+from asyncio import Task, wait
 
-from aiofiles.os import remove
+import discord
 
 from .agents import Source, Agent, prepare_source
+from .cache import CacheEntry
 
 if TYPE_CHECKING:
     from .manager import Manager
 
 
 OUTPUT_DIRECTORY = "cogs/tts/outputs"
+CACHE_DIRECTORY = f"{OUTPUT_DIRECTORY}/cache"
 
 
 class Voice:
     "音声クラスです。再生キューに使うクラスです。"
 
-    path: Optional[str] = None
+    entry: Optional[CacheEntry] = None
 
     def __init__(self, manager: Manager, message: discord.Message):
         self.cog, self.message, self.manager = manager.cog, message, manager
         self.source: Optional[Source] = None
+        self.task: Optional[Task] = None
+        # 音声合成が終わっているかどうかです。失敗していても`True`になります。
+        self.ready = False
+
+    @property
+    def path(self) -> Optional[str]:
+        "音声ファイルのパスです。"
+        return None if self.entry is None else self.entry.path
 
     def print(self, *args, **kwargs):
         self.manager.print(f"[{self}]", *args, **kwargs)
@@ -38,6 +48,7 @@ class Voice:
     async def synthe(self) -> None:
         """音声合成を行います。Routineの場合はRoutineのSourceを作ります。
         インスタンス変数の`source`にSource入れられます。"""
+        await self.cog.user.load(self.message.author.id)
         # Routineがあるかチェックをする。
         for routine in self.cog.user[self.message.author.id].get("routines", ()):
             if any(key in self.message.content for key in routine["keys"]):
@@ -56,25 +67,34 @@ class Voice:
             else:
                 code = "gtts-en"
 
-        # 音声合成を行う。
-        self.path = f"{OUTPUT_DIRECTORY}/{self.message.author.id}-{self.message.id}.wav"
-        self.print("Doing voice synthesis...: ", code)
-        self.source = await Agent.from_agent_code(code) \
-            .synthe(self.adjust_text(self.message.content), self.path)
+        # 音声合成を行う。同じ声で同じ文字列を読み上げたことがあればキャッシュを使う。
+        agent, text = Agent.from_agent_code(code), self.adjust_text(self.message.content)
+
+        async def synthe(path: str) -> Union[bytes, bool]:
+            # 音声合成は全てのサーバーで同時に実行する数を制限する。
+            async with self.cog.synthe_semaphore:
+                self.print("Doing voice synthesis...: ", code)
+                return await agent.write(text, path)
+
+        self.entry = await self.cog.cache.acquire(code, text, synthe)
+        if self.entry is not None:
+            self.source = agent.prepare(
+                self.entry.path if self.entry.data is None else self.entry.data
+            )
 
     async def close(self) -> None:
-        "音声合成で作成したファイルを削除します。"
-        if self.path is not None:
+        "音声合成を中止し、作成したファイルをもう使わないことをキャッシュに伝えます。"
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await wait((self.task,))
+        if self.entry is not None:
             self.print("Cleaning...")
-            try:
-                await remove(self.path)
-            except Exception:
-                ...
-            self.path = None
+            self.cog.cache.release(self.entry)
+            self.entry = None
 
     def is_closed(self) -> bool:
         "お片付けが済んでいるかどうかです。"
-        return self.path is None
+        return self.entry is None
 
     def __del__(self):
         if not self.is_closed():
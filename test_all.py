@@ -12,3 +12,86 @@ def test_cog():
     assert all("setup" in dir(getattr(cogs, m))
                for m in dir(cogs)
                if not m.startswith(("_", ".")))
+
+
+def test_automod_scorer():
+    "AutoModのメッセージの似ている度の計算のテストをします。"
+    from cogs.serversafety.automod.modutils import SCORERS
+    for scorer in SCORERS.values():
+        def score(before, after):
+            return scorer.compare(scorer.fingerprint(before), scorer.fingerprint(after))
+        assert score("", "") == score("こんにちは", "こんにちは") == 100
+        assert 0 <= score("おはようございます", "こんばんは") < 50
+        assert score("今日はいい天気ですね", "今日はいい天気ですね！") \
+            > score("今日はいい天気ですね", "全然関係のない文章を送ってみる")
+
+
+def test_automod_benchmark():
+    "AutoModの似ている度の計算方法のベンチマークが動き、`minhash`の値が`difflib`に合っているかテストをします。"
+    from cogs.serversafety.automod.benchmark import raid_corpus, measure, deviation
+    from cogs.serversafety.automod.modutils import SCORERS
+    pairs = raid_corpus(500, seed=1)
+    assert all(measure(scorer, pairs) > 0 for scorer in SCORERS.values())
+    assert deviation(SCORERS["minhash"], pairs) < 15
+
+
+def test_eng2kana(tmp_path):
+    "読み上げの英語からカタカナへの変換をローカルのサーバーを代わりに使ってテストをします。"
+    import pytest
+    pytest.importorskip("pyopenjtalk")
+    from asyncio import run, gather, sleep
+    from aiohttp import ClientSession, web
+    from ujson import loads
+    from cogs.tts import agents
+
+    requested = []
+
+    async def convert(request):
+        # 変換に時間がかかるようにして、同時に来た同じ英単語の取得がまとめられるかを確かめる。
+        requested.append(word := request.query["word"])
+        await sleep(0.05)
+        if word == "xyzzy":
+            return web.Response(text="<html><body>Not found</body></html>", content_type="text/html")
+        return web.Response(
+            text=f'<html><body><div class="katakana-string">{word.upper()}\n</div></body></html>',
+            content_type="text/html"
+        )
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/", convert)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        agents.setup_eng2kana(
+            f"http://127.0.0.1:{port}/", ClientSession(raise_for_status=True),
+            str(path := tmp_path / "eng2kana.jsonl")
+        )
+        agents.ENG2KANA_FLUSH_DELAY = 0.1
+        agents.eng2kanaData.clear()
+        try:
+            # 同じ英単語は同時に要求されても一度だけ取得する。
+            assert await gather(
+                agents.eng2kana("hello world xyzzy hello"), agents.eng2kana("world test")
+            ) == ["HELLO WORLD xyzzy HELLO", "WORLD TEST"]
+            assert sorted(requested) == ["hello", "test", "world", "xyzzy"]
+            # 変換できなかった英単語も覚えておき、もう一度は取得しない。
+            assert agents.eng2kanaData["xyzzy"] is None
+            assert await agents.eng2kana("xyzzy") == "xyzzy" and requested.count("xyzzy") == 1
+            # 変換結果はまとめてファイルに追記される。
+            await sleep(0.3)
+            first = path.read_text(encoding="utf8").splitlines()
+            assert sorted(map(tuple, map(loads, first))) == [
+                ("hello", "HELLO"), ("test", "TEST"), ("world", "WORLD"), ("xyzzy", None)
+            ]
+            await agents.eng2kana("again")
+            await sleep(0.3)
+            lines = path.read_text(encoding="utf8").splitlines()
+            assert lines[:len(first)] == first and loads(lines[-1]) == ["again", "AGAIN"]
+        finally:
+            await agents.session.close()
+            await runner.cleanup()
+
+    run(main())
@@ -18,11 +18,13 @@ from . import mysql_manager as mysql
 from .olds import tasks_extend, sendKwargs
 from .page import EmbedPage
 from .record import RTCPacket, PacketQueue, BufferDecoder, Decoder
+from .router import route
 from .types import sendableString
 from .views import TimeoutView
 from .webhooks import get_webhook, webhook_send
 
 from .ext import view as componesy
+from .ext.on_full_reaction import reaction_interest
 
 
 __all__ = [
@@ -39,6 +41,7 @@ __all__ = [
     "VoiceChannelsConverter",
     "RolesConverter",
     "DatabaseManager",
+    "bans",
     "debug",
     "dochelp",
     "docperser",
@@ -59,11 +62,14 @@ __all__ = [
     "PacketQueue",
     "BufferDecoder",
     "Decoder",
+    "route",
     "sendableString",
     "TimeoutView",
+    "topics",
     "get_webhook",
     "webhook_send",
     "websocket",
     "ext",
-    "componesy"
+    "componesy",
+    "reaction_interest"
 ]
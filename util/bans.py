@@ -0,0 +1,117 @@
+# Free RT Util - Ban Cache
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Union
+
+from asyncio import Task
+from time import time
+
+from discord.ext import commands, tasks
+import discord
+
+if TYPE_CHECKING:
+    from .bot import RT
+
+
+Guild = Union[discord.Guild, int]
+
+
+class BanCache(commands.Cog):
+    """サーバー毎のBANされているユーザーのIDをキャッシュするためのコグです。
+    `bot.bans`からアクセスできます。
+    BAN/BAN解除のイベントで更新され、`TTL`秒経ったものはバックグラウンドで取得し直されます。"""
+
+    TTL = 3600.0
+    RETRY = 300.0
+    "取得に失敗したサーバーのBANのリストをバックグラウンドで取得し直すまでの秒数です。"
+
+    def __init__(self, bot: RT):
+        self.bot = bot
+        self.bans: dict[int, set[int]] = {}
+        self.fetched: dict[int, float] = {}
+        self.failed: dict[int, float] = {}
+        self._fetching: dict[int, Task] = {}
+        bot.bans = self
+        self._refresh.start()
+
+    def _get_guild(self, guild: Guild) -> discord.Guild:
+        return self.bot.get_guild(guild) if isinstance(guild, int) else guild
+
+    async def _fetch(self, guild: discord.Guild) -> set[int]:
+        # BANのリストを取得する。権限がない場合などは空として扱い、`_refresh`で取得し直せるようにキャッシュはしない。
+        bans = set()
+        try:
+            async for entry in guild.bans(limit=None):
+                bans.add(entry.user.id)
+        except (discord.Forbidden, discord.HTTPException) as e:
+            self.bot.print("[BanCache]", "Failed to fetch bans:", guild.id, e)
+            self.failed[guild.id] = time()
+            return bans
+        self.failed.pop(guild.id, None)
+        self.bans[guild.id] = bans
+        self.fetched[guild.id] = time()
+        return bans
+
+    def prefetch(self, guild: Guild) -> Task:
+        "BANのリストの取得をバックグラウンドで開始します。既に取得中の場合はそれを返します。"
+        guild = self._get_guild(guild)
+        if guild.id not in self._fetching:
+            self._fetching[guild.id] = self.bot.loop.create_task(
+                self._fetch(guild), name=f"[BanCache] Fetch: {guild.id}"
+            )
+            self._fetching[guild.id].add_done_callback(
+                lambda _: self._fetching.pop(guild.id, None)
+            )
+        return self._fetching[guild.id]
+
+    async def get(self, guild: Guild) -> set[int]:
+        "サーバーでBANされているユーザーのIDのセットを取得します。この返り値は書き換えないでください。"
+        guild = self._get_guild(guild)
+        if guild.id in self.bans:
+            return self.bans[guild.id]
+        if guild.id in self.failed:
+            # 取得に失敗したサーバーは待たずに空として扱う。取得し直すのは`_refresh`に任せる。
+            return set()
+        return await self.prefetch(guild)
+
+    async def is_banned(self, guild: Guild, user_id: int) -> bool:
+        "ユーザーがサーバーでBANされているかどうかを調べます。"
+        return user_id in await self.get(guild)
+
+    @commands.Cog.listener()
+    async def on_member_ban(self, guild: discord.Guild, user: discord.User):
+        if guild.id in self.bans:
+            self.bans[guild.id].add(user.id)
+
+    @commands.Cog.listener()
+    async def on_member_unban(self, guild: discord.Guild, user: discord.User):
+        if guild.id in self.bans:
+            self.bans[guild.id].discard(user.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.bans.pop(guild.id, None)
+        self.fetched.pop(guild.id, None)
+        self.failed.pop(guild.id, None)
+
+    @tasks.loop(minutes=5)
+    async def _refresh(self):
+        # 古くなったキャッシュと取得に失敗したサーバーのBANのリストを取得し直す。
+        now = time()
+        for guild_id, fetched in list(self.fetched.items()):
+            if now - fetched > self.TTL and (guild := self.bot.get_guild(guild_id)):
+                self.prefetch(guild)
+        for guild_id, failed in list(self.failed.items()):
+            if now - failed > self.RETRY:
+                if guild := self.bot.get_guild(guild_id):
+                    self.prefetch(guild)
+                else:
+                    self.failed.pop(guild_id, None)
+
+    def cog_unload(self):
+        self._refresh.cancel()
+
+
+async def setup(bot):
+    await bot.add_cog(BanCache(bot))
@@ -1,6 +1,9 @@
 # Free RT Util - Bot
 
+from typing import Optional
+
 from discord.ext import commands
+import discord
 
 from aiohttp import ClientSession
 from ujson import dumps
@@ -8,6 +11,7 @@ from sys import argv
 
 from .dpy_monkey import _setup
 from . import mysql_manager as mysql
+from .pool import PoolPolicy
 from .db import add_db_manager, DBManager
 
 from data import data
@@ -18,17 +22,38 @@ class RT(commands.AutoShardedBot):
         self.user_prefixes: dict[int, str] = {}
         self.guild_prefixes: dict[int, str] = {}
         # プレフィックスの設定。
+        self._base_prefixes: tuple[str, ...] = tuple(data["prefixes"][argv[-1]])
+        self._prefixes: dict[tuple[str, str], tuple[str, ...]] = {}
         kwargs["command_prefix"] = self.get_prefix
         return super().__init__(*args, **kwargs)
 
-    async def get_prefix(self, m = None):
-        pr = data["prefixes"][argv[-1]]
-        if not m == None:
-            if m.author.id in self.user_prefixes and self.user_prefixes[m.author.id]:
-                pr.append(self.user_prefixes[m.author.id])
-            if m.guild.id in self.guild_prefixes and self.guild_prefixes[m.guild.id]:
-                pr.append(self.guild_prefixes[m.guild.id])
-        return pr
+    def get_prefixes(
+        self, guild_id: Optional[int] = None, user_id: Optional[int] = None
+    ) -> tuple[str, ...]:
+        """サーバーとユーザーで使えるプレフィックスを取得します。
+        返り値はキャッシュされているタプルです。"""
+        key = (
+            self.user_prefixes.get(user_id, "") if user_id else "",
+            self.guild_prefixes.get(guild_id, "") if guild_id else ""
+        )
+        if key not in self._prefixes:
+            self._prefixes[key] = self._base_prefixes + tuple(filter(None, key))
+        return self._prefixes[key]
+
+    def invalidate_prefixes(self) -> None:
+        "プレフィックスのキャッシュを削除します。カスタムプレフィックスが変更された際に呼ばれます。"
+        self._prefixes.clear()
+
+    def is_command(self, message: discord.Message) -> bool:
+        "メッセージがプレフィックスで始まっているかどうかを返します。"
+        return message.content.startswith(self.get_prefixes(
+            message.guild.id if message.guild else None, message.author.id
+        ))
+
+    async def get_prefix(self, m: Optional[discord.Message] = None) -> tuple[str, ...]:
+        if m is None:
+            return self._base_prefixes
+        return self.get_prefixes(m.guild.id if m.guild else None, m.author.id)
 
     @property
     def session(self) -> ClientSession:
@@ -44,14 +69,17 @@ class RT(commands.AutoShardedBot):
         await self.load_extension("cogs._first")
         # jishakuを読み込む
         await self.load_extension("jishaku")
+        # プールの設定はauth.jsonのpoolから読み込む。書かれていない場合はテスト用では10、本番環境では50になる。
+        policy = PoolPolicy.from_config(self.secret.get("pool", {}), self.test)
         self.mysql = self.data["mysql"] = mysql.MySQLManager(
             loop=self.loop,
             **self.secret["mysql"],
             pool=True,
-            minsize=1,
-            maxsize=500 if self.test else 1000000,
+            policy=policy,
+            minsize=policy.minsize,
+            maxsize=policy.maxsize,
             autocommit=True
-        )  # maxsizeはテスト用では500、本番環境では100万になっている
+        )
         self.pool = self.mysql.pool  # bot.mysql.pool のエイリアス
 
     def print(self, *args, **kwargs) -> None:
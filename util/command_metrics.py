@@ -0,0 +1,236 @@
+# Free RT Util - Command Metrics
+
+from __future__ import annotations
+
+from typing import Hashable, Iterable, Optional
+
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from math import ceil, inf
+from time import time
+
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, inf)
+"コマンドの実行時間のヒストグラムの区切りの秒数です。"
+
+
+class TopCounter:
+    """上限の数までしか値を覚えないカウンターです。Space-Saving法を使います。
+    上限を超えた場合は一番少ないものを新しい値で置き換えるので、数の多いものはほぼ正確に数えられます。
+
+    Parameters
+    ----------
+    capacity : int
+        覚えておく値の数の上限です。"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: dict[Hashable, int] = {}
+
+    def add(self, key: Hashable, count: int = 1) -> None:
+        "数を増やします。"
+        if key in self.counts or len(self.counts) < self.capacity:
+            self.counts[key] = self.counts.get(key, 0) + count
+        else:
+            minimum = min(self.counts, key=self.counts.__getitem__)
+            self.counts[key] = self.counts.pop(minimum) + count
+
+    def update(self, other: TopCounter) -> None:
+        "他のカウンターの数を足します。"
+        for key, count in other.counts.items():
+            self.add(key, count)
+
+    def most_common(self, count: Optional[int] = None) -> list[tuple[Hashable, int]]:
+        "数が多い順に返します。"
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+class Histogram:
+    "コマンドの実行時間のヒストグラムです。区切りは`LATENCY_BUCKETS`です。"
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.total = 0
+
+    def observe(self, value: float) -> None:
+        "値を追加します。"
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.total += 1
+
+    def update(self, other: Histogram) -> None:
+        "他のヒストグラムを足します。"
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.total += other.total
+
+    def quantile(self, value: float) -> float:
+        "百分位数をその値が入っている区切りの上限で返します。"
+        if not self.total:
+            return 0.0
+        target, current = self.total * value, 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            current += count
+            if current >= target:
+                return bound
+        return inf
+
+
+@dataclass
+class Bucket:
+    "一定時間毎のコマンドの実行記録です。"
+
+    slot: int
+    capacity: int
+    total: int = 0
+    errors: int = 0
+    commands: TopCounter = field(init=False)
+    parents: TopCounter = field(init=False)
+    users: TopCounter = field(init=False)
+    guilds: TopCounter = field(init=False)
+    latencies: dict[str, Histogram] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.commands, self.parents, self.users, self.guilds = (
+            TopCounter(self.capacity) for _ in range(4)
+        )
+
+    def update(self, other: Bucket) -> None:
+        "他の記録を足します。"
+        self.total += other.total
+        self.errors += other.errors
+        for key in ("commands", "parents", "users", "guilds"):
+            getattr(self, key).update(getattr(other, key))
+        for name, histogram in other.latencies.items():
+            self.latencies.setdefault(name, Histogram()).update(histogram)
+
+
+class CommandMetrics:
+    """コマンドの実行回数と実行時間を記録するためのクラスです。
+    直近の記録は`width`秒毎に区切った`count`個の`Bucket`を使い回して保存するので、使うメモリは一定です。
+    Prometheus用に起動してからの合計もコマンド毎に記録します。
+
+    Parameters
+    ----------
+    count : int, default 60
+        直近の記録を何個に区切って保存するかです。
+    width : float, default 60.0
+        一つの区切りの秒数です。
+    capacity : int, default 50
+        区切り毎にコマンドやユーザー等を何個まで数えるかです。"""
+
+    def __init__(self, count: int = 60, width: float = 60.0, capacity: int = 50):
+        self.count, self.width, self.capacity = count, width, capacity
+        self.buckets: list[Optional[Bucket]] = [None] * count
+        # Prometheus用の起動してからの合計です。(コマンド, 親コマンド, 失敗したかどうか)毎の回数とコマンド毎の実行時間です。
+        self.totals: dict[tuple[str, str, bool], int] = {}
+        self.latencies: dict[str, Histogram] = {}
+
+    def _slot(self, now: Optional[float] = None) -> int:
+        return int((time() if now is None else now) // self.width)
+
+    def _bucket(self, slot: int) -> Bucket:
+        # 区切りを取得する。古いものが入っている場合は空にする。
+        bucket = self.buckets[slot % self.count]
+        if bucket is None or bucket.slot != slot:
+            bucket = self.buckets[slot % self.count] = Bucket(slot, self.capacity)
+        return bucket
+
+    def record(
+        self, command: str, parent: str, user_id: int, guild_id: int,
+        elapsed: Optional[float], error: bool = False
+    ) -> None:
+        """コマンドの実行を記録します。
+
+        Parameters
+        ----------
+        command : str
+            コマンドの名前です。
+        parent : str
+            一番上の親コマンドの名前です。
+        user_id : int
+            実行したユーザーのIDです。
+        guild_id : int
+            実行されたサーバーのIDです。DMの場合は0にしてください。
+        elapsed : float, optional
+            実行にかかった秒数です。
+        error : bool, default False
+            実行に失敗したかどうかです。"""
+        bucket = self._bucket(self._slot())
+        bucket.total += 1
+        bucket.errors += error
+        bucket.commands.add(command)
+        bucket.parents.add(parent)
+        bucket.users.add(user_id)
+        bucket.guilds.add(guild_id)
+        key = (command, parent, error)
+        self.totals[key] = self.totals.get(key, 0) + 1
+        if elapsed is not None:
+            bucket.latencies.setdefault(command, Histogram()).observe(elapsed)
+            self.latencies.setdefault(command, Histogram()).observe(elapsed)
+
+    def window(self, seconds: Optional[float] = None) -> Bucket:
+        "直近の指定した秒数の記録を合計して返します。指定しない場合は保存している全ての記録を合計します。"
+        current = self._slot()
+        # 今の区切りも含めて`ceil(seconds / width)`個の区切りを合計する。
+        oldest = current - (self.count - 1 if seconds is None else min(
+            self.count - 1, max(ceil(seconds / self.width) - 1, 0)
+        ))
+        merged = Bucket(current, self.capacity)
+        for bucket in self.buckets:
+            if bucket is not None and oldest <= bucket.slot <= current:
+                merged.update(bucket)
+        return merged
+
+    def completed(self) -> Optional[Bucket]:
+        "一つ前の区切りの記録を返します。"
+        slot = self._slot() - 1
+        if (bucket := self.buckets[slot % self.count]) is not None and bucket.slot == slot:
+            return bucket
+
+    def slowest(self, bucket: Bucket, value: float = 0.99) -> list[tuple[str, float, Histogram]]:
+        "記録の中のコマンドを実行時間の百分位数が大きい順に返します。"
+        return sorted(
+            ((name, histogram.quantile(value), histogram)
+             for name, histogram in bucket.latencies.items()),
+            key=lambda item: (item[1], item[2].sum / item[2].total), reverse=True
+        )
+
+    def prometheus(self, prefix: str = "freert") -> str:
+        "起動してからの合計をPrometheusのテキスト形式で返します。"
+        lines = [
+            f"# HELP {prefix}_commands_total Number of command invocations.",
+            f"# TYPE {prefix}_commands_total counter"
+        ]
+        for (command, parent, error), count in sorted(self.totals.items()):
+            lines.append(
+                f'{prefix}_commands_total{{command="{_escape(command)}",parent="{_escape(parent)}",'
+                f'status="{"error" if error else "ok"}"}} {count}'
+            )
+        lines.extend((
+            f"# HELP {prefix}_command_latency_seconds Command latency from invocation to completion.",
+            f"# TYPE {prefix}_command_latency_seconds histogram"
+        ))
+        for command, histogram in sorted(self.latencies.items()):
+            label, current = _escape(command), 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                current += count
+                lines.append(
+                    f'{prefix}_command_latency_seconds_bucket{{command="{label}",'
+                    f'le="{"+Inf" if bound == inf else bound}"}} {current}'
+                )
+            lines.append(f'{prefix}_command_latency_seconds_sum{{command="{label}"}} {histogram.sum}')
+            lines.append(f'{prefix}_command_latency_seconds_count{{command="{label}"}} {histogram.total}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    # Prometheusのラベルの値をエスケープする。
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_top(items: Iterable[tuple[Hashable, int]]) -> str:
+    "`TopCounter.most_common`の結果を表示用の文字列にします。"
+    return "\n".join(f"{key}：{count}回" for key, count in items) or "なし"
@@ -7,6 +7,8 @@ from functools import wraps
 
 from aiomysql import Cursor
 
+from .pool import MeteredPool
+
 
 class _Dummy:
     default = Parameter.empty
@@ -32,16 +34,13 @@ class DatabaseManager:
             selfmade = "cursor" not in kwargs and not any(isinstance(arg, Cursor) for arg in args)
             if selfmade:
                 # connectionとcursorを作成してkwargsに渡す。
-                conn = await self.pool.acquire()
+                conn = await (
+                    self.pool.acquire(coro.__qualname__)
+                    if isinstance(self.pool, MeteredPool) else self.pool.acquire()
+                )
                 kwargs["cursor"] = await conn.cursor()
             try:
                 data = await coro(self, *args, **kwargs)
-            except Exception as e:
-                if selfmade:
-                    # 自動でcursorを閉じ、releaseする。
-                    await kwargs["cursor"].close()
-                    self.pool.release(conn)
-                raise e
             finally:
                 if selfmade:
                     # 自動でcursorを閉じ、releaseする。
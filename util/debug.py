@@ -8,6 +8,8 @@ from aiofiles import open as async_open, os
 from functools import wraps
 import psutil
 
+from .command_metrics import format_top
+
 
 def require_admin(coro):
     @wraps(coro)
@@ -128,6 +130,132 @@ class Debug(commands.Cog):
         )
         return embed
 
+    @debug.command()
+    @require_admin
+    async def pool(self, ctx):
+        if not hasattr(pool := self.bot.mysql.pool, "metrics"):
+            return await ctx.reply("プールが計測されていません。")
+        metrics = pool.metrics()
+        embed = discord.Embed(
+            title="Pool",
+            description=f"In use: {metrics['in_use']}/{metrics['maxsize']}\n"
+                        f"Idle: {metrics['idle']} (Size: {metrics['size']})\n"
+                        f"Waiting: {metrics['waiting']}\n"
+                        f"Acquire p50: {metrics['p50'] * 1000:.1f}ms, p99: {metrics['p99'] * 1000:.1f}ms",
+            color=0x0066ff
+        )
+        for caller, stats in pool.top_callers(15):
+            embed.add_field(
+                name=caller[-100:],
+                value=f"Acquired: {stats.acquired}\nFailed: {stats.failed}\n"
+                      f"Wait: {stats.wait:.3f}s\nHeld: {stats.held:.3f}s"
+            )
+        await ctx.reply(embed=embed)
+
+    @debug.command()
+    @require_admin
+    async def router(self, ctx):
+        router = self.bot.router
+        embed = discord.Embed(
+            title="MessageRouter",
+            description=f"Messages: {router.messages}\nScheduled: {router.scheduled}\n"
+                        f"Listeners: {len(router.masks.routes)}",
+            color=0x0066ff
+        )
+        for route in router.stats()[:15]:
+            embed.add_field(
+                name=route.name,
+                value=f"Calls: {route.calls}\nErrors: {route.errors}\n"
+                      f"Total: {route.total:.3f}s\nMax: {route.max * 1000:.1f}ms"
+            )
+        await ctx.reply(embed=embed)
+
+    @debug.command()
+    @require_admin
+    async def tts(self, ctx):
+        if "TTS" not in self.bot.cogs:
+            return await ctx.reply("読み上げ機能が読み込まれていません。")
+        metrics = self.bot.cogs["TTS"].cache.metrics()
+        await ctx.reply(embed=discord.Embed(
+            title="TTS Cache",
+            description=f"Entries: {metrics['entries']}\n"
+                        f"Size: {metrics['size'] / 1024 / 1024:.1f}/{metrics['budget'] / 1024 / 1024:.1f}MB\n"
+                        f"Memory: {metrics['memory'] / 1024 / 1024:.1f}/{metrics['memory_budget'] / 1024 / 1024:.1f}MB\n"
+                        f"Hits: {metrics['hits']}, Misses: {metrics['misses']} ({metrics['hit_rate'] * 100:.1f}%)\n"
+                        f"Evictions: {metrics['evictions']}",
+            color=0x0066ff
+        ))
+
+    @debug.command()
+    @require_admin
+    async def data(self, ctx):
+        if "DataManager" not in self.bot.cogs:
+            return await ctx.reply("DataManagerが読み込まれていません。")
+        cog = self.bot.cogs["DataManager"]
+        embed = discord.Embed(
+            title="DataManager",
+            description=f"Startup load: {sum(rows for rows, _ in cog.load_times.values())} rows "
+                        f"in {sum(took for _, took in cog.load_times.values()):.3f}s",
+            color=0x0066ff
+        )
+        for table in sorted(set(cog.load_times) | set(cog.lazy) | set(cog.stats))[:25]:
+            value = []
+            if table in cog.load_times:
+                value.append(f"Load: {cog.load_times[table][0]} rows in {cog.load_times[table][1] * 1000:.1f}ms")
+            if (state := cog.lazy.get(table)) is not None:
+                value.append(f"Lazy: {len(state.loaded)}/{state.size}, Hits: {state.hits}, Misses: {state.misses}")
+            if (stats := cog.stats.get(table)) is not None:
+                value.append(
+                    f"Sync: {stats.count} ({stats.rows} rows, {stats.failed} failed), "
+                    f"Avg: {stats.average_latency * 1000:.1f}ms"
+                )
+            embed.add_field(name=table, value="\n".join(value), inline=False)
+        await ctx.reply(embed=embed)
+
+    @debug.command()
+    @require_admin
+    async def scheduler(self, ctx):
+        metrics = self.bot.scheduler.metrics()
+        await ctx.reply(embed=discord.Embed(
+            title="Scheduler",
+            description=f"Loaded: {metrics['loaded']} (Heap: {metrics['heap']})\n"
+                        f"Waiting: {metrics['waiting']}\n"
+                        f"Fired: {metrics['fired']}, Failed: {metrics['failed']}, Dropped: {metrics['dropped']}\n"
+                        "Next: " + ("None" if metrics["next"] is None else f"{metrics['next']:.1f}s"),
+            color=0x0066ff
+        ))
+
+    @debug.command()
+    @require_admin
+    async def reaction(self, ctx):
+        metrics = self.bot.cogs["OnFullReactionAddRemove"].metrics()
+        await ctx.reply(embed=discord.Embed(
+            title="Full Reaction",
+            description=f"Cached messages: {metrics['messages']}, Authors: {metrics['authors']}\n"
+                        f"Hits: {metrics['hits']}, Fetches: {metrics['fetches']}, Skips: {metrics['skips']}",
+            color=0x0066ff
+        ))
+
+    @debug.command(name="commands")
+    @require_admin
+    async def command_metrics(self, ctx, minutes: int = 60):
+        if not hasattr(self.bot, "command_metrics"):
+            return await ctx.reply("コマンドの実行記録がありません。")
+        metrics = self.bot.command_metrics
+        bucket = metrics.window(minutes * 60)
+        embed = discord.Embed(
+            title="Commands",
+            description=f"直近{minutes}分間で{bucket.total}回の実行 (失敗: {bucket.errors}回)",
+            color=0x0066ff
+        )
+        for name, key in (("コマンド", "commands"), ("親コマンド", "parents"), ("ユーザー", "users"), ("サーバー", "guilds")):
+            embed.add_field(name=name, value=format_top(getattr(bucket, key).most_common(5)))
+        embed.add_field(name="遅いコマンド (p99)", value="\n".join(
+            f"{name}：p50 {histogram.quantile(0.5) * 1000:.0f}ms, p99 {p99 * 1000:.0f}ms ({histogram.total}回)"
+            for name, p99, histogram in metrics.slowest(bucket)[:5]
+        ) or "なし", inline=False)
+        await ctx.reply(embed=embed)
+
     @debug.command()
     @require_admin
     async def monitor(self, ctx):
@@ -208,9 +208,7 @@ class DocHelp(commands.Cog):
     def prefix(self):
         # Botの一番最初にあるプリフィックスを取得します。
         if self._prefix is None:
-            self._prefix = self.bot.command_prefix
-            if isinstance(self._prefix, (tuple, list)):
-                self._prefix = self._prefix[0]
+            self._prefix = self.bot.get_prefixes()[0]
         return self._prefix
 
     async def on_command_add(self, command, after: bool = False):
@@ -18,7 +18,10 @@ async def _setup(self, mode: tuple[str, ...] = ()) -> None:
                 await self.load_extension("util.ext." + name)
             except commands.ExtensionAlreadyLoaded:
                 pass
-    for name in ("dochelp", "rtws", "websocket", "debug", "settings", "lib_data_manager"):
+    for name in (
+        "dochelp", "rtws", "websocket", "debug", "settings", "lib_data_manager", "bans",
+        "webhooks", "topics", "router", "scheduler"
+    ):
         if name in mode or mode == ():
             try:
                 await self.load_extension("util." + name)
@@ -1,10 +1,77 @@
+# Free RT Util - On Full Reaction
+
+from __future__ import annotations
+
+from typing import Callable, Iterable, Optional, Any
+
+from collections import OrderedDict
+from dataclasses import dataclass
 
 from discord.ext import commands
+import discord
+
+
+GuildCheck = Callable[[Any, int], bool]
+IdCheck = Callable[[Any, int], bool]
+
+
+@dataclass
+class Interest:
+    "`on_full_reaction_add/remove`のリスナーがどのリアクションでメッセージを必要とするかです。"
+
+    emojis: Optional[frozenset[str]] = None
+    bot_author: bool = False
+    dm: bool = True
+    guild: Optional[GuildCheck] = None
+    channel: Optional[IdCheck] = None
+    message: Optional[IdCheck] = None
+
+
+def reaction_interest(
+    *, emojis: Optional[Iterable[str]] = None, bot_author: bool = False, dm: bool = True,
+    guild: Optional[GuildCheck] = None, channel: Optional[IdCheck] = None,
+    message: Optional[IdCheck] = None
+):
+    """`on_full_reaction_add/remove`のリスナーがどのリアクションでメッセージを必要とするかを設定するデコレータです。
+    設定した全ての条件に当てはまるリアクションでのみ`payload.message`が取得されます。
+    このデコレータが付いていないリスナーがある場合は全てのリアクションでメッセージを取得します。
+    リスナー自体は条件に関係なく呼ばれるので、`payload.message`がない場合は無視するようにしてください。
+
+    Parameters
+    ----------
+    emojis : Iterable[str], optional
+        対象の絵文字です。
+    bot_author : bool, default False
+        RTかウェブフックが送信したメッセージのみを対象にするかどうかです。
+        パネルはウェブフックで送信されるためウェブフックも含みます。
+    dm : bool, default True
+        DMのリアクションも対象にするかどうかです。
+    guild : Callable[[Cog, int], bool], optional
+        サーバーIDを受け取りサーバーが対象かどうかを返す関数です。DMは対象外になります。
+    channel : Callable[[Cog, int], bool], optional
+        チャンネルIDを受け取りチャンネルが対象かどうかを返す関数です。
+    message : Callable[[Cog, int], bool], optional
+        メッセージIDを受け取りメッセージが対象かどうかを返す関数です。"""
+    def decorator(func):
+        func.__reaction_interest__ = Interest(
+            None if emojis is None else frozenset(emojis), bot_author, dm, guild, channel, message
+        )
+        return func
+    return decorator
 
 
 class OnFullReactionAddRemove(commands.Cog):
+
+    MAX_MESSAGES = 1000
+    "取得したメッセージを何個までキャッシュするかです。"
+    MAX_AUTHORS = 10000
+    "メッセージがRTかウェブフックによって送信されたものかを何個まで覚えておくかです。"
+
     def __init__(self, bot, timeout: float = 0.025):
         self.bot, self.timeout = bot, timeout
+        self.messages: OrderedDict[int, discord.Message] = OrderedDict()
+        self.authors: OrderedDict[int, bool] = OrderedDict()
+        self.hits = self.fetches = self.skips = 0
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
@@ -14,25 +81,152 @@ class OnFullReactionAddRemove(commands.Cog):
     async def on_raw_reaction_remove(self, payload):
         await self.on_raw_reaction_addremove(payload, "remove")
 
+    def _remember(self, cache: OrderedDict, key: int, value: Any, max_: int) -> None:
+        # LRUのキャッシュに追加する。
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > max_:
+            cache.popitem(last=False)
+
+    def _cached(self, message_id: int) -> Optional[discord.Message]:
+        # キャッシュからメッセージを取得する。discord.pyがキャッシュしているものはリアクションも更新されている。
+        if (message := self.bot._connection._get_message(message_id)) is None \
+                and (message := self.messages.get(message_id)) is not None:
+            self.messages.move_to_end(message_id)
+        return message
+
+    def _by_bot(self, message: discord.Message) -> bool:
+        # メッセージがRTかウェブフックによって送信されたものかどうかを返す。
+        return message.author.id == self.bot.user.id or message.webhook_id is not None
+
+    def _learn(self, payload: discord.RawReactionActionEvent) -> None:
+        # リアクションのイベントにあるメッセージの送信者のIDからRTかウェブフックによって送信されたものかを調べる。
+        # ウェブフックのIDはメンバーにいないので、メンバーにいない場合はわからないとする。
+        if (author := payload.message_author_id) is None:
+            return
+        if author == self.bot.user.id:
+            self._remember(self.authors, payload.message_id, True, self.MAX_AUTHORS)
+        elif payload.guild_id is None or (
+            (guild := self.bot.get_guild(payload.guild_id)) is not None
+            and guild.get_member(author) is not None
+        ):
+            self._remember(self.authors, payload.message_id, False, self.MAX_AUTHORS)
+
+    def _author(self, message_id: int) -> Optional[bool]:
+        # メッセージがRTかウェブフックによって送信されたものかどうかを返す。わからない場合は`None`を返す。
+        if (message := self._cached(message_id)) is not None:
+            return self._by_bot(message)
+        return self.authors.get(message_id)
+
+    def _check(self, listener, key: str, value: int) -> bool:
+        try:
+            return getattr(listener.__reaction_interest__, key)(getattr(listener, "__self__", None), value)
+        except Exception as e:
+            self.bot.print("[OnFullReaction]", f"Failed to check {key}:", e)
+            return True
+
+    def interested(self, payload: discord.RawReactionActionEvent, event: str) -> bool:
+        "メッセージを取得する必要のあるリスナーがいるかどうかを返します。"
+        emoji = str(payload.emoji)
+        for listener in self.bot.extra_events.get(f"on_full_reaction_{event}", ()):
+            if (interest := getattr(listener, "__reaction_interest__", None)) is None:
+                return True
+            if interest.emojis is not None and emoji not in interest.emojis:
+                continue
+            if not interest.dm and payload.guild_id is None:
+                continue
+            if interest.guild is not None and (
+                payload.guild_id is None or not self._check(listener, "guild", payload.guild_id)
+            ):
+                continue
+            if interest.channel is not None and not self._check(listener, "channel", payload.channel_id):
+                continue
+            if interest.message is not None and not self._check(listener, "message", payload.message_id):
+                continue
+            # 送信者がわからない場合は取得してから確認する。
+            if interest.bot_author and self._author(payload.message_id) is False:
+                continue
+            return True
+        return False
+
+    def _update_reaction(self, payload: discord.RawReactionActionEvent, event: str) -> None:
+        # キャッシュしているメッセージのリアクションを更新する。
+        if (message := self.messages.get(payload.message_id)) is None:
+            return
+        try:
+            emoji = self.bot._connection._upgrade_partial_emoji(payload.emoji)
+            if event == "add":
+                message._add_reaction({"me": False}, emoji, payload.user_id)
+            else:
+                message._remove_reaction({}, emoji, payload.user_id)
+        except Exception:
+            # 更新できない場合は次に必要になった時に取得し直す。
+            del self.messages[payload.message_id]
+
     async def on_raw_reaction_addremove(self, payload, event: str):
-        # もし`self.on_reaction_addremove`が呼ばれなかった場合は自分でmessageを取得する。
+        self._learn(payload)
+        self._update_reaction(payload, event)
         try:
-            channel = (
-                self.bot.get_channel(payload.channel_id)
-                if payload.guild_id
-                else self.bot.get_user(payload.user_id)
-            )
-            payload.message = await channel.fetch_message(payload.message_id)
-            payload.member = (
-                payload.message.guild.get_member(payload.user_id)
-                if payload.guild_id else None
-            )
+            if payload.guild_id:
+                if (guild := self.bot.get_guild(payload.guild_id)) is None:
+                    return
+                payload.member = guild.get_member(payload.user_id)
+            if not self.interested(payload, event):
+                self.skips += 1
+                return
+            if (message := self._cached(payload.message_id)) is not None:
+                self.hits += 1
+            else:
+                # メッセージを必要とするリスナーがいる場合のみ取得する。
+                channel = (
+                    self.bot.get_channel(payload.channel_id)
+                    if payload.guild_id
+                    else self.bot.get_user(payload.user_id)
+                )
+                message = await channel.fetch_message(payload.message_id)
+                self.fetches += 1
+                self._remember(self.messages, message.id, message, self.MAX_MESSAGES)
+                self._remember(self.authors, message.id, self._by_bot(message), self.MAX_AUTHORS)
+            payload.message = message
         except Exception:
             return
         finally:
             # `on_full_reaction_add/remove`を呼び出す。
             self.bot.dispatch("full_reaction_" + event, payload)
 
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if (message := self.messages.get(payload.message_id)) is not None:
+            try:
+                message._update(payload.data)
+            except Exception:
+                del self.messages[payload.message_id]
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.messages.pop(payload.message_id, None)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        for message_id in payload.message_ids:
+            self.messages.pop(message_id, None)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent):
+        if (message := self.messages.get(payload.message_id)) is not None:
+            message.reactions.clear()
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent):
+        self.messages.pop(payload.message_id, None)
+
+    def metrics(self) -> dict[str, int]:
+        "メッセージの取得とキャッシュの状態を返します。"
+        return {
+            "messages": len(self.messages), "authors": len(self.authors),
+            "hits": self.hits, "fetches": self.fetches, "skips": self.skips
+        }
+
 
 async def setup(bot):
     timeout = getattr(bot, "_util_ofr_timeout", 0.025)
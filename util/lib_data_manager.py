@@ -6,8 +6,10 @@ from typing import (
     TYPE_CHECKING, TypeVar, Literal, Union, Optional, NoReturn, Any, get_args
 )
 
-from collections import defaultdict
-from asyncio import Event
+from dataclasses import dataclass, field
+from collections import defaultdict, OrderedDict
+from asyncio import Future, Event, sleep
+from time import monotonic
 
 from discord.ext import commands, tasks
 
@@ -39,18 +41,156 @@ class ChangedDict(dict):
 
 class DataDict(defaultdict):
 
-    _removed = []
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 削除されたキーです。同期時にまとめて削除されます。
+        self._removed: set[Key] = set()
 
     def __delitem__(self, key: str) -> None:
-        self._removed.append(key)
+        self._removed.add(key)
         return super().__delitem__(key)
 
     def __setitem__(self, key: str, value: dict):
-        if key in self._removed:
-            self._removed.remove(key)
+        self._removed.discard(key)
         return super().__setitem__(key, value)
 
 
+MUTABLE_TYPES = (dict, list, set)
+MARKING_ATTRIBUTES = ("pop", "update")
+
+
+def _track(value: Any, cog: DataManager, owner: tuple[str, Key]) -> Any:
+    # 辞書とリストを書き換えられた時にデータを変更されたものとして記録するものにする。
+    if isinstance(value, (TrackedDict, TrackedList)) \
+            and value._cog is cog and value._owner == owner:
+        return value
+    if isinstance(value, dict):
+        return TrackedDict(value, cog, owner)
+    if isinstance(value, list):
+        return TrackedList(value, cog, owner)
+    return value
+
+
+def _marking(method):
+    # 実行した後にデータを変更されたものとして記録するようにする。
+    def new_method(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._changed()
+        return result
+    return new_method
+
+
+class TrackedList(list):
+    """書き換えられた時にそのキーのデータを変更されたものとして記録するリストです。
+    中にある辞書とリストも同じように記録されます。"""
+
+    def __init__(self, data: Any, cog: DataManager, owner: tuple[str, Key]):
+        self._cog, self._owner = cog, owner
+        super().__init__(_track(value, cog, owner) for value in data)
+
+    def _track(self, value: Any) -> Any:
+        return _track(value, self._cog, self._owner)
+
+    def _changed(self) -> None:
+        self._cog.mark(*self._owner)
+
+    def __setitem__(self, index, value):
+        super().__setitem__(
+            index, [self._track(v) for v in value]
+            if isinstance(index, slice) else self._track(value)
+        )
+        self._changed()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def append(self, value):
+        super().append(self._track(value))
+        self._changed()
+
+    def extend(self, values):
+        super().extend(map(self._track, values))
+        self._changed()
+
+    def insert(self, index, value):
+        super().insert(index, self._track(value))
+        self._changed()
+
+
+for name in ("__delitem__", "__imul__", "pop", "remove", "clear", "sort", "reverse"):
+    setattr(TrackedList, name, _marking(getattr(list, name)))
+
+
+class TrackedDict(dict):
+    """書き換えられた時にそのキーのデータを変更されたものとして記録する辞書です。
+    中にある辞書とリストも同じように記録されます。"""
+
+    def __init__(self, data: Any, cog: DataManager, owner: tuple[str, Key]):
+        self._cog, self._owner = cog, owner
+        super().__init__((key, _track(value, cog, owner)) for key, value in data.items())
+
+    def _track(self, value: Any) -> Any:
+        return _track(value, self._cog, self._owner)
+
+    def _changed(self) -> None:
+        self._cog.mark(*self._owner)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self._track(value))
+        self._changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            super().__setitem__(key, self._track(value))
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+for name in ("__delitem__", "pop", "popitem", "clear"):
+    setattr(TrackedDict, name, _marking(getattr(dict, name)))
+del name
+
+
+@dataclass
+class FlushStats:
+    "テーブル毎の同期の統計です。"
+
+    count: int = 0
+    rows: int = 0
+    removed: int = 0
+    failed: int = 0
+    last_latency: float = 0.0
+    total_latency: float = 0.0
+
+    @property
+    def average_latency(self) -> float:
+        "同期一回あたりの平均の所要時間(秒)です。"
+        return self.total_latency / self.count if self.count else 0.0
+
+
+@dataclass
+class LazyState:
+    "遅延読み込みを行うテーブルのキャッシュの状態です。"
+
+    size: int
+    ttl: float
+    # 読み込み済みのキーと最後にアクセスされた時間です。古い順に並んでいます。
+    loaded: OrderedDict[Key, float] = field(default_factory=OrderedDict)
+    # 読み込み待ちのキーとその結果を待つためのFutureです。
+    pending: dict[Key, Future] = field(default_factory=dict)
+    hits: int = 0
+    misses: int = 0
+
+
 TableSelfT = TypeVar("TableSelfT", bound="Table")
 
 
@@ -58,6 +198,10 @@ class Table:
 
     __allocation__: Optional[str] = None
     __key__: Optional[Key] = None
+    # 遅延読み込みをするかどうかです。有効な場合はデータを使う前に`load`を実行する必要があります。
+    __lazy__: bool = False
+    __cache_size__: int = 10000
+    __cache_ttl__: float = 1800.0
 
     def __init__(self, bot: RT, immediately_sync: bool = False, heritance: bool = False):
         assert self.__allocation__ is not None, "割り振りを設定してください。"
@@ -80,19 +224,59 @@ class Table:
     def __getattr__(self: TableSelfT, key: str) -> Any:
         if self.__key__:
             if key in ("pop", "update", "get", "items", "values", "keys"):
-                return getattr(self.cog.data[self.name][self.__key__], key)
+                if key == "get":
+                    return self._get
+                row = self._row()
+                if key in MARKING_ATTRIBUTES:
+                    self._mark()
+                elif key in ("items", "values"):
+                    for name in row:
+                        self._tracked(row, name)
+                return getattr(row, key)
             elif key in self.__annotations__:
-                return self.cog.data[self.name][self.__key__][key]
+                return self._tracked(self._row(), key)
         raise AttributeError(key)
 
+    def _tracked(self, row: ChangedDict, key: str) -> Any:
+        # 値を取得する。辞書とリストは書き換えられた時に変更されたとみなすものにして保存し直す。
+        value = row[key]
+        if (tracked := _track(value, self.cog, (self.name, self.__key__))) is not value:
+            dict.__setitem__(row, key, value := tracked)
+        elif isinstance(value, MUTABLE_TYPES) and not isinstance(value, (TrackedDict, TrackedList)):
+            # 記録できないものは中身を書き換えられる可能性があるので変更されたとみなす。
+            self._mark()
+        return value
+
+    def _get(self, key, default=None):
+        # `dict.get`と同じですが、辞書とリストは書き換えられた時に変更されたとみなすものを返します。
+        row = self._row()
+        return self._tracked(row, key) if key in row else default
+
+    def _row(self) -> ChangedDict:
+        # このキーのデータを取得する。遅延読み込みのテーブルで既にキャッシュから消されている場合は、
+        # 空のデータが作られて保存されているデータを上書きしてしまわないようにエラーにする。
+        if self.__lazy__:
+            self.cog.touch(self.name, self.__key__)
+        return self.cog.data[self.name][self.__key__]
+
+    def _mark(self):
+        # このキーのデータを同期対象にする。
+        self.cog.mark(self.name, self.__key__)
+
     def to_dict(self) -> dict:
         "このデータにある辞書を返します。この関数が返すものに値は書き込まないでください。"
-        return self.cog.data[self.name] if self.__key__ is None \
-            else self.cog.data[self.name][self.__key__]
+        return self.cog.data[self.name] if self.__key__ is None else self._row()
 
     def sync(self):
         self.cog.sync(self.name)
 
+    async def load(self, *keys: Key) -> None:
+        """渡されたキーのデータを読み込みます。
+        遅延読み込みが有効なテーブルでは、データにアクセスする前にこれを実行する必要があります。
+        有効ではない場合は何もしません。"""
+        if self.__lazy__:
+            await self.cog.load(self.name, keys)
+
     def _assert_key(self) -> Optional[NoReturn]:
         assert self.__key__ is not None, "キーが設定されていません。"
 
@@ -100,25 +284,30 @@ class Table:
         if key in self.__annotations__:
             self._assert_key()
             new = self.__key__ not in self.cog.data[self.name]
-            self.cog.data[self.name][self.__key__][key] = value
+            self._row()[key] = value
             if new:
                 self.cog.data[self.name][self.__key__]._new = new
+            self._mark()
         else:
             return super().__setattr__(key, value)
 
     def __getitem__(self: TableSelfT, key: Key) -> TableSelfT:
         assert self.__key__ is None, "既にキーは設定されています。"
+        if self.__lazy__:
+            self.cog.touch(self.name, key)
         new = self.__class__(self.bot, heritance=True)
         new.__key__ = key
         return new
 
     def __delitem__(self, key: Key) -> None:
         del self.cog.data[self.name][key]
+        self.cog.dirty[self.name].pop(key, None)
 
     def __delattr__(self, key: str) -> None:
         if key in self.__annotations__:
             self._assert_key()
-            del self.cog.data[self.name][self.__key__][key]
+            del self._row()[key]
+            self._mark()
         else:
             return super().__delattr__(key)
 
@@ -126,16 +315,35 @@ class Table:
         if self.__key__ is None:
             return key in self.cog.data[self.name]
         else:
-            return key in self.cog.data[self.name][self.__key__]
+            return key in self._row()
 
 
 class DataManager(commands.Cog):
+    """`Table`のデータをキャッシュし、変更されたものだけをデータベースに書き戻すコグです。
+
+    変更されたキーは`mark`で記録され、テーブル毎にまとめて一つのトランザクションで書き込まれます。
+    書き込みは変更されたキーの数が`FLUSH_SIZE`を超えるか、
+    最も古い変更から`FLUSH_AGE`秒経過した時に行われます。"""
+
+    FLUSH_SIZE = 500
+    FLUSH_AGE = 600.0
+    FLUSH_CHUNK = 200
+
     def __init__(self, bot: RT):
         self.bot = bot
         self.data: defaultdict[str, DataDict[Key, ChangedDict]] = defaultdict(
             lambda: DataDict(ChangedDict)
         )
         self.allocations: dict[str, str] = {}
+        # 変更されたキーとその変更が最初に行われた時間です。
+        self.dirty: defaultdict[str, dict[Key, float]] = defaultdict(dict)
+        self.stats: defaultdict[str, FlushStats] = defaultdict(FlushStats)
+        # 起動時に全て読み込んだテーブルの行数とかかった秒数です。
+        self.load_times: dict[str, tuple[int, float]] = {}
+        self._digests: defaultdict[str, dict[Key, int]] = defaultdict(dict)
+        self._upsertable: dict[str, bool] = {}
+        self.lazy: dict[str, LazyState] = {}
+        self._syncing: set[str] = set()
         self._loaded: list[str] = []
         self._auto_sync.start()
 
@@ -147,89 +355,269 @@ class DataManager(commands.Cog):
                 if table.name not in self._loaded:
                     await cursor.execute(
                         f"""CREATE TABLE IF NOT EXISTS {table.name} (
-                            {table.__allocation_name__} {table.__allocation_type__}, Data JSON
+                            {table.__allocation_name__} {table.__allocation_type__}
+                                PRIMARY KEY NOT NULL,
+                            Data JSON
                         );"""
                     )
-                # キャッシュを作る。
+                    self._upsertable[table.name] = await self._prepare_primary_key(
+                        cursor, table.name, table.__allocation_name__
+                    )
+                    self._loaded.append(table.name)
                 self.allocations[table.name] = table.__allocation_name__
-                await cursor.execute(f"SELECT * FROM {table.name};")
-                for row in await cursor.fetchall():
-                    if row:
-                        self.data[table.name][row[0]] = ChangedDict(loads(row[1]))
-                        self.data[table.name][row[0]].changed = False
+                if table.__lazy__:
+                    # 遅延読み込みの場合は使われるまで読み込まない。
+                    self.lazy.setdefault(table.name, LazyState(
+                        table.__cache_size__, table.__cache_ttl__
+                    ))
+                else:
+                    # キャッシュを作る。
+                    started = monotonic()
+                    await cursor.execute(f"SELECT * FROM {table.name};")
+                    rows = await cursor.fetchall()
+                    self._store(table.name, rows)
+                    self.load_times[table.name] = (len(rows), monotonic() - started)
+                    self.print(
+                        "[load]", table.name,
+                        f"{len(rows)} rows in {self.load_times[table.name][1] * 1000:.1f}ms"
+                    )
 
         table.locked.set()
 
+    def _store(self, table: str, rows: list[tuple]) -> None:
+        # データベースから取得した行をキャッシュに入れる。変更済みのものは上書きしない。
+        for row in rows:
+            if row and row[0] not in self.dirty[table] \
+                    and row[0] not in self.data[table]._removed:
+                self.data[table][row[0]] = ChangedDict(loads(row[1]))
+                self.data[table][row[0]].changed = False
+
+    def touch(self, table: str, key: Key) -> None:
+        "遅延読み込みのテーブルのキーを使用したことを記録します。読み込まれていない場合はエラーとなります。"
+        state = self.lazy[table]
+        assert key in state.loaded, \
+            f"{table}の{key}は読み込まれていないかキャッシュから消されています。先に`Table.load`を実行してください。"
+        state.loaded[key] = monotonic()
+        state.loaded.move_to_end(key)
+
+    async def load(self, table: str, keys: tuple[Key, ...]) -> None:
+        """遅延読み込みのテーブルの指定されたキーのデータを読み込みます。
+        同時に読み込みが要求されたキーはまとめて一つのクエリで取得されます。"""
+        state, futures = self.lazy[table], []
+        for key in keys:
+            if key in state.loaded:
+                state.hits += 1
+                continue
+            if key not in state.pending:
+                state.misses += 1
+                if not state.pending:
+                    self.bot.loop.create_task(
+                        self._fetch(table, state), name=f"[{self.__cog_name__}] Fetch: {table}"
+                    )
+                state.pending[key] = self.bot.loop.create_future()
+            futures.append(state.pending[key])
+        for future in futures:
+            await future
+
+    async def _fetch(self, table: str, state: LazyState) -> None:
+        # 読み込み待ちのキーをまとめて取得する。
+        # 同じタイミングで要求された他のキーを待つために一度他の処理に譲る。
+        await sleep(0)
+        pending, state.pending = state.pending, {}
+        try:
+            async with self.bot.mysql.pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    for chunk in self._chunks(list(pending)):
+                        await cursor.execute(
+                            f"SELECT * FROM {table} WHERE {self.allocations[table]} IN "
+                            f"({', '.join(('%s',) * len(chunk))});", chunk
+                        )
+                        self._store(table, await cursor.fetchall())
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            now = monotonic()
+            for key, future in pending.items():
+                state.loaded[key] = now
+                state.loaded.move_to_end(key)
+                if not future.done():
+                    future.set_result(None)
+
+    def _evict(self, table: str, state: LazyState, now: float) -> None:
+        # 使われていないデータをキャッシュから消す。変更されていて同期されていないものは消さない。
+        if table in self._syncing:
+            return
+        for key, accessed in list(state.loaded.items()):
+            if len(state.loaded) <= state.size and now - accessed < state.ttl:
+                break
+            if key in self.dirty[table] or key in self.data[table]._removed:
+                continue
+            del state.loaded[key]
+            dict.pop(self.data[table], key, None)
+            self._digests[table].pop(key, None)
+
+    async def _prepare_primary_key(
+        self, cursor: Cursor, table: str, column: str
+    ) -> bool:
+        # 古いテーブルには主キーがないので付ける。付けられない場合は`False`を返す。
+        await cursor.execute(f"SHOW KEYS FROM {table} WHERE Key_name = 'PRIMARY';")
+        if await cursor.fetchone():
+            return True
+        try:
+            await cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({column});")
+        except Exception as e:
+            self.print("[warning]", f"{table} has no primary key, fallback to delete-insert:", e)
+            return False
+        return True
+
     def print(self, *args, **kwargs):
         return self.bot.print(f"[{self.__cog_name__}]", *args, **kwargs)
 
-    async def _remove(
-        self, cursor: Cursor, table: str, key: Key, print_: bool = False
-    ) -> None:
+    def mark(self, table: str, key: Key) -> None:
+        "指定されたキーのデータを変更されたものとして記録します。"
+        if key not in self.dirty[table]:
+            self.dirty[table][key] = monotonic()
+        if (data := self.data[table].get(key)) is not None:
+            data.changed = True
+
+    def _chunks(self, items: list) -> list[list]:
+        # `FLUSH_CHUNK`個ずつに分ける。
+        return [
+            items[i:i + self.FLUSH_CHUNK]
+            for i in range(0, len(items), self.FLUSH_CHUNK)
+        ]
+
+    async def _remove(self, cursor: Cursor, table: str, keys: list[Key]) -> None:
         # 削除を行う。
-        if print_:
-            self.print("[sync.remove]", f"{table}.{key}")
-        await cursor.execute(
-            f"DELETE FROM {table} WHERE {self.allocations[table]} = %s;",
-            (key,)
-        )
-
-    async def _update(
-        self, cursor: Cursor, table: str, key: Key,
-        data: ChangedDict, print_: bool = False
-    ) -> None:
-        # 更新を行う。
-        if print_:
-            self.print("[sync.update]", f"{table}.{key}: {data}")
-        await cursor.execute(
-            f"SELECT * FROM {table} WHERE {self.allocations[table]} = %s;",
-            (key,)
-        )
-        if await cursor.fetchone():
+        for chunk in self._chunks(keys):
             await cursor.execute(
-                f"UPDATE {table} SET Data = %s WHERE {self.allocations[table]} = %s;",
-                (dumps(data), key)
+                f"DELETE FROM {table} WHERE {self.allocations[table]} IN "
+                f"({', '.join(('%s',) * len(chunk))});", chunk
             )
-        else:
+
+    async def _upsert(
+        self, cursor: Cursor, table: str, rows: list[tuple[Key, str]]
+    ) -> None:
+        # 複数行をまとめて書き込む。
+        for chunk in self._chunks(rows):
+            if not self._upsertable.get(table, True):
+                await self._remove(cursor, table, [key for key, _ in chunk])
+            args = []
+            for row in chunk:
+                args.extend(row)
             await cursor.execute(
-                f"INSERT INTO {table} VALUES (%s, %s);", (key, dumps(data))
+                f"INSERT INTO {table} VALUES {', '.join(('(%s, %s)',) * len(chunk))}"
+                "{};".format(
+                    " ON DUPLICATE KEY UPDATE Data = VALUES(Data)"
+                    if self._upsertable.get(table, True) else ""
+                ), args
             )
 
+    def _collect(self, table: str, datas: DataDict[Key, ChangedDict]) -> tuple[
+        dict[Key, float], list[tuple[Key, str]], dict[Key, int]
+    ]:
+        # 書き込むべき行を集める。前回書き込んだ内容と同じものは除外する。
+        dirty, self.dirty[table] = self.dirty[table], {}
+        rows, digests = [], {}
+        for key in dirty:
+            if (data := datas.get(key)) is None:
+                continue
+            dumped = dumps(data)
+            digest = hash(dumped)
+            data.changed = False
+            if self._digests[table].get(key) != digest:
+                rows.append((key, dumped))
+                digests[key] = digest
+        return dirty, rows, digests
+
     async def _sync(self, table: str, datas: DataDict[Key, ChangedDict]) -> None:
-        # 指定されたテーブルのデータの同期を行います。
-        self.print("[sync]", table)
-        async with self.bot.mysql.pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                # 削除されたものを消す。
-                for removed_key in datas._removed:
-                    await self._remove(cursor, table, removed_key)
-                # 変更されたものをアップデートする。
-                for key, data in list(datas.items()):
-                    await self._update(cursor, table, key, data)
-                    data.changed = False
+        # 指定されたテーブルの変更されたデータを一つのトランザクションで書き込みます。
+        if table in self._syncing:
+            return
+        self._syncing.add(table)
+        removed, datas._removed = list(datas._removed), set()
+        dirty, rows, digests = self._collect(table, datas)
+        if not removed and not rows:
+            self._syncing.discard(table)
+            return
+
+        started = monotonic()
+        try:
+            async with self.bot.mysql.pool.acquire() as conn:
+                await conn.begin()
+                try:
+                    async with conn.cursor() as cursor:
+                        if removed:
+                            await self._remove(cursor, table, removed)
+                        if rows:
+                            await self._upsert(cursor, table, rows)
+                except Exception:
+                    await conn.rollback()
+                    raise
+                else:
+                    await conn.commit()
+        except Exception as e:
+            # 失敗した場合は次の同期で再度書き込むようにする。
+            self.stats[table].failed += 1
+            datas._removed.update(key for key in removed if key not in datas)
+            for key, marked in dirty.items():
+                self.dirty[table].setdefault(key, marked)
+            self.print("[sync.error]", table, e)
+        else:
+            for key in removed:
+                self._digests[table].pop(key, None)
+            self._digests[table].update(digests)
+            latency = monotonic() - started
+            stats = self.stats[table]
+            stats.count += 1
+            stats.rows += len(rows)
+            stats.removed += len(removed)
+            stats.last_latency = latency
+            stats.total_latency += latency
+            self.print(
+                "[sync]", table,
+                f"{len(rows)} rows, {len(removed)} removed in {latency * 1000:.1f}ms"
+            )
+        finally:
+            self._syncing.discard(table)
+
+    def _should_flush(self, table: str, now: float) -> bool:
+        # 書き込みの条件を満たしているかを調べる。
+        return bool(self.data[table]._removed) or (
+            dirty := self.dirty[table]
+        ) and (
+            len(dirty) >= self.FLUSH_SIZE
+            # 辞書は挿入順なので最初の値が最も古い。
+            or now - next(iter(dirty.values())) >= self.FLUSH_AGE
+        )
 
     def sync(self, table: Optional[str] = None):
         "同期を行います。注意：キャッシュのデータが優先されます。"
         if table is None:
-            if self.data[table]:
-                self.bot.loop.create_task(
-                    self._sync(table, self.data[table]), name=f"[{self.__cog_name__}] Sync: {table}"
-                )
-        else:
             if self.data:
                 self.print("Now syncing...")
                 for table, datas in list(self.data.items()):
                     self.bot.loop.create_task(
                         self._sync(table, datas), name=f"[{self.__cog_name__}] Sync: {table}"
                     )
+        elif table in self.data:
+            self.bot.loop.create_task(
+                self._sync(table, self.data[table]), name=f"[{self.__cog_name__}] Sync: {table}"
+            )
 
-    # @tasks.loop(seconds=10)
-    @tasks.loop(minutes=10)
+    @tasks.loop(seconds=10)
     async def _auto_sync(self):
-        self.sync()
+        now = monotonic()
+        for table in list(self.data.keys()):
+            if self._should_flush(table, now):
+                self.sync(table)
+        for table, state in list(self.lazy.items()):
+            self._evict(table, state, now)
 
     def cog_unload(self):
-        self._auto_save.cancel()
+        self._auto_sync.cancel()
 
     @commands.Cog.listener()
     async def on_close(self, _):
@@ -0,0 +1,116 @@
+# Free RT Util - Keyword Matcher
+
+from __future__ import annotations
+
+from typing import Callable, Hashable, Iterable, Optional
+
+from collections import deque
+from re import compile as re_compile, escape
+
+
+class KeywordMatcher:
+    """複数の言葉のどれが文字列に含まれているかを一度の走査で調べるためのクラスです。
+    Aho-Corasick法のオートマトンを使います。
+    何も含まれていない文字列は正規表現で先に弾くので、ほとんどの場合は走査がC言語の速さで終わります。
+
+    Parameters
+    ----------
+    words : Iterable[str]
+        探す言葉です。`find`はこの順番で見つかった言葉を返します。"""
+
+    def __init__(self, words: Iterable[str]):
+        self.words = list(dict.fromkeys(words))
+        # 状態毎の遷移、失敗時の遷移先、その状態で見つかる言葉の番号です。
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.output: list[tuple[int, ...]] = [()]
+        # 空文字はどの文字列にも含まれているとして扱う。
+        self.always = tuple(i for i, word in enumerate(self.words) if not word)
+        outputs: list[list[int]] = [[]]
+        for i, word in enumerate(self.words):
+            if not word:
+                continue
+            state = 0
+            for char in word:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    outputs.append([])
+                state = self.goto[state][char]
+            outputs[state].append(i)
+        # 幅優先で失敗時の遷移先を作る。
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_ in self.goto[state].items():
+                queue.append(next_)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_] = self.goto[fail].get(char, 0)
+                outputs[next_].extend(outputs[self.fail[next_]])
+        self.output = [tuple(output) for output in outputs]
+        # どれかの言葉があるかどうかと、その一番最初の位置を調べるための正規表現です。
+        self.pattern = re_compile("|".join(map(escape, filter(None, self.words)))) \
+            if len(self.goto) > 1 else None
+
+    def find(self, text: str, limit: Optional[int] = None) -> list[str]:
+        """文字列に含まれている言葉を登録された順番で返します。
+
+        Parameters
+        ----------
+        text : str
+            対象の文字列です。
+        limit : int, optional
+            何個まで返すかです。"""
+        found = set(self.always)
+        if self.pattern is None or (match := self.pattern.search(text)) is None:
+            return [self.words[i] for i in sorted(found)[:limit]]
+        goto, fail, output = self.goto, self.fail, self.output
+        root, state = goto[0], 0
+        # 一番最初に見つかった位置より前に言葉はないので、そこから走査する。
+        for char in text[match.start():]:
+            if not state and char not in root:
+                continue
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return [self.words[i] for i in sorted(found)[:limit]]
+
+    def search(self, text: str) -> Optional[str]:
+        "文字列に含まれている言葉で一番最初に登録されたものを返します。ない場合は`None`を返します。"
+        return found[0] if (found := self.find(text, 1)) else None
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+class MatcherCache:
+    """`KeywordMatcher`をサーバー毎などに保存しておくためのクラスです。
+    言葉が変わった際は`invalidate`を呼んでください。次に使われた時に作り直されます。"""
+
+    def __init__(self):
+        self.matchers: dict[Hashable, KeywordMatcher] = {}
+
+    def get(self, key: Hashable, words: Callable[[], Iterable[str]]) -> KeywordMatcher:
+        """`KeywordMatcher`を取得します。
+
+        Parameters
+        ----------
+        key : Hashable
+            サーバーIDなどです。
+        words : Callable[[], Iterable[str]]
+            キャッシュにない場合に呼ばれ、言葉を返す関数です。"""
+        if key not in self.matchers:
+            self.matchers[key] = KeywordMatcher(words())
+        return self.matchers[key]
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        "キャッシュを削除します。`key`を指定しない場合は全て削除します。"
+        if key is None:
+            self.matchers.clear()
+        else:
+            self.matchers.pop(key, None)
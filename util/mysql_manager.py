@@ -1,17 +1,72 @@
 # Free RT Util - MySQL Manager
 
-from typing import Any, Dict, Tuple
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from asyncio import get_event_loop, iscoroutinefunction
 from aiomysql import create_pool, connect
-from functools import wraps
+from contextlib import asynccontextmanager
+from functools import wraps, lru_cache
 import warnings
 import ujson
 
+from .pool import MeteredPool, PoolPolicy
+
 
 warnings.filterwarnings('ignore', module=r"aiomysql")
 
 
+@lru_cache(maxsize=1024)
+def _columns(keys: Tuple[str, ...], format_text: str) -> str:
+    # 列名の部分のSQLを作る。同じ列の組み合わせの場合はキャッシュしたものを使う。
+    return "".join(format_text.format(key) for key in keys)
+
+
+@lru_cache(maxsize=1024)
+def _build(
+    kind: str, table: str, keys: Tuple[str, ...] = (),
+    targets: Tuple[str, ...] = (), count: int = 0
+) -> str:
+    # SQL文を作る。同じテーブルと列の組み合わせの場合はキャッシュしたものを使う。
+    columns, values = ", ".join(keys), ", ".join(["%s"] * len(keys))
+    where = " AND ".join(f"{key} = %s" for key in targets)
+    if kind == "insert":
+        return f"INSERT INTO {table} ({columns}) VALUES ({values})"
+    elif kind == "insert_unique":
+        return (
+            f"INSERT INTO {table} ({columns}) SELECT {values} FROM DUAL "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {where})"
+        )
+    elif kind == "upsert":
+        updates = ", ".join(
+            f"{key} = VALUES({key})" for key in keys if key not in targets
+        ) or f"{keys[0]} = {keys[0]}"
+        return f"INSERT INTO {table} ({columns}) VALUES ({values}) ON DUPLICATE KEY UPDATE {updates}"
+    elif kind == "update":
+        return f"UPDATE {table} SET {', '.join(f'{key} = %s' for key in keys)} WHERE {where}"
+    elif kind == "delete":
+        return f"DELETE FROM {table} WHERE {where}"
+    elif kind == "select_in":
+        return (
+            f"SELECT * FROM {table} WHERE {keys[0]} IN ({', '.join(['%s'] * count)})"
+            + (f" AND {where}" if where else "")
+        )
+    raise ValueError(f"Unknown kind: {kind}")
+
+
+def _dump(values: Iterable[Any]) -> list:
+    # 辞書をjsonにする。
+    return [ujson.dumps(value) if isinstance(value, dict) else value for value in values]
+
+
+def _load(row: Sequence[Any]) -> list:
+    # jsonの文字列を辞書にする。
+    return [
+        ((ujson.loads(value) if (value and value[0] == "{" and value[-1] == "}") else value)
+         if isinstance(value, str) else value)
+        for value in row if value is not None
+    ]
+
+
 class Cursor:
     """データベースの操作を簡単に行うためのクラスです。  
     `Cursor.get_data`などの便利なものが使えます。  
@@ -26,7 +81,9 @@ class Cursor:
     ですがこれは`async with`文で代用することができます。  
     もしデータベースを操作した場合は`MySQLManager.commit`を通常は実行する必要がありますが、`Cursor`のデータベースを変更するものは全て自動で`MySQLManager.commit`を実行します。  
     これは引数の`commit`をFalseにすることで自動で実行しなくなります。  
-    もし連続でデータベースの操作をする場合はこの引数`commit`をFalseにして操作終了後に自分で`MySQLManager.commit`を実行する方が効率的でしょう。
+    もし連続でデータベースの操作をする場合はこの引数`commit`をFalseにして操作終了後に自分で`MySQLManager.commit`を実行する方が効率的でしょう。  
+    また`Cursor.transaction`を使えば、その中での操作はまとめて一度だけcommitされます。  
+    接続がautocommitの場合は自動での`MySQLManager.commit`は行われません。
 
     Example
     -------
@@ -39,6 +96,8 @@ class Cursor:
     ----------
     db : MySQLManager
         データベースマネージャーです。
+    connection : optional
+        使う接続です。指定しない場合は`db.connection`が使われます。
 
     Attributes
     ----------
@@ -49,9 +108,10 @@ class Cursor:
     cursor
         データベースの操作などに使うカーソルです。  
         `Cursor.prepare_cursor`を実行するまではこれは有効になりません。"""
-    def __init__(self, db):
+    def __init__(self, db, connection=None):
         self.cursor = None
-        self.loop, self.connection = db.loop, db.connection
+        self.loop, self.connection = db.loop, connection or db.connection
+        self._transaction = False
 
     async def prepare_cursor(self):
         """Cursorを使えるようにします。  
@@ -71,7 +131,7 @@ class Cursor:
             self.cursor = None
 
     def __del__(self):
-        if not self.loop.is_closed():
+        if self.cursor is not None and not self.loop.is_closed():
             self.loop.create_task(self.close())
 
     async def __aenter__(self):
@@ -81,6 +141,35 @@ class Cursor:
     async def __aexit__(self, ex_type, ex_value, trace):
         await self.close()
 
+    async def _commit(self, commit: bool) -> None:
+        # 必要な場合のみcommitをする。
+        if commit and not self._transaction and not self.connection.get_autocommit():
+            await self.connection.commit()
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator["Cursor"]:
+        """トランザクションを開始します。  
+        `async with`文で使い、抜ける際にcommitされます。例外が発生した場合はrollbackされます。  
+        この中での操作は引数の`commit`に関係なく自動でcommitされません。
+
+        Examples
+        --------
+        async with db.get_cursor() as cursor:
+            async with cursor.transaction():
+                await cursor.delete("tasuren_friends", {"name": "Takkun"})
+                await cursor.insert_many("tasuren_friends", rows)"""
+        await self.connection.begin()
+        self._transaction = True
+        try:
+            yield self
+        except BaseException:
+            await self.connection.rollback()
+            raise
+        else:
+            await self.connection.commit()
+        finally:
+            self._transaction = False
+
     async def create_table(self, table: str, columns: Dict[str, str],
                            if_not_exists: bool = True, commit: bool = True) -> None:
         """テーブルを作成します。
@@ -99,8 +188,7 @@ class Cursor:
         if_not_exists = "IF NOT EXISTS " if if_not_exists else ""
         values = ", ".join(f"{key} {columns[key]}" for key in columns)
         await self.cursor.execute(f"CREATE TABLE {if_not_exists}{table} ({values});")
-        if commit:
-            await self.connection.commit()
+        await self._commit(commit)
         del if_not_exists, values
 
     async def drop_table(self, table: str, commit: bool = True) -> None:
@@ -115,22 +203,16 @@ class Cursor:
         commit : bool, default True
             テーブル削除後に自動で`MySQLManager.commit`を実行するかどうかです。"""
         await self.cursor.execute(f"DROP TABLE {table};")
-        if commit:
-            await self.connection.commit()
+        await self._commit(commit)
 
     def _get_column_args(
             self, values: Dict[str, Any], format_text: str = "{} = %s AND ",
             json_dump: bool = False
     ) -> Tuple[str, list]:
-        conditions, args = "", []
-        for key in values:
-            conditions += format_text.format(key)
-            args.append(
-                ujson.dumps(values[key])
-                if json_dump and isinstance(values[key], dict)
-                else values[key]
-            )
-        return conditions, args
+        return (
+            _columns(tuple(values), format_text),
+            _dump(values.values()) if json_dump else list(values.values())
+        )
 
     async def insert_data(
         self, table: str, values: Dict[str, Any],
@@ -154,23 +236,103 @@ class Cursor:
         async with db.get_cursor() as cursor:
             values = {"name": "Takkun", "data": {"detail": "愉快"}}
             await cursor.post_data("tasuren_friends", values)"""
-        conditions, args = self._get_column_args(
-            values, "{}, ", json_dump=True
+        await self.cursor.execute(
+            _build("insert", table, tuple(values)), _dump(values.values())
         )
-        query = ("%s, " * len(args))[:-2]
+        await self._commit(commit)
+
+    async def insert_many(
+        self, table: str, rows: List[Dict[str, Any]], commit: bool = True
+    ) -> None:
+        """特定のテーブルに複数のデータを一度に追加します。  
+        全ての行は同じ列名を持っている必要があります。
+
+        Parameters
+        ----------
+        table : str
+            対象のテーブルです。
+        rows : List[Dict[str, Any]]
+            列名とそれに対応する追加する値の辞書のリストです。
+        commit : bool, default True
+            追加後に自動で`MySQLManager.commit`を実行するかどうかです。"""
+        if rows:
+            await self.cursor.executemany(
+                _build("insert", table, tuple(rows[0])),
+                [_dump(row.values()) for row in rows]
+            )
+            await self._commit(commit)
+
+    async def insert_unique(
+        self, table: str, values: Dict[str, Any],
+        targets: Dict[str, Any], commit: bool = True
+    ) -> bool:
+        """`targets`に当てはまるデータが存在しない場合のみデータを追加します。  
+        `exists`と`insert_data`を別々に実行するのとは違い、一度の通信で済みます。
+
+        Returns
+        -------
+        inserted : bool
+            追加したかどうかです。"""
         await self.cursor.execute(
-            f"INSERT INTO {table} ({conditions[:-2]}) VALUES ({query})",
-            args
+            _build("insert_unique", table, tuple(values), tuple(targets)),
+            _dump(values.values()) + _dump(targets.values())
         )
-        if commit:
-            await self.connection.commit()
+        await self._commit(commit)
+        return self.cursor.rowcount > 0
+
+    async def upsert_data(
+        self, table: str, values: Dict[str, Any],
+        targets: Dict[str, Any], commit: bool = True
+    ) -> None:
+        """`targets`に当てはまるデータがある場合は更新し、ない場合は追加します。  
+        主キーがないテーブルでも使えます。  
+        データが変わる更新の場合は一度の通信で済みます。
+
+        Parameters
+        ----------
+        table : str
+            対象のテーブルです。
+        values : Dict[str, Any]
+            更新する内容です。
+        targets : Dict[str, Any]
+            更新するデータの条件です。追加する場合はこれも追加されます。
+        commit : bool, default True
+            終わった後に自動で`MySQLManager.commit`を実行するかどうかです。"""
+        if not await self.update_data(table, values, targets, False):
+            await self.insert_unique(table, {**targets, **values}, targets, False)
+        await self._commit(commit)
+
+    async def upsert_many(
+        self, table: str, rows: List[Dict[str, Any]],
+        keys: Sequence[str] = (), commit: bool = True
+    ) -> None:
+        """複数のデータを一度に追加または更新します。  
+        `INSERT ... ON DUPLICATE KEY UPDATE`を使うので、テーブルに主キーかユニークキーが必要です。
+
+        Parameters
+        ----------
+        table : str
+            対象のテーブルです。
+        rows : List[Dict[str, Any]]
+            列名とそれに対応する値の辞書のリストです。全ての行は同じ列名を持っている必要があります。
+        keys : Sequence[str], optional
+            主キーまたはユニークキーの列名です。これらの列は更新されません。
+        commit : bool, default True
+            終わった後に自動で`MySQLManager.commit`を実行するかどうかです。"""
+        if rows:
+            await self.cursor.executemany(
+                _build("upsert", table, tuple(rows[0]), tuple(keys)),
+                [_dump(row.values()) for row in rows]
+            )
+            await self._commit(commit)
 
     async def update_data(
         self, table: str, values: Dict[str, Any],
         targets: Dict[str, Any], commit: bool = True,
         json: bool = False
-    ) -> None:
-        """特定のテーブルの特定のデータを更新します。
+    ) -> int:
+        """特定のテーブルの特定のデータを更新します。  
+        変更された行の数を返します。
 
         Parameters
         ----------
@@ -182,18 +344,12 @@ class Cursor:
             更新するデータの条件です。
         commit : bool, default True
             更新後に自動で`MySQLManager.commit`を実行するかどうかです。"""
-        values, values_args = self._get_column_args(
-            values, "{} = %s, ", True
-        )
-        conditions, conditions_args = self._get_column_args(
-            targets, json_dump=True
-        )
         await self.cursor.execute(
-            f"UPDATE {table} SET {values[:-2]} WHERE {conditions[:-4]}",
-            values_args + conditions_args
+            _build("update", table, tuple(values), tuple(targets)),
+            _dump(values.values()) + _dump(targets.values())
         )
-        if commit:
-            await self.connection.commit()
+        await self._commit(commit)
+        return self.cursor.rowcount
 
     async def exists(self, table: str, targets: Dict[str, Any], json: bool = False) -> bool:
         """特定のテーブルに特定のデータが存在しているかどうかを確認します。
@@ -214,8 +370,9 @@ class Cursor:
     async def delete(
         self, table: str, targets: Dict[str, Any], commit: bool = True,
         json: bool = False
-    ) -> None:
-        """特定のテーブルにある特定のデータを削除します。
+    ) -> int:
+        """特定のテーブルにある特定のデータを削除します。  
+        削除された行の数を返します。
 
         Parameters
         ----------
@@ -225,13 +382,11 @@ class Cursor:
             削除するデータの条件です。
         commit : bool, default True
             削除後に自動で`MySQLManager.commit`を実行するかどうかです。"""
-        conditions, args = self._get_column_args(targets, json_dump=True)
         await self.cursor.execute(
-            f"DELETE FROM {table} WHERE {conditions[:-4]}",
-            args
+            _build("delete", table, targets=tuple(targets)), _dump(targets.values())
         )
-        if commit:
-            await self.connection.commit()
+        await self._commit(commit)
+        return self.cursor.rowcount
 
     async def get_datas(
         self, table: str, targets: Dict[str, Any],
@@ -280,12 +435,7 @@ class Cursor:
                 if rows is None:
                     yield []
                 else:
-                    rows = [
-                        ((ujson.loads(row) if (row and row[0] == "{" and row[-1] == "}")else row)
-                         if isinstance(row, str) else row)
-                        for row in rows if row is not None
-                    ]
-                    yield rows
+                    yield _load(rows)
                     if not _fetchall:
                         break
         else:
@@ -307,6 +457,38 @@ class Cursor:
                 # -> {"detail": "愉快"} (辞書データ)"""
         return [row async for row in self.get_datas(table, targets, _fetchall=False, json=json)][0]
 
+    async def get_many(
+        self, table: str, column: str, keys: Iterable[Any],
+        targets: Dict[str, Any] = {}, chunk: int = 500
+    ) -> List[list]:
+        """特定の列の値が`keys`のどれかであるデータをまとめて取得します。  
+        `get_data`を何回も実行するのとは違い、`chunk`個毎に一度の通信で済みます。
+
+        Parameters
+        ----------
+        table : str
+            対象のテーブルです。
+        column : str
+            `keys`と比べる列の名前です。
+        keys : Iterable[Any]
+            取得するデータの`column`の値です。
+        targets : Dict[str, Any], optional
+            追加の条件です。
+
+        Returns
+        -------
+        rows : List[list]
+            取得したデータのリストです。jsonは辞書になります。"""
+        keys, rows = list(keys), []
+        for i in range(0, len(keys), chunk):
+            part = keys[i:i + chunk]
+            await self.cursor.execute(
+                _build("select_in", table, (column,), tuple(targets), len(part)),
+                _dump(part) + _dump(targets.values())
+            )
+            rows.extend(_load(row) for row in await self.cursor.fetchall() if row)
+        return rows
+
 
 class MySQLManager:
     """MySQLを簡単に使うためのモジュールです。  
@@ -328,6 +510,8 @@ class MySQLManager:
     ----------
     pool : bool, default False
         プールを使用します。
+    policy : PoolPolicy, optional
+        プールの設定です。指定した場合はプールが`MeteredPool`で包まれ、同時に使う接続の数が制限されて計測されます。
     **kwargs : dict
         `aiomysql.connect`または`aiomysql.create_pool`に渡すキーワード引数です。
 
@@ -356,19 +540,45 @@ class MySQLManager:
     async with db.get_cursor() as cursor:
         ..."""
 
-    def __init__(self, pool: bool = False, _pool_c=False, **kwargs):
+    def __init__(
+        self, pool: bool = False, _pool_c=False,
+        policy: Optional[PoolPolicy] = None, **kwargs
+    ):
         self.connection, self.pool = None, None
         self._real_pool = None
         self.loop = kwargs.get("loop", get_event_loop())
-        self.loop.create_task(self._setup(pool, _pool_c, kwargs))
+        self.loop.create_task(self._setup(pool, _pool_c, policy, kwargs))
 
-    async def _setup(self, pool, _pool_c, kwargs) -> None:
+    async def _setup(self, pool, _pool_c, policy, kwargs) -> None:
         # データベースの準備をする。
         if pool and not _pool_c:
             self.pool = await create_pool(**kwargs)
+            if policy is not None:
+                self.pool = MeteredPool(self.pool, policy)
         elif not _pool_c:
             self.connection = await connect(**kwargs)
 
+    @asynccontextmanager
+    async def acquire(self, caller: Optional[str] = None) -> AsyncIterator[Cursor]:
+        """`Cursor`を取得します。  
+        プールモードの場合はプールから接続を取得して、抜ける際にその接続をプールに返します。  
+        `caller`はプールが`MeteredPool`の場合の記録に使われる名前です。
+
+        Examples
+        --------
+        async with db.acquire() as cursor:
+            row = await cursor.get_data("test", {"column1": "tasuren"})"""
+        if self.pool is None:
+            async with Cursor(self) as cursor:
+                yield cursor
+        else:
+            async with (
+                self.pool.acquire(caller) if isinstance(self.pool, MeteredPool)
+                else self.pool.acquire()
+            ) as connection:
+                async with Cursor(self, connection) as cursor:
+                    yield cursor
+
     async def get_database(self):
         """このクラスの定義済みのものをプールを使って取得します。  
         これはこのクラスの定義時`pool=True`と言う引数を作っている場合のみ使用できます。  
@@ -416,24 +626,10 @@ class DatabaseManager:
                         if iscoroutinefunction(coro):
                             setattr(cls, name, cls.prepare_cursor(coro))
 
-    async def _close(self, conn, cursor):
-        await cursor.close()
-        conn.close()
-        del cursor
-
     @staticmethod
     def prepare_cursor(coro):
         @wraps(coro)
         async def new_coro(self, *args, **kwargs):
-            conn = await self.db.get_database()
-            cursor = conn.get_cursor()
-            await cursor.prepare_cursor()
-            try:
-                data = await coro(self, cursor, *args, **kwargs)
-            except Exception as e:
-                await self._close(conn, cursor)
-                raise e
-            else:
-                await self._close(conn, cursor)
-                return data
+            async with self.db.acquire(coro.__qualname__) as cursor:
+                return await coro(self, cursor, *args, **kwargs)
         return new_coro
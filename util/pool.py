@@ -0,0 +1,175 @@
+# Free RT Util - Pool
+
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from asyncio import Semaphore, TimeoutError, wait_for
+from dataclasses import dataclass, fields
+from collections import defaultdict, deque
+from time import perf_counter
+import sys
+
+
+class PoolExhausted(Exception):
+    "接続の取得を待っているものが多すぎる場合か、取得が時間内に終わらなかった場合に発生します。"
+
+
+@dataclass
+class PoolPolicy:
+    """プールの設定です。`auth.json`の`pool`から読み込まれます。
+
+    Parameters
+    ----------
+    minsize : int
+        プールが常に持っておく接続の数です。
+    maxsize : int
+        同時に使える接続の最大数です。
+    acquire_timeout : float
+        接続の取得を待つ最大の秒数です。
+    max_waiters : int
+        接続の取得を待てるものの最大数です。これを超えた場合はすぐに`PoolExhausted`が発生します。"""
+
+    minsize: int = 1
+    maxsize: int = 10
+    acquire_timeout: float = 10.0
+    max_waiters: int = 500
+
+    @classmethod
+    def from_config(cls, config: dict, test: bool = False) -> PoolPolicy:
+        """`auth.json`の`pool`の辞書から作ります。書かれていないものはデフォルトになります。
+        `説明`のような設定ではないキーは無視します。値の型が違う場合は`ValueError`が発生します。"""
+        kwargs: dict[str, Any] = {"maxsize": 10 if test else 50}
+        for field in fields(cls):
+            if field.name in config:
+                type_ = int if field.type == "int" else float
+                if isinstance(config[field.name], bool) \
+                        or not isinstance(config[field.name], (int, float)) \
+                        or type_(config[field.name]) != config[field.name]:
+                    raise ValueError(
+                        f"auth.jsonのpoolの{field.name}は{type_.__name__}にしてください：{config[field.name]!r}"
+                    )
+                kwargs[field.name] = type_(config[field.name])
+        return cls(**kwargs)
+
+
+@dataclass
+class CallerStats:
+    "接続を取得したところ毎の記録です。"
+
+    acquired: int = 0
+    wait: float = 0.0
+    held: float = 0.0
+    failed: int = 0
+
+
+class _Acquire:
+    # `async with pool.acquire()`と`await pool.acquire()`の両方で使えるようにするためのクラスです。
+    def __init__(self, pool: MeteredPool, caller: str):
+        self.pool, self.caller, self.connection = pool, caller, None
+
+    def __await__(self):
+        return self.pool._acquire(self.caller).__await__()
+
+    async def __aenter__(self):
+        self.connection = await self.pool._acquire(self.caller)
+        return self.connection
+
+    async def __aexit__(self, *_):
+        await self.pool.release(self.connection)
+
+
+class MeteredPool:
+    """aiomysqlのプールを包んで、同時に使う接続の数を制限して計測をするためのクラスです。
+    `acquire`と`release`以外はaiomysqlのプールと同じように使えます。
+
+    Parameters
+    ----------
+    pool : aiomysql.Pool
+        包むプールです。
+    policy : PoolPolicy
+        プールの設定です。"""
+
+    def __init__(self, pool, policy: PoolPolicy):
+        self.pool, self.policy = pool, policy
+        self.semaphore = Semaphore(policy.maxsize)
+        self.waiting = self.in_use = 0
+        self.latencies: deque[float] = deque(maxlen=1024)
+        self.callers: defaultdict[str, CallerStats] = defaultdict(CallerStats)
+        self._held: dict[int, tuple[str, float]] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.pool, name)
+
+    def acquire(self, caller: Optional[str] = None) -> _Acquire:
+        """接続を取得します。
+
+        Parameters
+        ----------
+        caller : str, optional
+            記録に使う取得したところの名前です。指定しない場合は呼び出し元の関数の名前になります。"""
+        if caller is None:
+            frame = sys._getframe(1)
+            caller = f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}"
+        return _Acquire(self, caller)
+
+    async def _acquire(self, caller: str):
+        start = perf_counter()
+        if self.semaphore.locked():
+            # 空きがない場合は待つ。待っているものが多すぎる場合はすぐに諦める。
+            if self.waiting >= self.policy.max_waiters:
+                self.callers[caller].failed += 1
+                raise PoolExhausted(f"Too many waiters: {self.waiting}")
+            self.waiting += 1
+            try:
+                await wait_for(self.semaphore.acquire(), self.policy.acquire_timeout)
+            except TimeoutError:
+                self.callers[caller].failed += 1
+                raise PoolExhausted(f"Acquire timed out: {caller}")
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+        try:
+            connection = await self.pool.acquire()
+        except BaseException:
+            self.semaphore.release()
+            self.callers[caller].failed += 1
+            raise
+        now = perf_counter()
+        self.in_use += 1
+        self.latencies.append(now - start)
+        stats = self.callers[caller]
+        stats.acquired += 1
+        stats.wait += now - start
+        self._held[id(connection)] = (caller, now)
+        return connection
+
+    def release(self, connection):
+        "接続をプールに返します。"
+        if (held := self._held.pop(id(connection), None)) is not None:
+            self.callers[held[0]].held += perf_counter() - held[1]
+            self.in_use -= 1
+            self.semaphore.release()
+        return self.pool.release(connection)
+
+    def percentile(self, value: float) -> float:
+        "最近の接続の取得にかかった時間の百分位数を秒で返します。"
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * value))]
+
+    def metrics(self) -> dict[str, Any]:
+        "現在のプールの状態を返します。"
+        return {
+            "size": self.pool.size, "in_use": self.in_use, "idle": self.pool.freesize,
+            "waiting": self.waiting, "maxsize": self.policy.maxsize,
+            "p50": self.percentile(0.5), "p99": self.percentile(0.99)
+        }
+
+    def top_callers(self, count: Optional[int] = 10) -> list[tuple[str, CallerStats]]:
+        "接続を使っていた時間が長い順に取得したところを返します。"
+        return sorted(
+            self.callers.items(), key=lambda item: item[1].held, reverse=True
+        )[:count]
@@ -1,13 +1,13 @@
 import struct
 import time
 from collections import defaultdict
+from heapq import heappush, heappop
 from discord.opus import Decoder as DiscordDecoder
 from discord.opus import exported_functions, OpusError, c_float_ptr
 import sys
 import ctypes
 import os
 import wave
-import array
 
 c_int_ptr = ctypes.POINTER(ctypes.c_int)
 c_int16_ptr = ctypes.POINTER(ctypes.c_int16)
@@ -64,7 +64,8 @@ def is_loaded():
     return _lib is not None
 
 
-MAX_SRC = 65535
+SILENCE = bytes(DiscordDecoder.SAMPLE_SIZE * DiscordDecoder.SAMPLING_RATE)
+"一秒分の無音のPCMです。"
 
 
 class RTCPacket:
@@ -107,124 +108,134 @@ class RTCPacket:
         self.decrypted = self.decrypted[offset + 1:]
 
 
+SEQUENCE_MODULO = 1 << 16
+TIMESTAMP_MODULO = 1 << 32
+
+
+def unwrap(value: int, reference: int, modulo: int) -> int:
+    """一周して戻ったシーケンス番号などを、`reference`に一番近い下位のビットが同じ値にします。
+    これで一周しても大小の比較ができるようになります。"""
+    diff = (value - reference) % modulo
+    if diff >= modulo // 2:
+        diff -= modulo
+    return reference + diff
+
+
 class PacketQueue:
+    """ssrc毎にパケットをシーケンス番号の順番に並べ替えるためのキューです。
+    シーケンス番号は一周しても順番が変わらないように`unwrap`したものをヒープで管理します。"""
+
     def __init__(self):
-        self.queues = defaultdict(list)
+        self.heaps: defaultdict[int, list[int]] = defaultdict(list)
+        self.queues: defaultdict[int, dict[int, RTCPacket]] = defaultdict(dict)
+        # 最後に受け取ったパケットと、次に取り出すパケットのシーケンス番号です。
+        self.last: dict[int, int] = {}
+        self.next: dict[int, int] = {}
 
     def push(self, packet):
-        self.queues[packet.ssrc].append(packet)
+        ssrc = packet.ssrc
+        seq = unwrap(packet.seq, self.last[ssrc], SEQUENCE_MODULO) \
+            if ssrc in self.last else packet.seq
+        self.last[ssrc] = max(seq, self.last.get(ssrc, seq))
+        # 取り出し済みの番号より前のものか重複しているものは捨てる。
+        if seq < self.next.get(ssrc, seq) or seq in self.queues[ssrc]:
+            return
+        self.queues[ssrc][seq] = packet
+        heappush(self.heaps[ssrc], seq)
 
     def get_all_ssrc(self):
         return self.queues.keys()
 
-    async def get_packets(self, ssrc: int):
-        last_seq = None
-        packets = self.queues[ssrc]
-        while len(packets) != 0:
-            if last_seq is None:
-                packet = packets.pop(0)
-                last_seq = packet.seq
-                yield packet
-                continue
-
-            if last_seq == MAX_SRC:
-                last_seq = -1
-
-            if packets[0].seq - 1 == last_seq:
-                packet = packets.pop(0)
-                last_seq = packet.seq
-                yield packet
-                continue
-
-            # 順番がおかしかったときの場合
-            for i in range(1, min(1000, len(packets))):
-                if packets[i].seq - 1 == last_seq:
-                    packet = packets.pop(0)
-                    last_seq = packet.seq
-                    yield packet
-                    break
-            else:
-                # 該当するパケットがなかった場合、破損していたとみなす
-                yield None
+    def count(self, ssrc: int) -> int:
+        "キューにあるパケットの数を返します。"
+        return len(self.queues[ssrc])
+
+    def pop(self, ssrc: int):
+        """一番古いパケットを取り出します。
+        それより前に届いていないパケットがある場合は、破損していたとみなして先に一度だけ`None`を返します。"""
+        seq = self.heaps[ssrc][0]
+        if ssrc in self.next and seq > self.next[ssrc]:
+            self.next[ssrc] = seq
+            return None
+        heappop(self.heaps[ssrc])
+        self.next[ssrc] = seq + 1
+        return self.queues[ssrc].pop(seq)
 
+    async def get_packets(self, ssrc: int):
+        while self.heaps[ssrc]:
+            yield self.pop(ssrc)
         # 終了
         yield -1
 
 
 class BufferDecoder:
+    """受け取ったパケットを並べ替えながらデコードしてWAVファイルに書き込むためのクラスです。
+    `REORDER_WINDOW`個を超えたパケットはすぐにデコードしてファイルに書き込むので、録音が長くてもメモリの使用量は変わりません。"""
+
+    REORDER_WINDOW = 50
+    "並べ替えのために保持しておくパケットの数です。約一秒分です。"
+    MAX_SILENCE = 60
+    "パケットの間の無音を何秒まで書き込むかです。"
+
     def __init__(self, client):
         self.queue = PacketQueue()
-        self.timestamp: int = 0
-        self.user_timestamps = {}
         self.client = client
+        # ssrc毎のデコーダー、書き込み先、次のパケットのタイムスタンプです。
+        self.decoders: dict[int, Decoder] = {}
+        self.writers: dict[int, tuple[str, wave.Wave_write]] = {}
+        self.user_timestamps: dict[int, int] = {}
 
     def recv_packet(self, packet):
         self.queue.push(packet)
-
-    async def _decode(self, ssrc):
-        decoder = Decoder()
-        pcm = []
-        start_time = None
-
-        last_timestamp = None
-        async for packet in self.queue.get_packets(ssrc):
-            if packet == -1:
-                # 終了
-                break
-            if start_time is None:
-                start_time = packet.real_time
-            else:
-                start_time = min(packet.real_time, start_time)
-
-            if len(packet.decrypted) < 10:
-                # パケットがdiscordから送られてくる無音のデータだった場合: https://discord.com/developers/docs/topics/voice-connections#voice-data-interpolation
-                last_timestamp = packet.timestamp
-                continue
-
-            if last_timestamp is not None:
-                elapsed = (packet.timestamp - last_timestamp) / Decoder.SAMPLING_RATE
-                if elapsed > 0.02:
-                    # 無音期間
-                    margin = [0] * 2 * int(Decoder.SAMPLE_SIZE * (elapsed - 0.02) * Decoder.SAMPLING_RATE)
-                    pcm += margin
-
-            data = await decoder.decode_float(packet.decrypted)
-            pcm += data
-            last_timestamp = packet.timestamp
-
-        del decoder
-
-        return dict(data=pcm, start_time=start_time)
+        while self.queue.count(packet.ssrc) > self.REORDER_WINDOW:
+            self._write(packet.ssrc, self.queue.pop(packet.ssrc))
+
+    def _open(self, ssrc: int) -> wave.Wave_write:
+        # 書き込み先のWAVファイルを開く。
+        if ssrc not in self.writers:
+            file = str(ssrc) + "-" + str(time.time()) + ".wav"
+            wav = wave.open(file, "wb")
+            wav.setnchannels(Decoder.CHANNELS)
+            wav.setsampwidth(Decoder.SAMPLE_SIZE // Decoder.CHANNELS)
+            wav.setframerate(Decoder.SAMPLING_RATE)
+            self.writers[ssrc] = (file, wav)
+        return self.writers[ssrc][1]
+
+    def _write(self, ssrc: int, packet):
+        # パケットをデコードしてファイルに書き込む。
+        if packet is None:
+            # パケット破損の場合
+            return
+        if ssrc not in self.decoders:
+            self.decoders[ssrc] = Decoder()
+        try:
+            decoded_data = self.decoders[ssrc].decode(packet.decrypted)
+        except Exception:
+            return
+        wav = self._open(ssrc)
+        if ssrc in self.user_timestamps:
+            # 前のパケットとの間の無音を書き込む。
+            silence = (packet.timestamp - self.user_timestamps[ssrc]) % TIMESTAMP_MODULO
+            if silence < TIMESTAMP_MODULO // 2:
+                silence = min(silence, Decoder.SAMPLING_RATE * self.MAX_SILENCE) * Decoder.SAMPLE_SIZE
+                while silence > 0:
+                    wav.writeframes(SILENCE[:silence])
+                    silence -= len(SILENCE)
+        wav.writeframes(decoded_data)
+        self.user_timestamps[ssrc] = (
+            packet.timestamp + len(decoded_data) // Decoder.SAMPLE_SIZE
+        ) % TIMESTAMP_MODULO
 
     async def decode(self, ssrc):
-        file = str(ssrc) + "-" + str(time.time()) + ".wav"
-        wav = wave.open(file, "wb")
-        wav.setnchannels(Decoder.CHANNELS)
-        wav.setsampwidth(Decoder.SAMPLE_SIZE // Decoder.CHANNELS)
-        wav.setframerate(Decoder.SAMPLING_RATE)
-        decoder = Decoder()
-        for packet in self.queue.queues[ssrc]:
-            try:
-                if packet is None:
-                    # パケット破損の場合
-                    continue
-                else:
-                    decoded_data = decoder.decode(packet.decrypted)
-                if packet.ssrc not in self.user_timestamps:
-                    self.user_timestamps.update({packet.ssrc: packet.timestamp})
-                    # Add silence when they were not being recorded.
-                    silence = 0
-                else:
-                    silence = packet.timestamp - self.user_timestamps[packet.ssrc] - 960
-                    self.user_timestamps[packet.ssrc] = packet.timestamp
-                decoded_data = struct.pack("<h", 0) * silence * decoder.CHANNELS + decoded_data
-                wav.writeframes(decoded_data)
-                del decoded_data
-            except Exception:
-                pass
+        "キューに残っているパケットを全て書き込んで、WAVファイルを閉じてそのファイル名を返します。"
+        while self.queue.count(ssrc):
+            self._write(ssrc, self.queue.pop(ssrc))
+        self._open(ssrc)
+        file, wav = self.writers.pop(ssrc)
         wav.close()
-        # file.seek(0)
-        self.queue.queues[ssrc] = list()
+        # 次のファイルは最初のパケットから始める。
+        self.decoders.pop(ssrc, None)
+        self.user_timestamps.pop(ssrc, None)
         return file
 
 
@@ -252,7 +263,7 @@ class Decoder(DiscordDecoder):
         pcm_ptr = ctypes.cast(pcm, c_float_ptr)
         ret = _lib.opus_decode_float(self._state, data, len(data) if data else 0, pcm_ptr, frame_size, fec)
 
-        return array.array('f', pcm[:ret * channel_count]).tobytes()
+        return ctypes.string_at(pcm, ret * channel_count * ctypes.sizeof(ctypes.c_float))
 
     def decode(self, data, *, fec=False):
         if data is None and fec:
@@ -267,9 +278,9 @@ class Decoder(DiscordDecoder):
             samples_per_frame = self.packet_get_samples_per_frame(data)
             frame_size = frames * samples_per_frame
 
-        pcm = (ctypes.c_int16 * (frame_size * channel_count * ctypes.sizeof(ctypes.c_int16)))()
+        pcm = (ctypes.c_int16 * (frame_size * channel_count))()
         pcm_ptr = ctypes.cast(pcm, c_int16_ptr)
 
         ret = _lib.opus_decode(self._state, data, len(data) if data else 0, pcm_ptr, frame_size, fec)
 
-        return array.array("h", pcm[: ret * channel_count]).tobytes()
+        return ctypes.string_at(pcm, ret * channel_count * ctypes.sizeof(ctypes.c_int16))
@@ -0,0 +1,249 @@
+# Free RT Util - Message Router
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable, Optional, Any
+
+from dataclasses import dataclass, field
+from time import perf_counter
+
+from discord.ext import commands, tasks
+import discord
+
+if TYPE_CHECKING:
+    from .bot import RT
+
+
+GuildCheck = Callable[[Any, int], bool]
+ChannelCheck = Callable[[Any, discord.abc.Messageable], bool]
+
+
+def route(
+    *, bots: bool = True, own: bool = True, dm: bool = True, prefixed: bool = True,
+    guild: Optional[GuildCheck] = None, channel: Optional[ChannelCheck] = None
+):
+    """コグのメソッドを`MessageRouter`から呼ばれる`on_message`にするためのデコレータです。
+    `commands.Cog.listener()`の代わりに使います。
+
+    Parameters
+    ----------
+    bots : bool, default True
+        Botのメッセージも受け取るかどうかです。
+    own : bool, default True
+        RT自身のメッセージも受け取るかどうかです。
+    dm : bool, default True
+        DMのメッセージも受け取るかどうかです。
+    prefixed : bool, default True
+        プレフィックスで始まるメッセージも受け取るかどうかです。
+    guild : Callable[[Cog, int], bool], optional
+        サーバーでこの機能が有効かどうかを返す関数です。
+        結果はキャッシュされるので、変わる際は`bot.router.invalidate`を呼んでください。
+    channel : Callable[[Cog, discord.abc.Messageable], bool], optional
+        チャンネルでこの機能が有効かどうかを返す関数です。
+        結果はキャッシュされ、チャンネルが更新された際に消されます。"""
+    def decorator(func):
+        func.__route__ = {
+            "bots": bots, "own": own, "dm": dm, "prefixed": prefixed,
+            "guild": guild, "channel": channel
+        }
+        return func
+    return decorator
+
+
+@dataclass
+class Route:
+    "`MessageRouter`に登録されたリスナーです。"
+
+    name: str
+    cog: commands.Cog
+    callback: Callable[[discord.Message], Any]
+    bots: bool
+    own: bool
+    dm: bool
+    prefixed: bool
+    guild: Optional[GuildCheck]
+    channel: Optional[ChannelCheck]
+    calls: int = 0
+    errors: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+
+@dataclass
+class Masks:
+    "条件毎の、その条件でも呼ばれるリスナーのビットマスクです。"
+
+    all: int = 0
+    bots: int = 0
+    own: int = 0
+    dm: int = 0
+    prefixed: int = 0
+    guild: int = 0
+    channel: int = 0
+    routes: list[Route] = field(default_factory=list)
+
+
+class MessageRouter(commands.Cog):
+    """`on_message`をコグ毎ではなく一度だけ受け取り、そのメッセージで呼ぶ必要のあるリスナーだけを呼ぶためのコグです。
+    `bot.router`からアクセスできます。
+    リスナーは`route`デコレータで登録します。
+    サーバー/チャンネル毎にどのリスナーが有効かをビットマップでキャッシュしています。
+    キャッシュは`invalidate`が呼ばれた時の他、念のため`RESET_INTERVAL`秒毎にも消されます。"""
+
+    RESET_INTERVAL = 60
+
+    def __init__(self, bot: RT):
+        self.bot = bot
+        self.masks = Masks()
+        self.guilds: dict[int, int] = {}
+        self.channels: dict[int, int] = {}
+        self.messages = self.scheduled = 0
+        bot.router = self
+        for cog in bot.cogs.values():
+            self.add(cog)
+        self._reset.start()
+
+    def add(self, cog: commands.Cog) -> None:
+        "コグにある`route`で装飾されたメソッドを登録します。"
+        routes = [
+            route for route in self.masks.routes
+            if route.cog.qualified_name != cog.qualified_name
+        ]
+        names = set()
+        for class_ in type(cog).__mro__:
+            for name, value in class_.__dict__.items():
+                if name not in names and hasattr(value, "__route__"):
+                    names.add(name)
+                    routes.append(Route(
+                        f"{cog.qualified_name}.{name}", cog, getattr(cog, name),
+                        **value.__route__
+                    ))
+        self._rebuild(routes)
+
+    def remove(self, cog: commands.Cog) -> None:
+        "コグのリスナーの登録を解除します。"
+        self._rebuild([route for route in self.masks.routes if route.cog is not cog])
+
+    def _rebuild(self, routes: list[Route]) -> None:
+        # ビットマスクを作り直す。
+        self.masks = masks = Masks(routes=routes)
+        for i, route in enumerate(routes):
+            bit = 1 << i
+            masks.all |= bit
+            for key in ("bots", "own", "dm", "prefixed"):
+                if getattr(route, key):
+                    setattr(masks, key, getattr(masks, key) | bit)
+            for key in ("guild", "channel"):
+                if getattr(route, key) is None:
+                    setattr(masks, key, getattr(masks, key) | bit)
+        self.invalidate()
+
+    def invalidate(self, guild_id: Optional[int] = None, channel_id: Optional[int] = None) -> None:
+        """キャッシュしているビットマップを削除します。
+        引数を指定しない場合は全て削除します。"""
+        if guild_id is None and channel_id is None:
+            self.guilds.clear()
+            self.channels.clear()
+        if guild_id is not None:
+            self.guilds.pop(guild_id, None)
+        if channel_id is not None:
+            self.channels.pop(channel_id, None)
+
+    def _check(self, route: Route, key: str, value: Any) -> bool:
+        try:
+            return getattr(route, key)(route.cog, value)
+        except Exception as e:
+            self.bot.print("[MessageRouter]", f"Failed to check {route.name}:", e)
+            return True
+
+    def _bitmap(self, cache: dict[int, int], key: str, id_: int, value: Any) -> int:
+        # サーバー/チャンネルでどのリスナーが有効かのビットマップを取得する。
+        if id_ not in cache:
+            bits = getattr(self.masks, key)
+            for i, route in enumerate(self.masks.routes):
+                if getattr(route, key) is not None and self._check(route, key, value):
+                    bits |= 1 << i
+            cache[id_] = bits
+        return cache[id_]
+
+    def select(self, message: discord.Message) -> list[Route]:
+        "メッセージで呼ぶ必要のあるリスナーを取得します。"
+        masks = self.masks
+        bits = masks.all
+        if message.guild is None:
+            bits &= masks.dm
+        else:
+            bits &= self._bitmap(self.guilds, "guild", message.guild.id, message.guild.id)
+            if bits & ~masks.channel:
+                bits &= self._bitmap(
+                    self.channels, "channel", message.channel.id, message.channel
+                )
+        if message.author.bot:
+            bits &= masks.bots
+            if self.bot.user and message.author.id == self.bot.user.id:
+                bits &= masks.own
+        if bits & ~masks.prefixed and message.content and self.bot.is_command(message):
+            bits &= masks.prefixed
+        return [route for i, route in enumerate(masks.routes) if bits >> i & 1]
+
+    async def _run(self, route: Route, message: discord.Message) -> None:
+        # リスナーを実行して、かかった時間を記録する。
+        start = perf_counter()
+        try:
+            await route.callback(message)
+        except Exception:
+            route.errors += 1
+            await self.bot.on_error(f"on_message ({route.name})", message)
+        finally:
+            elapsed = perf_counter() - start
+            route.calls += 1
+            route.total += elapsed
+            route.max = max(route.max, elapsed)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        self.messages += 1
+        routes = self.select(message)
+        self.scheduled += len(routes)
+        if len(routes) == 1:
+            await self._run(routes[0], message)
+        else:
+            for route in routes:
+                self.bot.loop.create_task(
+                    self._run(route, message), name=f"[MessageRouter] {route.name}"
+                )
+
+    def stats(self) -> list[Route]:
+        "登録されているリスナーを合計の実行時間が長い順で取得します。"
+        return sorted(self.masks.routes, key=lambda route: route.total, reverse=True)
+
+    @tasks.loop(seconds=RESET_INTERVAL)
+    async def _reset(self):
+        self.invalidate()
+
+    def cog_unload(self):
+        self._reset.cancel()
+
+    @commands.Cog.listener()
+    async def on_cog_add(self, cog: commands.Cog):
+        self.add(cog)
+
+    @commands.Cog.listener()
+    async def on_cog_remove(self, cog: commands.Cog):
+        self.remove(cog)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, _, after: discord.abc.GuildChannel):
+        self.invalidate(channel_id=after.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.invalidate(channel_id=channel.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.invalidate(guild.id)
+
+
+async def setup(bot):
+    await bot.add_cog(MessageRouter(bot))
@@ -0,0 +1,280 @@
+# Free RT Util - Scheduler
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable, Coroutine, Iterable, Optional, Any
+
+from asyncio import Event, Task, TimeoutError, wait_for
+from dataclasses import dataclass, field
+from heapq import heappush, heappop
+from itertools import count
+from time import time
+
+from discord.ext import commands
+
+from aiomysql import Cursor
+from ujson import loads, dumps
+
+from .data_manager import DatabaseManager
+
+if TYPE_CHECKING:
+    from .bot import RT
+
+
+Handler = Callable[[Any], Coroutine]
+
+
+@dataclass(eq=False)
+class Job:
+    "予約されている処理です。"
+
+    key: str
+    due: float
+    payload: Any = None
+    attempts: int = 0
+    kind: str = field(init=False)
+
+    def __post_init__(self):
+        self.kind = self.key.split(":", 1)[0]
+
+
+class Scheduler(commands.Cog, DatabaseManager):
+    """指定した時刻に処理を実行するためのコグです。`bot.scheduler`からアクセスできます。
+    予約はMySQLに保存されるので再起動しても消えず、処理が成功するまでは削除されません。(少なくとも一回は実行されます。)
+    `HORIZON`秒以内に実行するものだけをメモリ上のヒープに読み込んで、一番早いものの時刻まで待つので、
+    処理の量は保存されている予約の数ではなく実行するものの数に比例します。
+
+    予約のキーは`種類:ID`の形式で、種類毎に`register`で登録した関数がペイロードを引数にして呼ばれます。"""
+
+    HORIZON = 3600.0
+    "何秒先までの予約をメモリに読み込んでおくかです。"
+    RETRY_DELAY = 60.0
+    "処理に失敗した際に何秒後にもう一度実行するかです。失敗した回数だけ長くなります。"
+    MAX_ATTEMPTS = 5
+    "処理に何回失敗したら諦めるかです。"
+
+    def __init__(self, bot: RT):
+        self.bot = bot
+        self.pool = bot.mysql.pool
+        self.handlers: dict[str, Handler] = {}
+        self.jobs: dict[str, Job] = {}
+        self.heap: list[tuple[float, int, Job]] = []
+        # 処理する関数がまだ登録されていない種類の予約です。
+        self.waiting: dict[str, list[Job]] = {}
+        self.loaded_until = 0.0
+        # 削除中の予約と読み込み中にキャンセルされた予約のキーです。読み込んだ行にあっても実行しないようにする。
+        self._cancelling: set[str] = set()
+        self._cancelled: set[str] = set()
+        self._loading = False
+        self.fired = self.failed = self.dropped = 0
+        self._counter = count()
+        self._wakeup = Event()
+        self._runner: Optional[Task] = None
+        bot.scheduler = self
+
+    async def cog_load(self):
+        await self._prepare_table()
+        self._runner = self.bot.loop.create_task(self._run(), name="[Scheduler] Runner")
+
+    async def cog_unload(self):
+        if self._runner is not None:
+            self._runner.cancel()
+
+    async def _prepare_table(self, cursor: Cursor = None) -> None:
+        await cursor.execute(
+            """CREATE TABLE IF NOT EXISTS Scheduler (
+                JobKey VARCHAR(191) PRIMARY KEY NOT NULL, DueTime DOUBLE NOT NULL,
+                Payload JSON, Attempts INT NOT NULL DEFAULT 0, INDEX (DueTime)
+            );"""
+        )
+        await cursor.execute(
+            "CREATE TABLE IF NOT EXISTS SchedulerMigrations (Name VARCHAR(191) PRIMARY KEY NOT NULL);"
+        )
+
+    def register(self, kind: str, handler: Handler) -> None:
+        """予約の種類を処理する関数を登録します。
+        既に実行時刻を過ぎていて処理を待っていたものがあればすぐに実行されます。
+
+        Parameters
+        ----------
+        kind : str
+            予約のキーの`:`より前の部分です。
+        handler : Callable[[Any], Coroutine]
+            予約のペイロードを引数にして呼ばれるコルーチン関数です。
+            例外が発生した場合は時間をおいてもう一度呼ばれます。"""
+        self.handlers[kind] = handler
+        for job in self.waiting.pop(kind, ()):
+            if self.jobs.get(job.key) is job:
+                self._push(job, job.due)
+        self._wakeup.set()
+
+    def unregister(self, kind: str) -> None:
+        "予約の種類を処理する関数の登録を解除します。"
+        self.handlers.pop(kind, None)
+
+    def _push(self, job: Job, when: float) -> None:
+        # 予約をヒープに追加する。キャンセルや再予約されたものはヒープから取り出した時に無視する。
+        self.jobs[job.key] = job
+        heappush(self.heap, (when, next(self._counter), job))
+        if self.heap[0][2] is job:
+            self._wakeup.set()
+
+    async def at(
+        self, when: float, key: str, payload: Any = None, cursor: Cursor = None
+    ) -> None:
+        """指定した時刻に処理を予約します。同じキーの予約が既にある場合は上書きします。
+
+        Parameters
+        ----------
+        when : float
+            実行するUNIX時間です。
+        key : str
+            `種類:ID`の形式のキーです。キャンセルする際に使います。
+        payload : Any
+            処理する関数に渡す値です。JSONにできるものにしてください。"""
+        await cursor.execute(
+            """INSERT INTO Scheduler (JobKey, DueTime, Payload, Attempts) VALUES (%s, %s, %s, 0)
+                ON DUPLICATE KEY UPDATE DueTime = VALUES(DueTime), Payload = VALUES(Payload), Attempts = 0;""",
+            (key, when, dumps(payload))
+        )
+        if when <= self.loaded_until:
+            self._push(Job(key, when, payload), when)
+        else:
+            self.jobs.pop(key, None)
+
+    async def migrated(self, name: str, cursor: Cursor = None) -> bool:
+        "`migrate`で指定した名前の移行が既に終わっているかどうかを返します。"
+        await cursor.execute("SELECT 1 FROM SchedulerMigrations WHERE Name = %s;", (name,))
+        return bool(await cursor.fetchone())
+
+    async def migrate(
+        self, name: str, jobs: Iterable[tuple[float, str, Any]], cursor: Cursor = None
+    ) -> None:
+        """スケジューラーを使う前に保存されていたものをまとめて予約します。
+        同じキーの予約が既にある場合はそのままにし、終わった移行は`name`で記録されます。
+        `migrated`で移行が終わっていないか確認してから使ってください。
+
+        Parameters
+        ----------
+        name : str
+            移行の名前です。
+        jobs : Iterable[tuple[float, str, Any]]
+            `at`の引数の`(when, key, payload)`です。"""
+        if (jobs := list(jobs)):
+            await cursor.executemany(
+                "INSERT IGNORE INTO Scheduler (JobKey, DueTime, Payload) VALUES (%s, %s, %s);",
+                [(key, when, dumps(payload)) for when, key, payload in jobs]
+            )
+            for when, key, payload in jobs:
+                if when <= self.loaded_until and key not in self.jobs:
+                    self._push(Job(key, when, payload), when)
+        await cursor.execute("INSERT IGNORE INTO SchedulerMigrations VALUES (%s);", (name,))
+
+    async def later(self, delay: float, key: str, payload: Any = None) -> None:
+        "指定した秒数後に処理を予約します。`at`と同じです。"
+        await self.at(time() + delay, key, payload)
+
+    async def cancel(self, key: str, cursor: Cursor = None) -> None:
+        "予約をキャンセルします。"
+        self.jobs.pop(key, None)
+        self._cancelling.add(key)
+        if self._loading:
+            self._cancelled.add(key)
+        try:
+            await cursor.execute("DELETE FROM Scheduler WHERE JobKey = %s;", (key,))
+        finally:
+            self._cancelling.discard(key)
+
+    async def _load(self, until: float, cursor: Cursor = None) -> None:
+        # 指定した時刻までに実行する予約を読み込む。
+        # 読み込み中に`at`で予約されたものもメモリに入るように先に時刻を更新しておく。
+        # また、読み込み中にキャンセルされたものが読み込んだ行に残っていても実行しないように、そのキーを記録しておく。
+        self.loaded_until = until
+        self._loading = True
+        try:
+            await cursor.execute(
+                "SELECT JobKey, DueTime, Payload, Attempts FROM Scheduler WHERE DueTime <= %s;",
+                (until,)
+            )
+            for key, due, payload, attempts in await cursor.fetchall():
+                if key not in self.jobs and key not in self._cancelling and key not in self._cancelled:
+                    self._push(Job(key, due, loads(payload) if payload else None, attempts), due)
+        finally:
+            self._loading = False
+            self._cancelled.clear()
+
+    async def _done(self, job: Job, cursor: Cursor = None) -> None:
+        # 処理が終わった予約を削除する。処理中に再予約されていた場合は消さない。
+        await cursor.execute(
+            "DELETE FROM Scheduler WHERE JobKey = %s AND DueTime = %s;", (job.key, job.due)
+        )
+
+    async def _retry(self, job: Job, cursor: Cursor = None) -> None:
+        # 処理に失敗した予約を後でもう一度実行するようにする。
+        job.attempts += 1
+        due, job.due = job.due, time() + self.RETRY_DELAY * job.attempts
+        await cursor.execute(
+            "UPDATE Scheduler SET DueTime = %s, Attempts = %s WHERE JobKey = %s AND DueTime = %s;",
+            (job.due, job.attempts, job.key, due)
+        )
+        if self.jobs.get(job.key) is job:
+            self._push(job, job.due)
+
+    async def _fire(self, job: Job) -> None:
+        # 予約を実行する。
+        try:
+            await self.handlers[job.kind](job.payload)
+        except Exception as e:
+            self.failed += 1
+            self.bot.print("[Scheduler]", f"Failed to run {job.key}:", e)
+            if job.attempts + 1 < self.MAX_ATTEMPTS:
+                return await self._retry(job)
+            self.dropped += 1
+            self.bot.print("[Scheduler]", f"Dropped {job.key} after {self.MAX_ATTEMPTS} attempts.")
+        else:
+            self.fired += 1
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        await self._done(job)
+
+    async def _run(self) -> None:
+        while True:
+            now = time()
+            if now + self.HORIZON / 2 > self.loaded_until:
+                try:
+                    await self._load(now + self.HORIZON)
+                except Exception as e:
+                    self.bot.print("[Scheduler]", "Failed to load jobs:", e)
+                    # 読み込めなかった予約は次に読み込めた時に実行されるので、少し待ってからもう一度読み込む。
+                    self.loaded_until = now + self.HORIZON / 2 + self.RETRY_DELAY
+            # 実行時刻になったものを実行する。
+            while self.heap and self.heap[0][0] <= now:
+                _, _, job = heappop(self.heap)
+                if self.jobs.get(job.key) is not job:
+                    continue
+                if job.kind not in self.handlers:
+                    self.waiting.setdefault(job.kind, []).append(job)
+                    continue
+                self.bot.loop.create_task(self._fire(job), name=f"[Scheduler] Fire: {job.key}")
+            # 次の予約の時刻か、次の読み込みの時刻まで待つ。
+            self._wakeup.clear()
+            timeout = self.loaded_until - self.HORIZON / 2 - now
+            if self.heap:
+                timeout = min(timeout, self.heap[0][0] - now)
+            try:
+                await wait_for(self._wakeup.wait(), max(timeout, 0))
+            except TimeoutError:
+                ...
+
+    def metrics(self) -> dict[str, Any]:
+        "スケジューラーの状態を返します。"
+        return {
+            "loaded": len(self.jobs), "heap": len(self.heap),
+            "waiting": sum(map(len, self.waiting.values())),
+            "fired": self.fired, "failed": self.failed, "dropped": self.dropped,
+            "next": self.heap[0][0] - time() if self.heap else None
+        }
+
+
+async def setup(bot):
+    await bot.add_cog(Scheduler(bot))
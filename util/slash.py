@@ -387,7 +387,7 @@ class SlashManager(commands.Cog):
                         and command.name == interaction.data["options"][0]["name"]):
                     # コマンドのメッセージの内容を作る。
                     data = interaction.data["options"][0]
-                    content = f"{self.bot.command_prefix[0]}{data['name']}"
+                    content = f"{self.bot.get_prefixes()[0]}{data['name']}"
                     while "options" in data:
                         if not data["options"]:
                             break
@@ -470,8 +470,8 @@ class SlashManager(commands.Cog):
         if "command " in content:
             await ctx.reply("使えないワードがあります。")
         else:
-            if not content.startswith(tuple(self.bot.command_prefix)):
-                content = f"{self.bot.command_prefix[0]}{content}"
+            if not content.startswith(self.bot.get_prefixes()):
+                content = f"{self.bot.get_prefixes()[0]}{content}"
             ctx.content = content
             await self.bot.process_commands(ctx)
 
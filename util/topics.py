@@ -0,0 +1,119 @@
+# Free RT Util - Topic Index
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional, Union
+
+from discord.ext import commands
+import discord
+
+if TYPE_CHECKING:
+    from .bot import RT
+
+
+Guild = Union[discord.Guild, int]
+
+
+class TopicIndex(commands.Cog):
+    """チャンネルのトピックにある`rt>xxx`や`rf>xxx`のような設定をサーバー毎に索引するためのコグです。
+    `bot.topics`からアクセスできます。
+    索引はサーバー毎に初めて使われた時に作られ、チャンネルの作成/更新/削除のイベントで更新されます。
+    設定は`rt>star3`のように後ろに引数が続くことがあるので、索引する設定の名前を決めておき前方一致で調べます。"""
+
+    # 索引する設定の名前です。`get`で他の設定が使われた場合は追加されます。
+    DIRECTIVES = ("rt>star", "rt>automod", "rf>log")
+    # トピックではなくチャンネルの名前で設定するものです。
+    NAME_MARKERS = ("log-rt",)
+
+    def __init__(self, bot: RT):
+        self.bot = bot
+        self.directives = set(self.DIRECTIVES)
+        # サーバーID: {設定: {チャンネルID: チャンネル}}
+        self.index: dict[int, dict[str, dict[int, discord.TextChannel]]] = {}
+        bot.topics = self
+
+    def _get_guild(self, guild: Guild) -> Optional[discord.Guild]:
+        return self.bot.get_guild(guild) if isinstance(guild, int) else guild
+
+    def _directives(self, channel: discord.TextChannel) -> set[str]:
+        # チャンネルにある設定を全て取り出す。
+        directives = {
+            directive for directive in self.directives if directive in channel.topic
+        } if channel.topic else set()
+        for marker in self.NAME_MARKERS:
+            if marker in channel.name:
+                directives.add(marker)
+        return directives
+
+    def _add(self, index: dict, channel: discord.TextChannel) -> None:
+        for directive in self._directives(channel):
+            index.setdefault(directive, {})[channel.id] = channel
+
+    def _remove(self, index: dict, channel_id: int) -> None:
+        for directive in list(index.keys()):
+            if index[directive].pop(channel_id, None) is not None \
+                    and not index[directive]:
+                del index[directive]
+
+    def _build(self, guild: discord.Guild) -> dict[str, dict[int, discord.TextChannel]]:
+        # サーバーの索引を作る。
+        self.index[guild.id] = index = {}
+        for channel in guild.text_channels:
+            self._add(index, channel)
+        return index
+
+    def get(self, guild: Guild, directive: str) -> list[discord.TextChannel]:
+        """指定された設定がされているチャンネルをチャンネルの並び順で取得します。
+
+        Parameters
+        ----------
+        guild : Union[discord.Guild, int]
+            対象のサーバーです。
+        directive : str
+            `rt>automod`のような設定の名前です。引数は含めないでください。"""
+        if (guild := self._get_guild(guild)) is None:
+            return []
+        if directive not in self.directives and directive not in self.NAME_MARKERS:
+            # 知らない設定の場合は追加して索引を作り直す。
+            self.directives.add(directive)
+            self.index.clear()
+        index = self.index[guild.id] if guild.id in self.index else self._build(guild)
+        return sorted(index.get(directive, {}).values(), key=lambda ch: ch.position)
+
+    def first(self, guild: Guild, directive: str) -> Optional[discord.TextChannel]:
+        "指定された設定がされているチャンネルで一番上にあるものを取得します。"
+        return channels[0] if (channels := self.get(guild, directive)) else None
+
+    @staticmethod
+    def argument(channel: discord.TextChannel, directive: str) -> str:
+        "チャンネルのトピックにある設定の後ろに書かれている文字列をその行の終わりまで取得します。"
+        if not channel.topic or (index := channel.topic.find(directive)) == -1:
+            return ""
+        return channel.topic[index + len(directive):].split("\n", 1)[0].strip()
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        if isinstance(channel, discord.TextChannel) and channel.guild.id in self.index:
+            self._add(self.index[channel.guild.id], channel)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(
+        self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel
+    ):
+        if isinstance(after, discord.TextChannel) and after.guild.id in self.index \
+                and (getattr(before, "topic", None) != after.topic or before.name != after.name):
+            self._remove(self.index[after.guild.id], after.id)
+            self._add(self.index[after.guild.id], after)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        if channel.guild.id in self.index:
+            self._remove(self.index[channel.guild.id], channel.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.index.pop(guild.id, None)
+
+
+async def setup(bot):
+    await bot.add_cog(TopicIndex(bot))
@@ -1,15 +1,75 @@
 # Free RT Util - webhooks
 
+from __future__ import annotations
+
+from typing import Optional
+
+from asyncio import Task, create_task
+
 import discord
 from discord.ext import commands
-from typing import Optional
+
+
+class WebhookRegistry:
+    """チャンネルのウェブフックをチャンネルIDと名前でキャッシュするためのクラスです。
+    同じチャンネルのウェブフックの取得が同時に要求された場合は一度だけ取得します。"""
+
+    def __init__(self):
+        self.webhooks: dict[int, dict[str, discord.Webhook]] = {}
+        self._fetching: dict[int, Task] = {}
+        self.hits = self.misses = 0
+
+    async def _fetch(self, channel):
+        # チャンネルのウェブフックを全て取得してキャッシュする。トークンがあるものを優先する。
+        webhooks = {}
+        for webhook in await channel.webhooks():
+            if webhook.name not in webhooks or (
+                webhook.token and not webhooks[webhook.name].token
+            ):
+                webhooks[webhook.name] = webhook
+        self.webhooks[channel.id] = webhooks
+
+    async def _get_all(self, channel) -> dict[str, discord.Webhook]:
+        # チャンネルのウェブフックを取得する。キャッシュにない場合はチャンネルのウェブフックを取得する。
+        if channel.id in self.webhooks:
+            self.hits += 1
+            return self.webhooks[channel.id]
+        self.misses += 1
+        if channel.id not in self._fetching:
+            self._fetching[channel.id] = create_task(
+                self._fetch(channel), name=f"[WebhookRegistry] Fetch: {channel.id}"
+            )
+            self._fetching[channel.id].add_done_callback(
+                lambda _: self._fetching.pop(channel.id, None)
+            )
+        await self._fetching[channel.id]
+        return self.webhooks.get(channel.id, {})
+
+    async def get(self, channel, name: str) -> Optional[discord.Webhook]:
+        "ウェブフックを取得します。キャッシュにない場合はチャンネルのウェブフックを取得します。"
+        return (await self._get_all(channel)).get(name)
+
+    async def find(self, channel, webhook_id: int) -> Optional[discord.Webhook]:
+        "IDからウェブフックを取得します。キャッシュにない場合はチャンネルのウェブフックを取得します。"
+        return discord.utils.get((await self._get_all(channel)).values(), id=webhook_id)
+
+    def set(self, channel_id: int, webhook: discord.Webhook) -> None:
+        "ウェブフックをキャッシュに追加します。"
+        self.webhooks.setdefault(channel_id, {})[webhook.name] = webhook
+
+    def invalidate(self, channel_id: int) -> None:
+        "チャンネルのウェブフックのキャッシュを削除します。"
+        self.webhooks.pop(channel_id, None)
+
+
+registry = WebhookRegistry()
 
 
 async def get_webhook(
     channel: discord.TextChannel, name: str = "RT-Tool"
 ) -> Optional[discord.Webhook]:
     "ウェブフックを取得します。"
-    return discord.utils.get(await channel.webhooks(), name=name)
+    return await registry.get(channel, name)
 
 
 async def webhook_send(
@@ -29,12 +89,21 @@ async def webhook_send(
         discord.pyのWebhook.sendに入れるキーワード引数です。"""
     if isinstance(channel, commands.Context):
         channel = channel.channel
-    wb = (
-        wb if (
-            wb := discord.utils.get(await channel.webhooks(), name=webhook_name)
-        ) else await channel.create_webhook(name=webhook_name))
+    if (wb := await registry.get(channel, webhook_name)) is None:
+        wb = await channel.create_webhook(name=webhook_name)
+        registry.set(channel.id, wb)
     try:
         return await wb.send(*args, **kwargs)
+    except discord.NotFound:
+        # ウェブフックが削除されていた場合はキャッシュを消してもう一度試す。
+        registry.invalidate(channel.id)
+        if kwargs.get("file") or kwargs.get("files"):
+            # 送信に失敗してもファイルは閉じられてしまい、もう一度送ることはできないので諦める。
+            raise
+        if (wb := await registry.get(channel, webhook_name)) is None:
+            wb = await channel.create_webhook(name=webhook_name)
+            registry.set(channel.id, wb)
+        return await wb.send(*args, **kwargs)
     except ValueError as e:
         if webhook_name == "free-RT-Tool":
             return await webhook_send(channel, *args, webhook_name="free-R2-Tool", **kwargs)
@@ -42,3 +111,23 @@ async def webhook_send(
             return await webhook_send(channel, *args, webhook_name="free-R3-Tool", **kwargs)
         else:
             raise e
+
+
+class WebhookCache(commands.Cog):
+    "ウェブフックが変更された際にキャッシュを削除するためのコグです。"
+
+    def __init__(self, bot):
+        self.bot = bot
+        bot.webhooks = registry
+
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel):
+        registry.invalidate(channel.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        registry.invalidate(channel.id)
+
+
+async def setup(bot):
+    await bot.add_cog(WebhookCache(bot))